@@ -0,0 +1,113 @@
+"""
+Benchmark decoding Hydra client listings with and without HYDRA_RAW_RESPONSES.
+
+Serves a canned page of clients through a stub HTTP transport, so only the
+client-side work is measured: decoding the response with ory_client models
+or into HydraClientRecords, then converting every client with
+OAuth2Client.from_hydra_client as the list and sync paths do.
+
+Usage:
+    python benchmarks/client_listing.py [--clients 500] [--seconds 3]
+"""
+
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ory_auth.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+from ory_client.rest import RESTClientObject, RESTResponse  # noqa: E402
+
+from hydra_auth.hydra_client import HydraClient  # noqa: E402
+from hydra_auth.models import OAuth2Client  # noqa: E402
+from hydra_auth.records import loads  # noqa: E402
+
+
+class StubResponse:
+    def __init__(self, data):
+        self.status = 200
+        self.reason = 'OK'
+        self.data = data
+        self.headers = {'content-type': 'application/json'}
+
+    def release_conn(self):
+        pass
+
+
+def make_page(count):
+    return json.dumps([{
+        'client_id': f'client-{i}',
+        'client_name': f'Client {i}',
+        'redirect_uris': [f'https://app{i}.example.com/callback', f'https://app{i}.example.com/silent'],
+        'grant_types': ['authorization_code', 'refresh_token'],
+        'response_types': ['code'],
+        'scope': 'openid profile email offline_access',
+        'audience': [f'https://api{i}.example.com'],
+        'owner': '',
+        'policy_uri': '',
+        'tos_uri': '',
+        'client_uri': f'https://app{i}.example.com',
+        'logo_uri': '',
+        'contacts': [f'ops{i}@example.com'],
+        'client_secret_expires_at': 0,
+        'subject_type': 'public',
+        'jwks': {},
+        'token_endpoint_auth_method': 'client_secret_basic',
+        'userinfo_signed_response_alg': 'none',
+        'created_at': '2024-01-01T00:00:00Z',
+        'updated_at': '2024-01-01T00:00:00Z',
+        'metadata': {},
+        'skip_consent': False,
+        'skip_logout_consent': None,
+        'authorization_code_grant_access_token_lifespan': None,
+    } for i in range(count)]).encode('utf-8')
+
+
+def run(hydra_client, convert, seconds):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        clients = hydra_client.list_oauth2_clients(limit=500)
+        if convert:
+            for client in clients:
+                OAuth2Client.from_hydra_client(client)
+        count += 1
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    page = make_page(args.clients)
+
+    def request(rest_client, method, url, headers=None, body=None, post_params=None, _request_timeout=None):
+        return RESTResponse(StubResponse(page))
+
+    RESTClientObject.request = request
+    model_client = HydraClient()
+    with override_settings(HYDRA_RAW_RESPONSES=True):
+        raw_client = HydraClient()
+
+    print(f"{args.clients} clients per page, {len(page) / 1024:.0f} KiB, decoder {loads.__module__}")
+    for label, convert in (('list', False), ('list + from_hydra_client', True)):
+        model_time = run(model_client, convert, args.seconds)
+        raw_time = run(raw_client, convert, args.seconds)
+        print(f"{label:26s} models {model_time * 1000:8.2f} ms   raw {raw_time * 1000:8.2f} ms   "
+              f"{model_time / raw_time:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
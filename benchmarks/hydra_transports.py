@@ -0,0 +1,200 @@
+"""
+Benchmark login and consent round trips over the Hydra transports.
+
+Starts a stub Hydra admin API on TCP (HTTP/1.1), on a Unix domain socket
+and on TCP with cleartext HTTP/2 (h2c, needs the h2 package), then times
+the two Hydra calls of a login (get + accept login request) and of a consent
+(get + accept consent request) through HydraClient on each transport, one
+at a time and from several threads at once.
+
+Usage:
+    python benchmarks/hydra_transports.py [--seconds 3] [--threads 8]
+"""
+
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ory_auth.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from hydra_auth.hydra_client import HydraClient  # noqa: E402
+
+CLIENT = {'client_id': 'bench-client', 'client_name': 'Bench', 'scope': 'openid profile'}
+LOGIN_REQUEST = json.dumps({
+    'challenge': 'login', 'client': CLIENT, 'request_url': 'http://hydra/oauth2/auth',
+    'requested_scope': ['openid'], 'requested_access_token_audience': [], 'skip': False, 'subject': '',
+}).encode('utf-8')
+CONSENT_REQUEST = json.dumps({
+    'challenge': 'consent', 'client': CLIENT, 'requested_scope': ['openid', 'profile'],
+    'requested_access_token_audience': [], 'skip': False, 'subject': 'bench-user',
+}).encode('utf-8')
+REDIRECT = json.dumps({'redirect_to': 'http://hydra/oauth2/auth?login_verifier=v'}).encode('utf-8')
+
+
+def respond(method, path):
+    if method == 'GET' and path.startswith('/admin/oauth2/auth/requests/login?'):
+        return LOGIN_REQUEST
+    if method == 'GET' and path.startswith('/admin/oauth2/auth/requests/consent?'):
+        return CONSENT_REQUEST
+    return REDIRECT
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = respond(self.command, self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        # Headers and body in one write, like Hydra
+        self._headers_buffer.append(b'\r\n')
+        self._headers_buffer.append(body)
+        self.flush_headers()
+
+    do_GET = do_PUT = _handle
+
+    def address_string(self):
+        return 'stub'
+
+    def log_message(self, *args):
+        pass
+
+
+class TCPStubHandler(StubHandler):
+    # Hydra's Go server sets TCP_NODELAY too
+    disable_nagle_algorithm = True
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve_h2c(sock):
+    """
+    Minimal cleartext HTTP/2 server answering like StubHandler.
+    """
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    def handle(conn_sock):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        conn_sock.sendall(conn.data_to_send())
+        requests = {}
+        while True:
+            data = conn_sock.recv(65536)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    requests[event.stream_id] = (headers[b':method'].decode(), headers[b':path'].decode())
+                elif isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    body = respond(*requests.pop(event.stream_id))
+                    conn.send_headers(event.stream_id, [
+                        (':status', '200'), ('content-type', 'application/json'), ('content-length', str(len(body))),
+                    ])
+                    conn.send_data(event.stream_id, body, end_stream=True)
+            conn_sock.sendall(conn.data_to_send())
+
+    while True:
+        conn_sock, _ = sock.accept()
+        conn_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=handle, args=(conn_sock,), daemon=True).start()
+
+
+def login_round_trip(hydra_client):
+    hydra_client.get_login_request.__wrapped__(hydra_client, 'login')
+    hydra_client.accept_login_request('login', 'bench-user')
+
+
+def consent_round_trip(hydra_client):
+    hydra_client.get_consent_request.__wrapped__(hydra_client, 'consent')
+    hydra_client.accept_consent_request('consent', ['openid'])
+
+
+def measure(hydra_client, round_trip, seconds, threads):
+    round_trip(hydra_client)
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        round_trip(hydra_client)
+        latencies.append(time.perf_counter() - start)
+
+    counts = [0] * threads
+
+    def worker(index):
+        while time.perf_counter() < deadline:
+            round_trip(hydra_client)
+            counts[index] += 1
+
+    deadline = time.perf_counter() + seconds
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    latencies.sort()
+    return (statistics.median(latencies), latencies[int(len(latencies) * 0.99)], sum(counts) / seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    tcp = ThreadingHTTPServer(('127.0.0.1', 0), TCPStubHandler)
+    threading.Thread(target=tcp.serve_forever, daemon=True).start()
+    urls = {'http (urllib3, TCP)': f'http://127.0.0.1:{tcp.server_address[1]}'}
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'hydra-admin.sock')
+    uds = UnixHTTPServer(socket_path, StubHandler)
+    threading.Thread(target=uds.serve_forever, daemon=True).start()
+    urls['http+unix (Unix socket)'] = f"http+unix://{quote(socket_path, safe='')}"
+
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("h2 is not installed, skipping h2c")
+    else:
+        h2_sock = socket.socket()
+        h2_sock.bind(('127.0.0.1', 0))
+        h2_sock.listen(128)
+        threading.Thread(target=serve_h2c, args=(h2_sock,), daemon=True).start()
+        urls['h2c (HTTP/2, TCP)'] = f'h2c://127.0.0.1:{h2_sock.getsockname()[1]}'
+
+    print(f"{'transport':26s} {'flow':8s} {'p50':>9s} {'p99':>9s} {f'{args.threads} threads':>16s}")
+    for label, url in urls.items():
+        hydra_client = HydraClient(url, url, cluster='bench')
+        for flow, round_trip in (('login', login_round_trip), ('consent', consent_round_trip)):
+            p50, p99, throughput = measure(hydra_client, round_trip, args.seconds, args.threads)
+            print(f"{label:26s} {flow:8s} {p50 * 1e6:7.0f}us {p99 * 1e6:7.0f}us {throughput:10,.0f} flows/s")
+
+
+if __name__ == '__main__':
+    main()
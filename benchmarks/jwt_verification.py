@@ -0,0 +1,98 @@
+"""
+Benchmark offline JWT access-token verification.
+
+Generates a throwaway RSA key, serves it through a stub JWKS source and
+measures how many tokens a single thread (one core) can verify per second.
+
+Usage:
+    python benchmarks/jwt_verification.py [--bits 2048] [--seconds 3]
+"""
+
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ory_auth.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import ory_client  # noqa: E402
+from cryptography.hazmat.primitives import hashes  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import padding  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+from hydra_auth.jwt_verifier import JWKSCache, JWTVerifier  # noqa: E402
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64_int(value):
+    return _b64(value.to_bytes((value.bit_length() + 7) // 8, 'big'))
+
+
+def sign(claims, private_key, kid):
+    header = _b64(json.dumps({'alg': 'RS256', 'kid': kid, 'typ': 'JWT'}).encode())
+    payload = _b64(json.dumps(claims).encode())
+    signing_input = f'{header}.{payload}'.encode('ascii')
+    signature = private_key.sign(signing_input, padding.PKCS1v15(), hashes.SHA256())
+    return f'{header}.{payload}.{_b64(signature)}'
+
+
+class StubJWKSSource:
+    def __init__(self, public_key, kid):
+        numbers = public_key.public_numbers()
+        n, e = numbers.n, numbers.e
+        self.key_set = ory_client.JsonWebKeySet(keys=[
+            ory_client.JsonWebKey(kty='RSA', use='sig', alg='RS256', kid=kid, n=_b64_int(n), e=_b64_int(e)),
+        ])
+
+    def get_json_web_keys(self):
+        return self.key_set
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bits', type=int, default=2048)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    kid = hashlib.sha256(os.urandom(8)).hexdigest()[:16]
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=args.bits)
+    issuer = 'http://localhost:4444'
+    token = sign({
+        'iss': issuer + '/',
+        'sub': 'bench-user',
+        'client_id': 'bench-client',
+        'scp': ['openid', 'offline'],
+        'exp': int(time.time()) + 3600,
+        'iat': int(time.time()),
+    }, private_key, kid)
+
+    verifier = JWTVerifier(jwks=JWKSCache(StubJWKSSource(private_key.public_key(), kid)), issuer=issuer)
+    verifier.verify(token)
+
+    count = 0
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            verifier.verify(token)
+        count += 100
+    elapsed = time.perf_counter() - start
+
+    print(f"RSA-{args.bits} RS256: {count / elapsed:,.0f} verifications/second on one core "
+          f"({elapsed / count * 1e6:.1f} us each)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,39 @@
+import os
+
 from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
 
+from . import metrics, outbox
+from .executors import ExecutorOverloaded, get_revocation_executor
 from .forms import OAuth2ClientAdminForm
-from .hydra_client import HydraClient
-from .models import OAuth2Client
+from .models import AuditEvent, HydraOutboxEntry, OAuth2Client, RequestProfile
+from .pagination import EstimatedCountPaginator
+from .profiling import get_profile_dir
+from .revocation import revoke_client_consent, revoke_user_sessions
+from .rotation import (SecretExportWriter, get_export_dir, rotatable_clients,
+                       stage_rotation)
+from .routing import get_router
+
+
+class LeanChangeList(ChangeList):
+    """
+    ChangeList that loads only the columns shown on the page.
+    """
+    
+    def get_results(self, request):
+        # Only the page query is narrowed, actions still get full rows
+        columns = {field.name for field in self.model._meta.concrete_fields}
+        fields = [name for name in self.list_display if name in columns]
+        self.queryset = self.queryset.only(*fields)
+        super().get_results(request)
 
 
 class OAuth2ClientAdmin(admin.ModelAdmin):
@@ -11,6 +42,10 @@ class OAuth2ClientAdmin(admin.ModelAdmin):
     search_fields = ('client_id', 'client_name')
     list_filter = ('token_endpoint_auth_method', 'allow_cors_requests')
     readonly_fields = ('created_at', 'updated_at')
+    ordering = ('-created_at',)
+    # Large tables are paginated on estimated counts and never counted in full
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {
             'fields': ('client_id', 'client_name', 'client_secret')
@@ -31,6 +66,10 @@ class OAuth2ClientAdmin(admin.ModelAdmin):
             'fields': ('client_uri', 'logo_uri', 'tos_uri', 'policy_uri', 'jwks_uri'),
             'classes': ('collapse',)
         }),
+        ('Remember Policy', {
+            'fields': OAuth2Client.POLICY_FIELDS,
+            'description': "How long Hydra remembers logins and consents for this client, so later ones skip the page"
+        }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -39,52 +78,48 @@ class OAuth2ClientAdmin(admin.ModelAdmin):
     
     def save_model(self, request, obj, form, change):
         """
-        Override save_model to synchronize with Hydra when saving from admin.
+        Override save_model to queue the matching Hydra write in the same transaction.
         """
-        hydra_client = HydraClient()
-        client_data = obj.to_hydra_dict()
+        if change and obj.is_synced():
+            policy_changes = [field for field in form.changed_data if field in OAuth2Client.POLICY_FIELDS]
+            if policy_changes:
+                # Only this app reads the policy, Hydra has nothing to apply
+                obj.save(update_fields=policy_changes + ['updated_at'])
+                messages.success(request, f"Remember policy of client '{obj.client_name}' updated.")
+                return
+            # Nothing changed since the last sync, skip both Hydra and the DB
+            metrics.increment('hydra_client_writes_skipped', source='admin')
+            messages.info(request, f"No changes detected for client '{obj.client_name}'.")
+            return
         
-        if change:  # Update existing client
-            hydra_response = hydra_client.update_oauth2_client(obj.client_id, client_data)
-            if hydra_response:
-                super().save_model(request, obj, form, change)
-                messages.success(request, f"Client '{obj.client_name}' updated successfully in Hydra.")
-            else:
-                messages.error(request, f"Failed to update client '{obj.client_name}' in Hydra.")
-        else:  # Create new client
-            hydra_response = hydra_client.create_oauth2_client(client_data)
-            if hydra_response:
-                # Update with generated ID and secret if needed
-                obj.client_id = hydra_response.client_id
-                obj.client_secret = hydra_response.client_secret
-                super().save_model(request, obj, form, change)
-                messages.success(request, f"Client '{obj.client_name}' created successfully in Hydra.")
-            else:
-                messages.error(request, f"Failed to create client '{obj.client_name}' in Hydra.")
+        operation = HydraOutboxEntry.OPERATION_UPDATE if change else HydraOutboxEntry.OPERATION_CREATE
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            outbox.enqueue(obj.client_id, operation)
+        messages.success(request, f"Client '{obj.client_name}' queued for synchronization with Hydra.")
     
     def delete_model(self, request, obj):
         """
-        Override delete_model to synchronize with Hydra when deleting from admin.
+        Override delete_model to queue the Hydra deletion in the same transaction.
         """
-        hydra_client = HydraClient()
-        if hydra_client.delete_oauth2_client(obj.client_id):
+        with transaction.atomic():
             super().delete_model(request, obj)
-            messages.success(request, f"Client '{obj.client_name}' deleted successfully from Hydra.")
-        else:
-            messages.error(request, f"Failed to delete client '{obj.client_name}' from Hydra.")
+            outbox.enqueue(obj.client_id, HydraOutboxEntry.OPERATION_DELETE, obj.hydra_cluster)
+        messages.success(request, f"Client '{obj.client_name}' queued for deletion from Hydra.")
     
     def delete_queryset(self, request, queryset):
         """
-        Override delete_queryset to synchronize with Hydra when bulk deleting from admin.
+        Override delete_queryset to queue the Hydra deletions in the same transaction.
         """
-        hydra_client = HydraClient()
-        for obj in queryset:
-            if hydra_client.delete_oauth2_client(obj.client_id):
-                messages.success(request, f"Client '{obj.client_name}' deleted successfully from Hydra.")
-            else:
-                messages.error(request, f"Failed to delete client '{obj.client_name}' from Hydra.")
-        
-        super().delete_queryset(request, queryset)
+        with transaction.atomic():
+            clusters = dict(queryset.values_list('client_id', 'hydra_cluster'))
+            client_ids = list(clusters)
+            super().delete_queryset(request, queryset)
+            outbox.enqueue_many(client_ids, HydraOutboxEntry.OPERATION_DELETE, clusters)
+        messages.success(request, f"{len(client_ids)} client(s) queued for deletion from Hydra.")
+    
+    def get_changelist(self, request, **kwargs):
+        return LeanChangeList
     
     def get_readonly_fields(self, request, obj=None):
         """
@@ -98,28 +133,205 @@ class OAuth2ClientAdmin(admin.ModelAdmin):
         """
         Custom admin action to synchronize selected clients with Hydra.
         """
-        hydra_client = HydraClient()
-        success_count = 0
-        error_count = 0
+        changed_ids = {HydraOutboxEntry.OPERATION_CREATE: [], HydraOutboxEntry.OPERATION_UPDATE: []}
+        skipped_count = 0
         
         for obj in queryset:
-            client_data = obj.to_hydra_dict()
-            hydra_response = hydra_client.update_oauth2_client(obj.client_id, client_data)
-            
-            if hydra_response:
-                success_count += 1
+            if obj.is_synced():
+                skipped_count += 1
+            elif obj.hydra_state:
+                changed_ids[HydraOutboxEntry.OPERATION_UPDATE].append(obj.client_id)
             else:
-                error_count += 1
+                # Never created in Hydra, an update would only get a 404
+                changed_ids[HydraOutboxEntry.OPERATION_CREATE].append(obj.client_id)
         
-        if success_count > 0:
-            messages.success(request, f"Successfully synchronized {success_count} client(s) with Hydra.")
+        if skipped_count > 0:
+            metrics.increment('hydra_client_writes_skipped', skipped_count, source='admin_sync')
+            messages.info(request, f"{skipped_count} client(s) already up to date with Hydra.")
         
-        if error_count > 0:
-            messages.error(request, f"Failed to synchronize {error_count} client(s) with Hydra.")
+        queued_count = 0
+        for operation, client_ids in changed_ids.items():
+            if client_ids:
+                outbox.enqueue_many(client_ids, operation)
+                queued_count += len(client_ids)
+        if queued_count:
+            messages.success(request, f"Queued {queued_count} client(s) for synchronization with Hydra.")
     
     sync_with_hydra.short_description = "Synchronize selected clients with Hydra"
     
-    actions = ['sync_with_hydra']
+    def revoke_client_sessions(self, request, queryset):
+        """
+        Custom admin action to delete the tokens of selected clients and
+        revoke the consent users granted them.
+
+        Tokens are deleted right away, with one Hydra call per client. The
+        consent sessions take one call per user and client, so they are
+        revoked in the background.
+        """
+        router = get_router()
+        executor = get_revocation_executor()
+        for obj in queryset:
+            hydra_client = router.for_client(obj)
+            if not hydra_client.delete_oauth2_tokens(obj.client_id):
+                messages.error(request, f"Failed to delete tokens of client '{obj.client_name}'.")
+                continue
+            
+            try:
+                executor.submit(revoke_client_consent, obj.client_id, hydra_client)
+            except ExecutorOverloaded:
+                messages.warning(
+                    request,
+                    f"Deleted tokens of client '{obj.client_name}', but too many revocations are running. "
+                    f"Revoke its consent sessions with: manage.py revoke_hydra_sessions --client {obj.client_id}",
+                )
+                continue
+            messages.success(
+                request,
+                f"Deleted tokens of client '{obj.client_name}', its consent sessions are being revoked.",
+            )
+    
+    revoke_client_sessions.short_description = "Revoke tokens and consent sessions of selected clients"
+    
+    def rotate_client_secrets(self, request, queryset):
+        """
+        Custom admin action to stage new secrets for selected clients. They
+        are written to an encrypted export and become active in Hydra after
+        the rotation grace period.
+        """
+        try:
+            path = os.path.join(get_export_dir(), f"client-secrets-{timezone.now():%Y%m%d%H%M%S}.enc")
+            export = SecretExportWriter(path)
+        except ImproperlyConfigured as e:
+            messages.error(request, str(e))
+            return
+        except OSError as e:
+            messages.error(request, f"Cannot write the secret export: {e}")
+            return
+        with export:
+            staged = stage_rotation(rotatable_clients(queryset.values('client_id')), export)
+        messages.success(request, f"Staged new secrets for {staged} client(s), written to {path}.")
+    
+    rotate_client_secrets.short_description = "Rotate secrets of selected clients"
+    
+    actions = ['sync_with_hydra', 'revoke_client_sessions', 'rotate_client_secrets']
+
+
+class HydraOutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('client_id', 'operation', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('status', 'operation')
+    search_fields = ('client_id',)
+    readonly_fields = ('idempotency_key', 'client_id', 'operation', 'status', 'attempts',
+                       'next_attempt_at', 'last_error', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_entries(self, request, queryset):
+        """
+        Custom admin action to make selected entries due again.
+        """
+        count = queryset.update(
+            status=HydraOutboxEntry.STATUS_PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now(),
+        )
+        messages.success(request, f"Rescheduled {count} outbox entries.")
+    
+    retry_entries.short_description = "Retry selected entries now"
+    
+    actions = ['retry_entries']
+
+
+class AuditEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'event_type', 'subject', 'client_id', 'remote_addr')
+    list_filter = ('event_type',)
+    search_fields = ('=subject', '=client_id')
+    date_hierarchy = 'created_date'
+    # Counting months of events on every page load is not worth it
+    show_full_result_count = False
+    readonly_fields = ('event_type', 'subject', 'client_id', 'remote_addr', 'details', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
-# Register the model with the admin site
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms',
+                    'hydra_calls', 'hydra_ms', 'samples', 'download_link')
+    list_filter = ('view_name',)
+    readonly_fields = ('method', 'path', 'view_name', 'status_code', 'duration_ms', 'samples',
+                       'hydra_calls', 'hydra_ms', 'file_name', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path(
+                '<int:profile_id>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='hydra_auth_requestprofile_download',
+            ),
+        ] + super().get_urls()
+    
+    def download_link(self, obj):
+        url = reverse('admin:hydra_auth_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">Collapsed stacks</a>', url)
+    
+    download_link.short_description = "Profile"
+    
+    def download_view(self, request, profile_id):
+        """
+        Serve the collapsed-stack file of a profile.
+        """
+        if not self.has_view_permission(request):
+            raise Http404
+        profile = RequestProfile.objects.filter(pk=profile_id).first()
+        file_path = os.path.join(get_profile_dir(), os.path.basename(profile.file_name)) if profile else None
+        if file_path is None or not os.path.exists(file_path):
+            raise Http404("Profile file not found")
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=profile.file_name)
+
+
+class HydraUserAdmin(UserAdmin):
+    def revoke_hydra_sessions(self, request, queryset):
+        """
+        Custom admin action to revoke the Hydra login and consent sessions
+        of selected users.
+
+        Each user takes at least one Hydra call per cluster, so the sessions
+        are revoked in the background.
+        """
+        subjects = list(queryset.values_list(queryset.model.USERNAME_FIELD, flat=True))
+        try:
+            get_revocation_executor().submit(revoke_user_sessions, subjects)
+        except ExecutorOverloaded:
+            messages.warning(
+                request,
+                "Too many revocations are running. Revoke the sessions of the selected users with: "
+                "manage.py revoke_hydra_sessions --login --subjects-file <file with one username per line>",
+            )
+            return
+        messages.success(request, f"The Hydra sessions of {len(subjects)} user(s) are being revoked.")
+    
+    revoke_hydra_sessions.short_description = "Revoke Hydra login and consent sessions"
+    
+    actions = ['revoke_hydra_sessions']
+
+
+# Register the models with the admin site
 admin.site.register(OAuth2Client, OAuth2ClientAdmin)
+admin.site.register(HydraOutboxEntry, HydraOutboxEntryAdmin)
+admin.site.register(AuditEvent, AuditEventAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
+
+User = get_user_model()
+if admin.site.is_registered(User):
+    admin.site.unregister(User)
+admin.site.register(User, HydraUserAdmin)
@@ -0,0 +1,128 @@
+"""
+Adaptive admission control for the login and consent challenge endpoints.
+
+Each protected route gets a concurrency limit that adapts AIMD-style to the
+Hydra latency its requests observe: the limit grows by about one per
+window of healthy requests and shrinks multiplicatively when Hydra gets
+slow or requests fail. Requests beyond the limit are rejected right away
+with 503 and Retry-After. A share of the capacity is held back for POSTs,
+which complete flows already in progress, so new GETs are shed first.
+"""
+
+
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import NoReverseMatch, reverse
+
+from . import metrics
+from .instrumentation import track_hydra_calls
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase and multiplicative decrease.
+    """
+
+    def __init__(self, initial=20, min_limit=2, max_limit=200, target_latency=0.25,
+                 backoff=0.9, reserve=0.2):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.reserve = reserve
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, priority=False):
+        """
+        Admit a request if it fits in the limit. Non-priority requests may
+        only use the share of the limit that is not reserved.
+        """
+        with self._lock:
+            limit = self.limit if priority else self.limit * (1 - self.reserve)
+            if self.in_flight >= max(1, int(limit)):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None, failed=False):
+        """
+        Finish an admitted request and adapt the limit to how it went.
+
+        Args:
+            latency (float, optional): Time the request spent waiting on Hydra
+            failed (bool): Whether the request ended in a server error
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if failed or (latency is not None and latency > self.target_latency):
+                # Back off at most once per latency window, not once per request
+                now = time.monotonic()
+                if now - self._last_decrease >= self.target_latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class AdmissionControlMiddleware:
+    """
+    Apply an AIMDLimiter to each URL name listed in HYDRA_ADMISSION_ROUTES.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.retry_after = str(getattr(settings, 'HYDRA_ADMISSION_RETRY_AFTER', 1))
+        self.limiters = {
+            name: AIMDLimiter(
+                initial=getattr(settings, 'HYDRA_ADMISSION_INITIAL_LIMIT', 20),
+                min_limit=getattr(settings, 'HYDRA_ADMISSION_MIN_LIMIT', 2),
+                max_limit=getattr(settings, 'HYDRA_ADMISSION_MAX_LIMIT', 200),
+                target_latency=getattr(settings, 'HYDRA_ADMISSION_TARGET_LATENCY', 0.25),
+                reserve=getattr(settings, 'HYDRA_ADMISSION_POST_RESERVE', 0.2),
+            )
+            for name in getattr(settings, 'HYDRA_ADMISSION_ROUTES', ('login', 'consent'))
+        }
+        self._paths = None
+
+    def _route_for(self, request):
+        if self._paths is None:
+            paths = {}
+            for name in self.limiters:
+                try:
+                    paths[reverse(name)] = name
+                except NoReverseMatch:
+                    pass
+            self._paths = paths
+        return self._paths.get(request.path_info)
+
+    def __call__(self, request):
+        route = self._route_for(request)
+        if route is None:
+            return self.get_response(request)
+
+        limiter = self.limiters[route]
+        # POSTs complete flows already in progress, GETs start new ones
+        priority = request.method == 'POST'
+        if not limiter.try_acquire(priority):
+            metrics.increment('hydra_admission_rejected', route=route, method=request.method)
+            response = HttpResponse('Service is busy, please retry shortly', status=503)
+            response['Retry-After'] = self.retry_after
+            return response
+
+        failed = True
+        with track_hydra_calls() as calls:
+            try:
+                response = self.get_response(request)
+                failed = response.status_code >= 500
+            finally:
+                latency = sum(call.elapsed for call in calls) if calls else None
+                limiter.release(latency, failed)
+                metrics.set_gauge('hydra_admission_limit', limiter.limit, route=route)
+                metrics.set_gauge('hydra_admission_in_flight', limiter.in_flight, route=route)
+        return response
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class HydraAuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hydra_auth'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if getattr(settings, 'HYDRA_WARMUP_ON_STARTUP', False):
+            # Warm up now rather than on the first readiness probe
+            from .health import get_health_probe
+
+            get_health_probe().ensure_started()
@@ -0,0 +1,193 @@
+"""
+Buffered audit log of login, consent and logout decisions.
+
+record() only appends to an in-process buffer, so views never wait on the
+database. A background thread writes the buffer with bulk_create when it
+reaches HYDRA_AUDIT_BUFFER_SIZE events or every HYDRA_AUDIT_FLUSH_INTERVAL
+seconds, whichever comes first. Events that cannot be written, because the
+database is down or the process is exiting, are appended as JSON lines to
+HYDRA_AUDIT_FALLBACK_PATH and can be loaded later with the
+load_audit_fallback management command. If the buffer grows past
+HYDRA_AUDIT_MAX_BUFFERED events because the writer cannot keep up, the
+oldest events are spilled to the same file.
+"""
+
+
+import atexit
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .models import AuditEvent
+
+
+class AuditLog:
+    """
+    In-process buffer of audit events with size and time based flushing.
+    """
+
+    def __init__(self, buffer_size=None, flush_interval=None, fallback_path=None, max_buffered=None):
+        self.buffer_size = buffer_size or getattr(settings, 'HYDRA_AUDIT_BUFFER_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'HYDRA_AUDIT_FLUSH_INTERVAL', 2.0)
+        self.fallback_path = fallback_path or getattr(settings, 'HYDRA_AUDIT_FALLBACK_PATH', 'audit-fallback.jsonl')
+        self.max_buffered = (
+            max_buffered or getattr(settings, 'HYDRA_AUDIT_MAX_BUFFERED', None) or self.buffer_size * 10
+        )
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._fallback_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker_pid = None
+
+    def record(self, event_type, subject='', client_id='', request=None, **details):
+        """
+        Buffer one event. Never touches the database.
+        """
+        event = {
+            'event_type': event_type,
+            'subject': subject or '',
+            'client_id': client_id or '',
+            'remote_addr': request.META.get('REMOTE_ADDR') if request is not None else None,
+            'details': details,
+            'created_at': timezone.now(),
+        }
+        spilled = None
+        with self._lock:
+            self._events.append(event)
+            if len(self._events) > self.max_buffered:
+                # The writer is not keeping up, keep memory bounded
+                spilled, self._events = self._events[:self.buffer_size], self._events[self.buffer_size:]
+            size = len(self._events)
+            # Threads do not survive a fork, so each worker process starts its own
+            if self._worker_pid != os.getpid():
+                self._start_worker()
+        metrics.set_gauge('hydra_audit_buffered', size)
+        if spilled:
+            self._spill(spilled)
+        if size >= self.buffer_size:
+            self._wakeup.set()
+
+    def _spill(self, events):
+        try:
+            self._write_fallback(events)
+        except OSError as e:
+            print(f"Exception when spilling audit events: {e}")
+            metrics.increment('hydra_audit_events', len(events), result='dropped')
+
+    def _start_worker(self):
+        self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='hydra-audit', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                try:
+                    self.flush()
+                finally:
+                    close_old_connections()
+            except Exception as e:
+                # The worker must outlive any failure, or nothing would be
+                # flushed again while _worker_pid says it is running
+                print(f"Exception when flushing audit events: {e}")
+
+    def flush(self):
+        """
+        Write all buffered events, falling back to the JSON lines file if
+        the database rejects them.
+
+        Returns:
+            int: The number of events flushed
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            metrics.set_gauge('hydra_audit_buffered', 0)
+            if not events:
+                return 0
+
+            try:
+                AuditEvent.objects.bulk_create(
+                    [AuditEvent(created_date=event['created_at'].date(), **event) for event in events],
+                    batch_size=self.buffer_size,
+                )
+            except Exception as e:
+                print(f"Exception when writing audit events: {e}")
+                try:
+                    self._write_fallback(events)
+                except OSError:
+                    # Keep them for the next flush, record() caps the buffer
+                    with self._lock:
+                        self._events[:0] = events
+                    raise
+            else:
+                metrics.increment('hydra_audit_events', len(events), result='written')
+            return len(events)
+
+    def _write_fallback(self, events):
+        with self._fallback_lock, open(self.fallback_path, 'a') as f:
+            for event in events:
+                f.write(json.dumps({**event, 'created_at': event['created_at'].isoformat()}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.increment('hydra_audit_events', len(events), result='fallback')
+
+    def load_fallback(self):
+        """
+        Write the events from the fallback file to the database and remove the file.
+
+        Returns:
+            int: The number of events loaded
+        """
+        with self._flush_lock:
+            # Move the file aside first so events appended meanwhile are kept.
+            # A file left over from an interrupted load is retried as is.
+            loading_path = f'{self.fallback_path}.loading'
+            if not os.path.exists(loading_path):
+                with self._fallback_lock:
+                    if not os.path.exists(self.fallback_path):
+                        return 0
+                    os.replace(self.fallback_path, loading_path)
+            events = []
+            with open(loading_path) as f:
+                for line in f:
+                    if line.strip():
+                        event = json.loads(line)
+                        event['created_at'] = parse_datetime(event['created_at'])
+                        events.append(AuditEvent(created_date=event['created_at'].date(), **event))
+            with transaction.atomic():
+                AuditEvent.objects.bulk_create(events, batch_size=self.buffer_size)
+            os.remove(loading_path)
+            return len(events)
+
+
+_audit_log = None
+_audit_log_lock = threading.Lock()
+
+
+def get_audit_log():
+    """
+    Get the process-wide audit log, flushed once more when the process exits.
+    """
+    global _audit_log
+    with _audit_log_lock:
+        if _audit_log is None:
+            _audit_log = AuditLog()
+            atexit.register(_audit_log.flush)
+        return _audit_log
+
+
+def record(event_type, subject='', client_id='', request=None, **details):
+    """
+    Record an audit event, unless HYDRA_AUDIT_ENABLED is off.
+    """
+    if getattr(settings, 'HYDRA_AUDIT_ENABLED', True):
+        get_audit_log().record(event_type, subject, client_id, request, **details)
@@ -0,0 +1,122 @@
+"""
+Caching primitives: a bounded per-process LRU and a two-tier read-through
+cache that layers it over a shared Django cache backend.
+"""
+
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import transaction
+
+from . import invalidation, metrics
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded LRU mapping with per-entry expiry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache:
+    """
+    Read-through cache with a per-process LRU in front of a shared cache.
+
+    Lookups try the local LRU, then the shared cache alias, then call the
+    loader and populate both tiers. Hits and misses are counted per tier
+    under the cache name. Invalidations reach the local tiers of other
+    processes through the invalidation bus, when one is configured.
+    """
+
+    def __init__(self, name, alias='default', timeout=300, local_size=1024, local_ttl=30):
+        self.name = name
+        self.alias = alias
+        self.timeout = timeout
+        self.local = LRUCache(maxsize=local_size, ttl=local_ttl)
+        invalidation.register(self)
+
+    def _shared_key(self, key):
+        return f'hydra:{self.name}:{key}'
+
+    def get(self, key, loader):
+        invalidation.ensure_listening()
+        value = self.local.get(key)
+        if value is not MISSING:
+            metrics.increment('hydra_cache_requests', cache=self.name, tier='local', result='hit')
+            return value
+        metrics.increment('hydra_cache_requests', cache=self.name, tier='local', result='miss')
+
+        shared = caches[self.alias]
+        value = shared.get(self._shared_key(key), MISSING)
+        if value is not MISSING:
+            metrics.increment('hydra_cache_requests', cache=self.name, tier='shared', result='hit')
+            self.local.set(key, value)
+            return value
+        metrics.increment('hydra_cache_requests', cache=self.name, tier='shared', result='miss')
+
+        value = loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        caches[self.alias].set(self._shared_key(key), value, self.timeout)
+        self.local.set(key, value)
+
+    def invalidate(self, key):
+        """
+        Drop a key from both tiers, now and again once the surrounding
+        transaction commits: until then, other threads and processes still
+        read the old row and may cache it again.
+        """
+        def drop():
+            self.local.delete(key)
+            caches[self.alias].delete(self._shared_key(key))
+
+        drop()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(drop)
+        # Other processes drop their local copy too, see hydra_auth.invalidation
+        invalidation.publish(self.name, key)
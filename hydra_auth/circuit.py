@@ -0,0 +1,65 @@
+"""
+Circuit breaker guarding the connection to one Hydra endpoint.
+"""
+
+
+import threading
+import time
+
+from . import metrics
+
+
+class CircuitBreaker:
+    """
+    Open after failure_threshold consecutive failures, so calls fail fast
+    instead of piling up on an endpoint that is down. After reset_timeout
+    seconds one probe call is let through: success closes the circuit
+    again, failure keeps it open for another reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a call may go through.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def record(self, failed):
+        """
+        Record the outcome of a call that allow() let through.
+        """
+        with self._lock:
+            if not failed:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self._set_state(self.CLOSED)
+                return
+
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.increment('hydra_circuit_transitions', circuit=self.name, state=state)
+        metrics.set_gauge('hydra_circuit_open', int(state != self.CLOSED), circuit=self.name)
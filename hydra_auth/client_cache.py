@@ -0,0 +1,69 @@
+"""
+Read-through cache of merged Hydra and local OAuth2Client metadata, used to
+render and validate consent requests and to apply the client's remember
+policy without extra lookups.
+"""
+
+
+from django.conf import settings
+
+from .caching import TwoTierCache
+from .models import OAuth2Client
+
+_cache = TwoTierCache(
+    'client_metadata',
+    alias=getattr(settings, 'HYDRA_CLIENT_CACHE', 'default'),
+    timeout=getattr(settings, 'HYDRA_CLIENT_CACHE_TIMEOUT', 300),
+    local_size=getattr(settings, 'HYDRA_CLIENT_CACHE_LOCAL_SIZE', 1024),
+    local_ttl=getattr(settings, 'HYDRA_CLIENT_CACHE_LOCAL_TTL', 30),
+)
+
+
+def build_client_metadata(client_id, hydra_client=None, hydra_data=None):
+    """
+    Merge a client's Hydra representation with its local OAuth2Client row.
+
+    Args:
+        client_id (str): ID of the client
+        hydra_client (HydraClient, optional): Used to fetch the client from
+            Hydra when hydra_data is not given
+        hydra_data (OAuth2Client, optional): Hydra client object already at
+            hand, e.g. the one embedded in a consent request
+
+    Returns:
+        dict: Client metadata without the secret, local values taking
+            precedence and the local remember_policy added, or None if the
+            client is unknown
+    """
+    if hydra_data is None and hydra_client is not None:
+        hydra_data = hydra_client.get_oauth2_client(client_id)
+    metadata = hydra_data.to_dict() if hydra_data is not None else {}
+
+    local = OAuth2Client.objects.filter(client_id=client_id).first()
+    if local is not None:
+        metadata.update({
+            key: value for key, value in local.to_hydra_dict().items()
+            if value not in ('', None, [])
+        })
+        metadata['remember_policy'] = local.get_remember_policy()
+
+    if not metadata:
+        return None
+    metadata.pop('client_secret', None)
+    metadata['client_id'] = client_id
+    return metadata
+
+
+def get_client_metadata(client_id, hydra_client=None, hydra_data=None):
+    """
+    Get merged client metadata through the per-process and shared caches.
+    See build_client_metadata for the arguments.
+    """
+    return _cache.get(client_id, lambda: build_client_metadata(client_id, hydra_client, hydra_data))
+
+
+def invalidate_client_metadata(client_id):
+    """
+    Drop a client from both cache tiers.
+    """
+    _cache.invalidate(client_id)
@@ -0,0 +1,143 @@
+"""
+Size-capped executors for CPU-heavy work done on behalf of requests.
+"""
+
+
+import asyncio
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+
+
+class ExecutorOverloaded(Exception):
+    """
+    Raised when an executor already holds as many tasks as it may queue.
+    """
+
+
+class BoundedExecutor:
+    """
+    Thread pool that rejects work instead of queueing it without bound.
+
+    At most max_workers tasks run at once and at most max_pending more wait
+    for a worker; anything beyond that fails fast with ExecutorOverloaded,
+    so bursts are shed instead of starving other requests. The number of
+    queued and running tasks is published as the hydra_executor_depth gauge.
+    """
+
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.capacity = max_workers + max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'hydra-{name}')
+        self._lock = threading.Lock()
+        self._depth = 0
+
+    def _set_depth(self, delta):
+        with self._lock:
+            self._depth += delta
+            depth = self._depth
+        metrics.set_gauge('hydra_executor_depth', depth, executor=self.name)
+
+    def _run(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # Worker threads never see request_finished, so tidy up here
+            close_old_connections()
+            self._set_depth(-1)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn and return its Future.
+
+        Raises:
+            ExecutorOverloaded: If the executor is at capacity
+        """
+        with self._lock:
+            if self._depth >= self.capacity:
+                metrics.increment('hydra_executor_rejected', executor=self.name)
+                raise ExecutorOverloaded(f"The {self.name} executor is at capacity")
+            self._depth += 1
+        metrics.set_gauge('hydra_executor_depth', self._depth, executor=self.name)
+        metrics.increment('hydra_executor_submitted', executor=self.name)
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Run fn on the executor and wait for its result.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run_async(self, fn, *args, **kwargs):
+        """
+        Run fn on the executor from an async view without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+
+def map_bounded(fn, items, concurrency, name='batch'):
+    """
+    Apply fn to each item on a pool of concurrency threads and yield the
+    results in completion order.
+
+    Items are consumed lazily and at most concurrency * 2 calls are pending
+    at any time, so jobs over very large iterables run in constant memory.
+    fn must not raise; exceptions propagate to the caller and stop the job.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'hydra-{name}') as executor:
+        pending = set()
+        for item in items:
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(fn, item))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+_password_executor = None
+_password_executor_lock = threading.Lock()
+
+
+def get_password_executor():
+    """
+    Get the shared executor used for password verification.
+    """
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is None:
+            _password_executor = BoundedExecutor(
+                'password',
+                max_workers=getattr(settings, 'HYDRA_PASSWORD_WORKERS', None) or os.cpu_count() or 2,
+                max_pending=getattr(settings, 'HYDRA_PASSWORD_QUEUE_SIZE', 32),
+            )
+        return _password_executor
+
+
+_revocation_executor = None
+_revocation_executor_lock = threading.Lock()
+
+
+def get_revocation_executor():
+    """
+    Get the shared executor that admin actions hand session revocation to,
+    so their requests do not wait for one Hydra call per user.
+    """
+    global _revocation_executor
+    with _revocation_executor_lock:
+        if _revocation_executor is None:
+            _revocation_executor = BoundedExecutor(
+                'revocation',
+                max_workers=1,
+                max_pending=getattr(settings, 'HYDRA_REVOCATION_QUEUE_SIZE', 16),
+            )
+        return _revocation_executor
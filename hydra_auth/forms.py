@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 
 from .models import OAuth2Client
@@ -108,3 +110,72 @@ class OAuth2ClientAdminForm(forms.ModelForm):
             cleaned_data['contacts'] = ','.join([contact.strip() for contact in contacts.split('\n') if contact.strip()])
         
         return cleaned_data
+
+
+class OAuth2ClientForm(forms.ModelForm):
+    """
+    Form for OAuth2Client in the client management views.
+    """
+    grant_types = forms.MultipleChoiceField(
+        choices=OAuth2ClientAdminForm.GRANT_TYPE_CHOICES,
+        widget=forms.CheckboxSelectMultiple,
+        required=False
+    )
+    
+    response_types = forms.MultipleChoiceField(
+        choices=OAuth2ClientAdminForm.RESPONSE_TYPE_CHOICES,
+        widget=forms.CheckboxSelectMultiple,
+        required=False
+    )
+    
+    class Meta:
+        model = OAuth2Client
+        fields = [
+            'client_id', 'client_name', 'client_secret', 'token_endpoint_auth_method', 'redirect_uris',
+            'grant_types', 'response_types', 'scope', 'audience', 'client_uri', 'logo_uri', 'contacts',
+            'tos_uri', 'policy_uri', 'jwks_uri', 'allow_cors_requests',
+        ]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['client_id'].required = False
+        
+        instance = kwargs.get('instance')
+        if instance:
+            self.initial['grant_types'] = instance.get_grant_types_list()
+            self.initial['response_types'] = instance.get_response_types_list()
+            # The textareas hold one value per line
+            self.initial['redirect_uris'] = '\n'.join(instance.get_redirect_uris_list())
+            self.initial['audience'] = '\n'.join(instance.get_audience_list())
+            self.initial['contacts'] = '\n'.join(instance.get_contacts_list())
+    
+    def clean_client_id(self):
+        # The ID of an existing client never changes
+        if self.instance.pk:
+            return self.instance.pk
+        return self.cleaned_data.get('client_id') or str(uuid.uuid4())
+    
+    def clean_client_secret(self):
+        # Left blank on update, the current secret is kept
+        if self.instance.pk and not self.cleaned_data.get('client_secret'):
+            return self.instance.client_secret
+        return self.cleaned_data.get('client_secret') or None
+    
+    def clean_grant_types(self):
+        return ','.join(self.cleaned_data.get('grant_types', []))
+    
+    def clean_response_types(self):
+        return ','.join(self.cleaned_data.get('response_types', []))
+    
+    @staticmethod
+    def _lines_to_list(value):
+        return ','.join([item.strip() for item in value.replace(',', '\n').split('\n') if item.strip()])
+    
+    def clean_redirect_uris(self):
+        return self._lines_to_list(self.cleaned_data.get('redirect_uris', ''))
+    
+    def clean_audience(self):
+        return self._lines_to_list(self.cleaned_data.get('audience', ''))
+    
+    def clean_contacts(self):
+        return self._lines_to_list(self.cleaned_data.get('contacts', ''))
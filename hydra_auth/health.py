@@ -0,0 +1,167 @@
+"""
+Liveness and readiness endpoints.
+
+/healthz answers as long as the process serves requests. /readyz answers
+from a report that a background thread refreshes every
+HYDRA_HEALTH_PROBE_INTERVAL seconds by checking the database and the
+readiness endpoint of every Hydra cluster, after warming the process up (see
+hydra_auth.warmup) unless HYDRA_WARMUP_ENABLED is off. Probes from load balancers never
+reach Hydra or the database themselves, so each process sends Hydra one
+check per interval however often it is probed. A report older than
+HYDRA_HEALTH_MAX_AGE seconds counts as not ready.
+
+Both endpoints are served by HealthCheckMiddleware, placed first, so they
+skip the rest of the middleware stack and URL resolution.
+"""
+
+
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import HttpResponse
+
+from . import metrics
+from .routing import get_router
+
+
+def _pool_stats(api_client):
+    stats = {'maxsize': api_client.configuration.connection_pool_maxsize, 'connections': 0, 'requests': 0}
+    # HTTP/2 transports keep no urllib3 pools
+    pools = getattr(api_client.rest_client.pool_manager, 'pools', {})
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            stats['connections'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+    return stats
+
+
+class HealthProbe:
+    """
+    Periodically computed readiness report, served from memory.
+    """
+
+    def __init__(self, interval=None, max_age=None, timeout=None):
+        self.interval = interval or getattr(settings, 'HYDRA_HEALTH_PROBE_INTERVAL', 5)
+        self.max_age = max_age or getattr(settings, 'HYDRA_HEALTH_MAX_AGE', 3 * self.interval)
+        self.timeout = timeout or getattr(settings, 'HYDRA_HEALTH_PROBE_TIMEOUT', 2)
+        self.warm_up_enabled = getattr(settings, 'HYDRA_WARMUP_ENABLED', True)
+        self._report = None
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def ensure_started(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._worker_pid != os.getpid():
+            with self._lock:
+                if self._worker_pid != os.getpid():
+                    self._worker_pid = os.getpid()
+                    threading.Thread(target=self._run, name='hydra-health', daemon=True).start()
+
+    def _run(self):
+        if self.warm_up_enabled:
+            # No report, and so no readiness, until the process is warm
+            from .warmup import warm_up
+
+            try:
+                timings = warm_up()
+                print(f"Warmed up in {sum(timings.values()):.2f}s: "
+                      + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items()))
+            except Exception as e:
+                print(f"Exception when warming up: {e}")
+            finally:
+                close_old_connections()
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Exception when probing health: {e}")
+            time.sleep(self.interval)
+
+    def _check_database(self):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception as e:
+            print(f"Exception when probing the database: {e}")
+            return False
+        finally:
+            close_old_connections()
+
+    def check(self):
+        """
+        Probe the database and Hydra now and store the report.
+        """
+        checks = {'database': self._check_database()}
+        clusters = {}
+        for name, hydra_client in get_router().all().items():
+            checks[f'hydra:{name}'] = hydra_client.is_ready(self.timeout)
+            clusters[name] = {
+                'admin_circuit': hydra_client.admin_circuit.state,
+                'public_circuit': hydra_client.public_circuit.state,
+                'admin_pool': _pool_stats(hydra_client.admin_api),
+            }
+
+        ready = all(checks.values())
+        metrics.set_gauge('hydra_ready', int(ready))
+        body = json.dumps({
+            'status': 'ready' if ready else 'unavailable',
+            'checked_at': time.time(),
+            'checks': checks,
+            'clusters': clusters,
+        }).encode('utf-8')
+        self._report = (time.monotonic(), ready, body)
+
+    def report(self):
+        """
+        Get the latest report without doing any I/O. The first call starts
+        the probe thread and reports "starting" until its first check.
+
+        Returns:
+            tuple: (ready, JSON body as bytes)
+        """
+        self.ensure_started()
+        report = self._report
+        if report is None:
+            return False, b'{"status": "starting"}'
+        checked_at, ready, body = report
+        if time.monotonic() - checked_at > self.max_age:
+            return False, body.replace(b'"status": "ready"', b'"status": "stale"', 1)
+        return ready, body
+
+
+_probe = None
+_probe_lock = threading.Lock()
+
+
+def get_health_probe():
+    global _probe
+    with _probe_lock:
+        if _probe is None:
+            _probe = HealthProbe()
+        return _probe
+
+
+class HealthCheckMiddleware:
+    """
+    Answer HYDRA_HEALTH_PATH and HYDRA_READY_PATH before any other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.health_path = getattr(settings, 'HYDRA_HEALTH_PATH', '/healthz')
+        self.ready_path = getattr(settings, 'HYDRA_READY_PATH', '/readyz')
+        self.probe = get_health_probe()
+
+    def __call__(self, request):
+        if request.path_info == self.health_path:
+            return HttpResponse(b'{"status": "ok"}', content_type='application/json')
+        if request.path_info == self.ready_path:
+            ready, body = self.probe.report()
+            return HttpResponse(body, status=200 if ready else 503, content_type='application/json')
+        return self.get_response(request)
@@ -3,39 +3,119 @@ Ory Hydra client configuration and utility functions.
 """
 
 
+import base64
+import time
+from urllib.parse import quote_plus
+
 import ory_client
 from django.conf import settings
 
+from .circuit import CircuitBreaker
+from .instrumentation import record_hydra_call
+from .records import HydraClientRecord, loads
+from .singleflight import single_flight
+from .transports import make_pool_manager
+
+
+class InstrumentedApiClient(ory_client.ApiClient):
+    """
+    ApiClient that reports the latency of every Hydra call and, given a
+    circuit breaker, fails fast while the endpoint is down.
+    """
+    
+    def __init__(self, configuration, circuit=None):
+        super().__init__(configuration)
+        self.circuit = circuit
+        # Unix socket and HTTP/2 hosts replace urllib3, see hydra_auth.transports
+        pool_manager = make_pool_manager(configuration)
+        if pool_manager is not None:
+            self.rest_client.pool_manager = pool_manager
+    
+    def call_api(self, method, url, *args, **kwargs):
+        if self.circuit is not None and not self.circuit.allow():
+            raise ory_client.ApiException(status=503, reason=f"Circuit '{self.circuit.name}' is open")
+        
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = super().call_api(method, url, *args, **kwargs)
+            failed = response.status >= 500
+            return response
+        finally:
+            record_hydra_call(method, url, time.perf_counter() - start)
+            if self.circuit is not None:
+                self.circuit.record(failed)
+
 
 class HydraClient:
     """
     Client for interacting with Ory Hydra OAuth2 server.
     """
     
-    def __init__(self):
+    def __init__(self, admin_url=None, public_url=None, cluster='default'):
+        """
+        Args:
+            admin_url (str, optional): Admin API URL, HYDRA_ADMIN_URL by default
+            public_url (str, optional): Public API URL, HYDRA_PUBLIC_URL by default
+            cluster (str): Name of the Hydra cluster, see hydra_auth.routing
+        """
+        self.cluster = cluster
+        failure_threshold = getattr(settings, 'HYDRA_CIRCUIT_FAILURE_THRESHOLD', 5)
+        reset_timeout = getattr(settings, 'HYDRA_CIRCUIT_RESET_TIMEOUT', 30)
+        
         # Configure the Ory Hydra Admin API client
         self.admin_configuration = ory_client.Configuration(
-            host=settings.HYDRA_ADMIN_URL
+            host=admin_url or settings.HYDRA_ADMIN_URL
+        )
+        self.admin_configuration.connection_pool_maxsize = getattr(
+            settings, 'HYDRA_CONNECTION_POOL_SIZE', self.admin_configuration.connection_pool_maxsize
         )
-        self.admin_api = ory_client.ApiClient(self.admin_configuration)
+        self.admin_circuit = CircuitBreaker(f'{cluster}-admin', failure_threshold, reset_timeout)
+        self.admin_api = InstrumentedApiClient(self.admin_configuration, self.admin_circuit)
         self.oauth2_api = ory_client.OAuth2Api(self.admin_api)
         
         # Configure the Ory Hydra Public API client
         self.public_configuration = ory_client.Configuration(
-            host=settings.HYDRA_PUBLIC_URL
+            host=public_url or settings.HYDRA_PUBLIC_URL
         )
-        self.public_api = ory_client.ApiClient(self.public_configuration)
+        self.public_circuit = CircuitBreaker(f'{cluster}-public', failure_threshold, reset_timeout)
+        self.public_api = InstrumentedApiClient(self.public_configuration, self.public_circuit)
+        self.wellknown_api = ory_client.WellknownApi(self.public_api)
+        
+        # 'patch' sends only changed fields, 'put' replaces the whole client
+        self.update_mode = getattr(settings, 'HYDRA_CLIENT_UPDATE_MODE', 'patch')
+        
+        # Read clients as HydraClientRecords instead of pydantic models
+        self.raw_responses = getattr(settings, 'HYDRA_RAW_RESPONSES', False)
+    
+    def _call_raw(self, method, **kwargs):
+        """
+        Call an OAuth2Api method and decode its JSON body, skipping the
+        ory_client models.
+        
+        Raises:
+            ApiException: If Hydra answered with an error status
+        """
+        response = getattr(self.oauth2_api, f'{method}_without_preload_content')(**kwargs)
+        try:
+            body = response.data
+        finally:
+            response.release_conn()
+        if not 200 <= response.status <= 299:
+            raise ory_client.ApiException(status=response.status, reason=response.reason, body=body)
+        return loads(body)
         
     # Login, Consent, and Logout methods
     
+    @single_flight
     def get_login_request(self, login_challenge):
         """
         Get login request information from Hydra.
         """
         try:
-            return self.oauth2_api.get_oauth2_login_request(login_challenge)
+            return self.oauth2_api.get_o_auth2_login_request(login_challenge)
         except ory_client.ApiException as e:
-            print(f"Exception when calling get_oauth2_login_request: {e}")
+            print(f"Exception when calling get_o_auth2_login_request: {e}")
             return None
     
     def accept_login_request(self, login_challenge, subject, remember=False, remember_for=3600):
@@ -48,12 +128,12 @@ class HydraClient:
                 remember=remember,
                 remember_for=remember_for
             )
-            return self.oauth2_api.accept_oauth2_login_request(
+            return self.oauth2_api.accept_o_auth2_login_request(
                 login_challenge=login_challenge,
-                accept_oauth2_login_request=body
+                accept_o_auth2_login_request=body
             )
         except ory_client.ApiException as e:
-            print(f"Exception when calling accept_oauth2_login_request: {e}")
+            print(f"Exception when calling accept_o_auth2_login_request: {e}")
             return None
     
     def reject_login_request(self, login_challenge, error="access_denied", error_description="The resource owner denied the request"):
@@ -65,41 +145,46 @@ class HydraClient:
                 error=error,
                 error_description=error_description
             )
-            return self.oauth2_api.reject_oauth2_login_request(
+            return self.oauth2_api.reject_o_auth2_login_request(
                 login_challenge=login_challenge,
-                reject_oauth2_request=body
+                reject_o_auth2_request=body
             )
         except ory_client.ApiException as e:
-            print(f"Exception when calling reject_oauth2_login_request: {e}")
+            print(f"Exception when calling reject_o_auth2_login_request: {e}")
             return None
     
+    @single_flight
     def get_consent_request(self, consent_challenge):
         """
         Get consent request information from Hydra.
         """
         try:
-            return self.oauth2_api.get_oauth2_consent_request(consent_challenge)
+            return self.oauth2_api.get_o_auth2_consent_request(consent_challenge)
         except ory_client.ApiException as e:
-            print(f"Exception when calling get_oauth2_consent_request: {e}")
+            print(f"Exception when calling get_o_auth2_consent_request: {e}")
             return None
     
-    def accept_consent_request(self, consent_challenge, grant_scope, grant_access_token_audience=None, remember=False, remember_for=3600):
+    def accept_consent_request(self, consent_challenge, grant_scope, grant_access_token_audience=None, remember=False, remember_for=3600, session=None):
         """
         Accept a consent request.
+        
+        The optional session is a dict with 'id_token' and 'access_token'
+        claims to embed in the issued tokens.
         """
         try:
             body = ory_client.AcceptOAuth2ConsentRequest(
                 grant_scope=grant_scope,
                 grant_access_token_audience=grant_access_token_audience,
                 remember=remember,
-                remember_for=remember_for
+                remember_for=remember_for,
+                session=ory_client.AcceptOAuth2ConsentRequestSession(**session) if session else None
             )
-            return self.oauth2_api.accept_oauth2_consent_request(
+            return self.oauth2_api.accept_o_auth2_consent_request(
                 consent_challenge=consent_challenge,
-                accept_oauth2_consent_request=body
+                accept_o_auth2_consent_request=body
             )
         except ory_client.ApiException as e:
-            print(f"Exception when calling accept_oauth2_consent_request: {e}")
+            print(f"Exception when calling accept_o_auth2_consent_request: {e}")
             return None
     
     def reject_consent_request(self, consent_challenge, error="access_denied", error_description="The resource owner denied the request"):
@@ -111,22 +196,23 @@ class HydraClient:
                 error=error,
                 error_description=error_description
             )
-            return self.oauth2_api.reject_oauth2_consent_request(
+            return self.oauth2_api.reject_o_auth2_consent_request(
                 consent_challenge=consent_challenge,
-                reject_oauth2_request=body
+                reject_o_auth2_request=body
             )
         except ory_client.ApiException as e:
-            print(f"Exception when calling reject_oauth2_consent_request: {e}")
+            print(f"Exception when calling reject_o_auth2_consent_request: {e}")
             return None
     
+    @single_flight
     def get_logout_request(self, logout_challenge):
         """
         Get logout request information from Hydra.
         """
         try:
-            return self.oauth2_api.get_oauth2_logout_request(logout_challenge)
+            return self.oauth2_api.get_o_auth2_logout_request(logout_challenge)
         except ory_client.ApiException as e:
-            print(f"Exception when calling get_oauth2_logout_request: {e}")
+            print(f"Exception when calling get_o_auth2_logout_request: {e}")
             return None
     
     def accept_logout_request(self, logout_challenge):
@@ -134,48 +220,202 @@ class HydraClient:
         Accept a logout request.
         """
         try:
-            return self.oauth2_api.accept_oauth2_logout_request(logout_challenge)
+            return self.oauth2_api.accept_o_auth2_logout_request(logout_challenge)
         except ory_client.ApiException as e:
-            print(f"Exception when calling accept_oauth2_logout_request: {e}")
+            print(f"Exception when calling accept_o_auth2_logout_request: {e}")
             return None
     
     def reject_logout_request(self, logout_challenge, error="access_denied", error_description="The resource owner denied the request"):
         """
-        Reject a logout request.
+        Reject a logout request. Hydra does not take an error for logouts,
+        error and error_description are accepted for symmetry only.
+        
+        Returns:
+            bool: True if Hydra rejected the request. It gives no redirect
+                for a rejected logout, the user stays signed in where they are.
         """
         try:
-            body = ory_client.RejectOAuth2Request(
-                error=error,
-                error_description=error_description
-            )
-            return self.oauth2_api.reject_oauth2_logout_request(
-                logout_challenge=logout_challenge,
-                reject_oauth2_request=body
+            self.oauth2_api.reject_o_auth2_logout_request(logout_challenge=logout_challenge)
+            return True
+        except ory_client.ApiException as e:
+            print(f"Exception when calling reject_o_auth2_logout_request: {e}")
+            return False
+    
+    # Token methods
+    
+    @single_flight
+    def introspect_token(self, token, scope=None):
+        """
+        Introspect an access or refresh token.
+        
+        Args:
+            token (str): The token to introspect
+            scope (str, optional): Space-separated scopes the token must have
+        
+        Returns:
+            IntrospectedOAuth2Token: The introspection result or None if an error occurred
+        """
+        try:
+            return self.oauth2_api.introspect_o_auth2_token(token=token, scope=scope)
+        except ory_client.ApiException as e:
+            print(f"Exception when calling introspect_o_auth2_token: {e}")
+            return None
+    
+    def request_client_credentials_token(self, client_id, client_secret, scope=(), audience=(), timeout=5):
+        """
+        Get an access token for a client with the client_credentials grant
+        from Hydra's public token endpoint, authenticating with
+        client_secret_basic.
+        
+        Use hydra_auth.tokens.get_token_provider() instead to reuse tokens
+        until they are about to expire.
+        
+        Args:
+            client_id (str): ID of the client
+            client_secret (str): Secret of the client
+            scope (list, optional): Scopes to request
+            audience (list, optional): Audiences to request
+        
+        Returns:
+            dict: The token response with access_token and expires_in, or
+                None if an error occurred
+        """
+        credentials = f'{quote_plus(client_id)}:{quote_plus(client_secret)}'.encode('utf-8')
+        form = [('grant_type', 'client_credentials')]
+        if scope:
+            form.append(('scope', ' '.join(scope)))
+        if audience:
+            form.append(('audience', ' '.join(audience)))
+        try:
+            response = self.public_api.call_api(
+                'POST',
+                f'{self.public_configuration.host}/oauth2/token',
+                header_params={
+                    'Authorization': f"Basic {base64.b64encode(credentials).decode('ascii')}",
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/json',
+                },
+                post_params=form,
+                _request_timeout=timeout
             )
+            response.read()
+            if response.status != 200:
+                raise ory_client.ApiException(status=response.status, reason=response.reason, body=response.data)
+            return loads(response.data)
+        except Exception as e:
+            print(f"Exception when calling /oauth2/token: {e}")
+            return None
+    
+    def get_json_web_keys(self):
+        """
+        Get the public JSON Web Key Set used to sign tokens.
+        
+        Returns:
+            JsonWebKeySet: The key set or None if an error occurred
+        """
+        try:
+            return self.wellknown_api.discover_json_web_keys()
         except ory_client.ApiException as e:
-            print(f"Exception when calling reject_oauth2_logout_request: {e}")
+            print(f"Exception when calling discover_json_web_keys: {e}")
             return None
     
+    def is_ready(self, timeout=2):
+        """
+        Check Hydra's readiness endpoint on the admin API.
+        
+        Returns:
+            bool: True if Hydra and its database are ready, False otherwise
+        """
+        try:
+            response = self.admin_api.call_api(
+                'GET',
+                f'{self.admin_configuration.host}/health/ready',
+                _request_timeout=timeout
+            )
+            # Read the body so the connection goes back to the pool
+            response.read()
+            return response.status == 200
+        except Exception as e:
+            print(f"Exception when calling /health/ready: {e}")
+            return False
+    
+    def delete_oauth2_tokens(self, client_id):
+        """
+        Delete all access and refresh tokens issued to a client.
+        
+        Returns:
+            bool: True if the tokens were deleted, False otherwise
+        """
+        try:
+            self.oauth2_api.delete_o_auth2_token(client_id=client_id)
+            return True
+        except ory_client.ApiException as e:
+            print(f"Exception when calling delete_o_auth2_token: {e}")
+            return False
+    
+    # Session methods
+    
+    def revoke_consent_sessions(self, subject, client_id=None):
+        """
+        Revoke a subject's consent sessions, for one client or for all of them.
+        
+        Returns:
+            bool: True if the sessions were revoked, False otherwise
+        """
+        try:
+            self.oauth2_api.revoke_o_auth2_consent_sessions(
+                subject=subject,
+                client=client_id,
+                all=True if client_id is None else None
+            )
+            return True
+        except ory_client.ApiException as e:
+            print(f"Exception when calling revoke_o_auth2_consent_sessions: {e}")
+            return False
+    
+    def revoke_login_sessions(self, subject):
+        """
+        Revoke all login sessions of a subject.
+        
+        Returns:
+            bool: True if the sessions were revoked, False otherwise
+        """
+        try:
+            self.oauth2_api.revoke_o_auth2_login_sessions(subject=subject)
+            return True
+        except ory_client.ApiException as e:
+            print(f"Exception when calling revoke_o_auth2_login_sessions: {e}")
+            return False
+    
     # OAuth2 Client Management methods
     
-    def list_oauth2_clients(self, limit=25, offset=0):
+    def list_oauth2_clients(self, limit=25, client_name=None):
         """
-        List all OAuth2 clients.
+        List OAuth2 clients, up to limit (Hydra's page size), only those
+        named client_name if it is given.
         """
         try:
-            return self.oauth2_api.list_oauth2_clients(limit=limit, offset=offset)
+            if self.raw_responses:
+                return [
+                    HydraClientRecord(data)
+                    for data in self._call_raw('list_o_auth2_clients', page_size=limit, client_name=client_name)
+                ]
+            return self.oauth2_api.list_o_auth2_clients(page_size=limit, client_name=client_name)
         except ory_client.ApiException as e:
-            print(f"Exception when calling list_oauth2_clients: {e}")
+            print(f"Exception when calling list_o_auth2_clients: {e}")
             return []
     
+    @single_flight
     def get_oauth2_client(self, client_id):
         """
         Get a specific OAuth2 client by ID.
         """
         try:
-            return self.oauth2_api.get_oauth2_client(id=client_id)
+            if self.raw_responses:
+                return HydraClientRecord(self._call_raw('get_o_auth2_client', id=client_id))
+            return self.oauth2_api.get_o_auth2_client(id=client_id)
         except ory_client.ApiException as e:
-            print(f"Exception when calling get_oauth2_client: {e}")
+            print(f"Exception when calling get_o_auth2_client: {e}")
             return None
     
     def create_oauth2_client(self, client_data):
@@ -200,6 +440,7 @@ class HydraClient:
                 - policy_uri (optional): Policy URI
                 - jwks_uri (optional): JWKS URI
                 - allow_cors_requests (optional): Whether to allow CORS requests
+                - metadata (optional): Free-form JSON stored with the client
         
         Returns:
             OAuth2Client: The created OAuth2 client or None if an error occurred
@@ -222,12 +463,13 @@ class HydraClient:
                 tos_uri=client_data.get('tos_uri'),
                 policy_uri=client_data.get('policy_uri'),
                 jwks_uri=client_data.get('jwks_uri'),
-                allow_cors_requests=client_data.get('allow_cors_requests', False)
+                allow_cors_requests=client_data.get('allow_cors_requests', False),
+                metadata=client_data.get('metadata')
             )
             
-            return self.oauth2_api.create_oauth2_client(oauth2_client=oauth2_client)
+            return self.oauth2_api.create_o_auth2_client(o_auth2_client=oauth2_client)
         except ory_client.ApiException as e:
-            print(f"Exception when calling create_oauth2_client: {e}")
+            print(f"Exception when calling create_o_auth2_client: {e}")
             return None
     
     def update_oauth2_client(self, client_id, client_data):
@@ -263,11 +505,49 @@ class HydraClient:
                 allow_cors_requests=client_data.get('allow_cors_requests', False)
             )
             
-            return self.oauth2_api.update_oauth2_client(id=client_id, oauth2_client=oauth2_client)
+            return self.oauth2_api.set_o_auth2_client(id=client_id, o_auth2_client=oauth2_client)
+        except ory_client.ApiException as e:
+            print(f"Exception when calling set_o_auth2_client: {e}")
+            return None
+    
+    def patch_oauth2_client(self, client_id, patch):
+        """
+        Partially update an existing OAuth2 client.
+        
+        Args:
+            client_id (str): ID of the client to update
+            patch (list): JSON Patch operations, each a dict with 'op', 'path'
+                and optionally 'value'
+        
+        Returns:
+            OAuth2Client: The updated OAuth2 client or None if an error occurred
+        """
+        try:
+            json_patch = [ory_client.JsonPatch(**operation) for operation in patch]
+            return self.oauth2_api.patch_o_auth2_client(id=client_id, json_patch=json_patch)
         except ory_client.ApiException as e:
-            print(f"Exception when calling update_oauth2_client: {e}")
+            print(f"Exception when calling patch_o_auth2_client: {e}")
             return None
     
+    def push_oauth2_client(self, client):
+        """
+        Push local changes of an OAuth2Client model instance to Hydra.
+        
+        In patch mode only the fields that differ from the last known Hydra
+        state are sent, so Hydra does not re-hash an unchanged secret. A full
+        update is used when no Hydra state is known yet or in put mode.
+        
+        Args:
+            client (OAuth2Client): The local model instance
+        
+        Returns:
+            OAuth2Client: The updated OAuth2 client or None if an error occurred
+        """
+        patch = client.to_hydra_patch() if self.update_mode == 'patch' else None
+        if patch is None:
+            return self.update_oauth2_client(client.client_id, client.to_hydra_dict())
+        return self.patch_oauth2_client(client.client_id, patch)
+    
     def delete_oauth2_client(self, client_id):
         """
         Delete an OAuth2 client.
@@ -276,11 +556,15 @@ class HydraClient:
             client_id (str): ID of the client to delete
         
         Returns:
-            bool: True if deletion was successful, False otherwise
+            bool: True if deletion was successful or the client did not exist,
+                False otherwise
         """
         try:
-            self.oauth2_api.delete_oauth2_client(id=client_id)
+            self.oauth2_api.delete_o_auth2_client(id=client_id)
             return True
         except ory_client.ApiException as e:
-            print(f"Exception when calling delete_oauth2_client: {e}")
+            if e.status == 404:
+                # Already gone, which is what the caller asked for
+                return True
+            print(f"Exception when calling delete_o_auth2_client: {e}")
             return False
@@ -0,0 +1,37 @@
+"""
+Per-request instrumentation of calls made to Hydra.
+"""
+
+
+import contextvars
+from collections import namedtuple
+from contextlib import contextmanager
+
+HydraCall = namedtuple('HydraCall', ['method', 'url', 'elapsed'])
+
+_trackers = contextvars.ContextVar('hydra_call_trackers', default=())
+
+
+@contextmanager
+def track_hydra_calls():
+    """
+    Collect the Hydra calls made in the current context.
+
+    Yields a list that receives a HydraCall for every request sent to Hydra
+    until the block exits. Trackers nest: outer trackers see inner calls too.
+    """
+    calls = []
+    token = _trackers.set(_trackers.get() + (calls,))
+    try:
+        yield calls
+    finally:
+        _trackers.reset(token)
+
+
+def record_hydra_call(method, url, elapsed):
+    """
+    Report a completed Hydra call to every active tracker.
+    """
+    call = HydraCall(method, url, elapsed)
+    for calls in _trackers.get():
+        calls.append(call)
@@ -0,0 +1,344 @@
+"""
+Cross-process invalidation of the per-process cache tiers.
+
+TwoTierCache.invalidate() drops an entry from the local LRU of the process
+that made the change and from the shared cache, once right away and once
+more when the transaction commits, but other processes keep their local
+copy until its TTL runs out. With HYDRA_INVALIDATION_BACKEND set, every
+invalidation (from the model signals, the outbox sync and any other caller)
+is also published once the surrounding transaction commits.
+Each process collects its own events and publishes them in batches every
+HYDRA_INVALIDATION_INTERVAL seconds from a background thread, which also
+receives the batches of the other processes and drops the named keys from
+their local tiers. Local TTLs can then be long without serving stale data.
+
+Backends, named by dotted path:
+
+- LocalBackend delivers to every bus in the same process, for tests.
+- CacheBackend appends batches to a numbered log in the shared
+  HYDRA_INVALIDATION_CACHE alias, which the other processes poll. Django's
+  cache API has no pub/sub, so this works on any shared backend.
+- PostgresNotifyBackend sends batches with NOTIFY and receives them on a
+  dedicated LISTEN connection.
+
+If a process cannot tell whether it missed a batch, because the backend
+failed or the log has a gap, it clears its local tiers instead.
+"""
+
+
+import json
+import os
+import queue
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connections, transaction
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+# TwoTierCaches by name, see register()
+_caches = {}
+
+
+def register(cache):
+    """
+    Let the bus drop keys from a TwoTierCache's local tier.
+    """
+    _caches[cache.name] = cache
+
+
+class InvalidationGap(Exception):
+    """
+    Raised by a backend when batches may have been lost.
+    """
+
+
+class LocalBackend:
+    """
+    In-process backend: every subscribed LocalBackend receives every batch.
+    """
+
+    _queues = []
+    _queues_lock = threading.Lock()
+
+    def __init__(self):
+        self._queue = None
+
+    def subscribe(self):
+        self._queue = queue.Queue()
+        with self._queues_lock:
+            self._queues.append(self._queue)
+
+    def publish(self, payload):
+        with self._queues_lock:
+            subscribers = list(self._queues)
+        for subscriber in subscribers:
+            subscriber.put(payload)
+
+    def receive(self, timeout):
+        try:
+            payloads = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                payloads.append(self._queue.get_nowait())
+            except queue.Empty:
+                return payloads
+
+
+class CacheBackend:
+    """
+    Numbered log of batches in a shared cache, polled by every process.
+    """
+
+    def __init__(self, alias=None, retention=60, grace=2):
+        self.alias = alias or getattr(settings, 'HYDRA_INVALIDATION_CACHE', 'default')
+        self.retention = retention
+        self.grace = grace
+        self.sequence_key = 'hydra:invalidation:sequence'
+        self.position = None
+        self._missing_since = None
+
+    def _sequence(self, cache):
+        cache.add(self.sequence_key, 0, None)
+        return cache.get(self.sequence_key) or 0
+
+    def subscribe(self):
+        self.position = self._sequence(caches[self.alias])
+
+    def publish(self, payload):
+        cache = caches[self.alias]
+        try:
+            number = cache.incr(self.sequence_key)
+        except ValueError:
+            # The counter was evicted, start it again
+            self._sequence(cache)
+            number = cache.incr(self.sequence_key)
+        cache.set(f'hydra:invalidation:{number}', payload, self.retention)
+
+    def receive(self, timeout):
+        cache = caches[self.alias]
+        latest = self._sequence(cache)
+        if latest == self.position:
+            time.sleep(timeout)
+            return []
+
+        if latest < self.position:
+            self.position = latest
+            raise InvalidationGap("The invalidation log was reset")
+        keys = [f'hydra:invalidation:{number}' for number in range(self.position + 1, latest + 1)]
+        payloads = cache.get_many(keys)
+        for index, key in enumerate(keys):
+            if key in payloads:
+                continue
+            # Numbered but not written yet by its publisher, or expired
+            number = self.position + 1 + index
+            now = time.monotonic()
+            if self._missing_since is None:
+                self._missing_since = now
+            if now - self._missing_since < self.grace:
+                # Read it again next time, along with the batches after it
+                self.position = number - 1
+                return [payloads[key] for key in keys[:index]]
+            self._missing_since = None
+            self.position = latest
+            raise InvalidationGap(f"Invalidation batch {number} is missing")
+        self._missing_since = None
+        self.position = latest
+        return list(payloads.values())
+
+
+class PostgresNotifyBackend:
+    """
+    PostgreSQL NOTIFY, received on a dedicated LISTEN connection. Works with
+    psycopg 3 and psycopg2.
+    """
+
+    # NOTIFY payloads must stay under 8000 bytes
+    max_payload = 7900
+
+    def __init__(self, alias='default', channel='hydra_invalidation'):
+        self.alias = alias
+        self.channel = channel
+        self._listener = None
+        self._received = []
+
+    def subscribe(self):
+        # Not the thread's connection: it must stay in autocommit and idle
+        listener = connections.create_connection(self.alias)
+        listener.ensure_connection()
+        raw = listener.connection
+        raw.autocommit = True
+        if hasattr(raw, 'add_notify_handler'):
+            raw.add_notify_handler(lambda notify: self._received.append(notify.payload))
+        raw.cursor().execute(f'LISTEN {listener.ops.quote_name(self.channel)}')
+        self._listener = listener
+
+    def publish(self, payload):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def receive(self, timeout):
+        if self._listener is None:
+            self.subscribe()
+            raise InvalidationGap("Listening again after losing the connection")
+        raw = self._listener.connection
+        try:
+            readable, _, _ = select.select([raw], [], [], timeout)
+            if readable:
+                if hasattr(raw, 'add_notify_handler'):
+                    # psycopg 3 runs the notify handlers while it reads
+                    raw.execute('SELECT 1')
+                else:
+                    raw.poll()
+                    self._received.extend(notify.payload for notify in raw.notifies)
+                    del raw.notifies[:]
+        except Exception as e:
+            self._listener.close()
+            self._listener = None
+            raise InvalidationGap(f"The LISTEN connection was lost: {e}")
+        received, self._received = self._received, []
+        return received
+
+
+class InvalidationBus:
+    """
+    Publish this process's invalidations and apply everyone else's.
+    """
+
+    def __init__(self, backend, interval=None):
+        self.backend = backend
+        self.interval = interval or getattr(settings, 'HYDRA_INVALIDATION_INTERVAL', 0.5)
+        self.origin = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def ensure_started(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._worker_pid != os.getpid():
+            with self._lock:
+                if self._worker_pid != os.getpid():
+                    self.origin = uuid.uuid4().hex
+                    self._pending = []
+                    # Subscribe before anything is cached, so no event is missed
+                    self.backend.subscribe()
+                    self._worker_pid = os.getpid()
+                    threading.Thread(target=self._run, name='hydra-invalidation', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush()
+                self.poll(self.interval)
+            except Exception as e:
+                print(f"Exception when exchanging invalidations: {e}")
+                close_old_connections()
+                time.sleep(self.interval)
+
+    def publish(self, cache_name, key):
+        """
+        Queue an invalidation for the other processes.
+        """
+        with self._lock:
+            self._pending.append((cache_name, key))
+
+    def flush(self):
+        """
+        Publish the queued invalidations, in as few messages as the backend allows.
+        """
+        with self._lock:
+            events, self._pending = self._pending, []
+        if not events:
+            return
+        events = list(dict.fromkeys(events))
+        max_payload = getattr(self.backend, 'max_payload', None)
+        batch = []
+        for event in events:
+            batch.append(event)
+            if max_payload and len(batch) > 1 and len(self._encode(batch)) > max_payload:
+                self.backend.publish(self._encode(batch[:-1]))
+                batch = [event]
+        self.backend.publish(self._encode(batch))
+        metrics.increment('hydra_invalidations_published', len(events))
+
+    def _encode(self, events):
+        return json.dumps({'origin': self.origin, 'events': events})
+
+    def poll(self, timeout=0):
+        """
+        Apply the batches received within timeout seconds.
+
+        Returns:
+            int: The number of keys dropped
+        """
+        try:
+            payloads = self.backend.receive(timeout)
+        except InvalidationGap as e:
+            print(f"Clearing local caches: {e}")
+            metrics.increment('hydra_invalidation_gaps')
+            for cache in _caches.values():
+                cache.local.clear()
+            return 0
+
+        dropped = 0
+        for payload in payloads:
+            batch = json.loads(payload)
+            if batch['origin'] == self.origin:
+                # Dropped locally when it happened
+                continue
+            for cache_name, key in batch['events']:
+                cache = _caches.get(cache_name)
+                if cache is not None:
+                    cache.local.delete(key)
+                    dropped += 1
+        if dropped:
+            metrics.increment('hydra_invalidations_received', dropped)
+        return dropped
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_invalidation_bus():
+    """
+    Get the bus of HYDRA_INVALIDATION_BACKEND, or None if it is not set.
+    """
+    global _bus
+    if _bus is None:
+        backend = getattr(settings, 'HYDRA_INVALIDATION_BACKEND', None)
+        if not backend:
+            return None
+        with _bus_lock:
+            if _bus is None:
+                _bus = InvalidationBus(import_string(backend)())
+    return _bus
+
+
+def ensure_listening():
+    """
+    Start receiving invalidations in this process, if a backend is set.
+    """
+    bus = get_invalidation_bus()
+    if bus is not None:
+        bus.ensure_started()
+
+
+def publish(cache_name, key):
+    """
+    Tell the other processes to drop a key once the current transaction
+    commits, after the shared tier has dropped it again, so that they reload
+    the committed value. Until the batch arrives they may still serve their
+    local copy.
+    """
+    bus = get_invalidation_bus()
+    if bus is not None:
+        bus.ensure_started()
+        transaction.on_commit(lambda: bus.publish(cache_name, key))
@@ -0,0 +1,214 @@
+"""
+Offline verification of JWT access tokens issued by Hydra.
+
+Hydra's public JWKS is fetched from the default cluster and cached; signatures
+and claims are then checked locally, so verifying a token needs no network
+call. Keys are refreshed when the cache expires and, rate limited, when a
+token names a key ID the cache does not know yet (key rotation). A failed
+fetch is retried no sooner than a rotation refetch would be.
+
+Only the RSA algorithms Hydra signs with (RS256/RS384/RS512) are supported.
+Signatures are checked with the cryptography package's RSA implementation.
+"""
+
+
+import base64
+import json
+import threading
+import time
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.conf import settings
+
+from . import metrics
+from .routing import get_router
+
+_ALGORITHMS = {
+    'RS256': hashes.SHA256,
+    'RS384': hashes.SHA384,
+    'RS512': hashes.SHA512,
+}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def b64url_decode(value):
+    if isinstance(value, str):
+        value = value.encode('ascii')
+    return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
+
+
+def _b64url_int(value):
+    return int.from_bytes(b64url_decode(value), 'big')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def looks_like_jwt(token):
+    """
+    Check whether a token has the shape of a JWS compact serialization.
+    """
+    if token.count('.') != 2:
+        return False
+    try:
+        header = json.loads(b64url_decode(token.split('.', 1)[0]))
+    except (TypeError, ValueError):
+        return False
+    return isinstance(header, dict) and 'alg' in header
+
+
+def verify_rsa_signature(public_key, algorithm, signing_input, signature):
+    """
+    Verify an RSASSA-PKCS1-v1_5 signature (RFC 8017, section 8.2.2).
+    """
+    try:
+        public_key.verify(signature, signing_input, padding.PKCS1v15(), _ALGORITHMS[algorithm]())
+    except InvalidSignature:
+        return False
+    return True
+
+
+class JWKSCache:
+    """
+    Cached RSA public keys from Hydra's public JWKS, keyed by key ID.
+    """
+
+    def __init__(self, hydra_client=None, ttl=None, min_refresh_interval=None):
+        self.hydra_client = hydra_client or get_router().for_cluster()
+        self.ttl = ttl if ttl is not None else getattr(settings, 'HYDRA_JWKS_CACHE_TTL', 300)
+        self.min_refresh_interval = (
+            min_refresh_interval if min_refresh_interval is not None
+            else getattr(settings, 'HYDRA_JWKS_MIN_REFRESH_INTERVAL', 30)
+        )
+        self._keys = {}
+        self._expires_at = 0
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        key_set = self.hydra_client.get_json_web_keys()
+        metrics.increment('hydra_jwks_refreshes', result='ok' if key_set else 'error')
+        self._refreshed_at = time.monotonic()
+        if not key_set:
+            # Keep serving the keys we have, and back off before asking a
+            # failing Hydra again
+            self._expires_at = self._refreshed_at + self.min_refresh_interval
+            return
+
+        keys = {}
+        for key in key_set.keys or []:
+            if key.kty == 'RSA' and key.use in (None, 'sig') and key.n and key.e:
+                try:
+                    keys[key.kid] = rsa.RSAPublicNumbers(_b64url_int(key.e), _b64url_int(key.n)).public_key()
+                except ValueError:
+                    # Not a usable RSA key, tokens naming it stay unverifiable
+                    continue
+        self._keys = keys
+        self._expires_at = time.monotonic() + self.ttl
+
+    def get_key(self, kid):
+        """
+        Get the RSA public key for a key ID, or None if Hydra has no such key.
+        """
+        now = time.monotonic()
+        if now >= self._expires_at:
+            # Only block when there is nothing to serve, otherwise let one
+            # thread refresh while the others use the current keys
+            if self._lock.acquire(blocking=not self._keys):
+                try:
+                    if time.monotonic() >= self._expires_at:
+                        self._refresh()
+                finally:
+                    self._lock.release()
+
+        key = self._keys.get(kid)
+        if key is None and now - self._refreshed_at >= self.min_refresh_interval:
+            # Possibly a freshly rotated key
+            with self._lock:
+                if self._refreshed_at <= now:
+                    self._refresh()
+            key = self._keys.get(kid)
+        return key
+
+
+class JWTVerifier:
+    """
+    Verify signatures and registered claims of Hydra-issued JWTs.
+    """
+
+    def __init__(self, jwks=None, issuer=None, audience=None, leeway=None):
+        self.jwks = jwks or JWKSCache()
+        issuer = issuer if issuer is not None else getattr(settings, 'HYDRA_JWT_ISSUER', settings.HYDRA_PUBLIC_URL)
+        self.issuer = issuer.rstrip('/') if issuer else None
+        self.audience = audience if audience is not None else getattr(settings, 'HYDRA_JWT_AUDIENCE', None)
+        self.leeway = leeway if leeway is not None else getattr(settings, 'HYDRA_JWT_LEEWAY', 30)
+
+    def verify(self, token):
+        """
+        Verify a JWT and return its claims.
+
+        Hydra puts granted scopes in the "scp" list; they are also exposed as
+        a space-separated "scope" claim, matching introspection results.
+
+        Raises:
+            InvalidToken: If the token is malformed, badly signed or its
+                claims are not acceptable
+        """
+        try:
+            encoded_header, encoded_payload, encoded_signature = token.split('.')
+            header = json.loads(b64url_decode(encoded_header))
+            claims = json.loads(b64url_decode(encoded_payload))
+            signature = b64url_decode(encoded_signature)
+        except ValueError as e:
+            raise InvalidToken(f"Malformed token: {e}")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise InvalidToken("Malformed token: header and claims must be JSON objects")
+
+        algorithm = header.get('alg')
+        if not isinstance(algorithm, str) or algorithm not in _ALGORITHMS:
+            raise InvalidToken(f"Unsupported algorithm: {algorithm}")
+
+        kid = header.get('kid')
+        if kid is not None and not isinstance(kid, str):
+            raise InvalidToken("Malformed token: kid must be a string")
+        key = self.jwks.get_key(kid)
+        if key is None:
+            raise InvalidToken(f"Unknown signing key: {kid}")
+
+        signing_input = f'{encoded_header}.{encoded_payload}'.encode('ascii')
+        if not verify_rsa_signature(key, algorithm, signing_input, signature):
+            raise InvalidToken("Invalid signature")
+
+        self._check_claims(claims)
+        scopes = claims.get('scp')
+        if 'scope' not in claims and isinstance(scopes, list) and all(isinstance(scope, str) for scope in scopes):
+            claims['scope'] = ' '.join(claims['scp'])
+        claims.setdefault('active', True)
+        return claims
+
+    def _check_claims(self, claims):
+        now = time.time()
+        if not _is_number(claims.get('exp')):
+            raise InvalidToken("Missing or malformed exp claim")
+        if now > claims['exp'] + self.leeway:
+            raise InvalidToken("Token expired")
+        if 'nbf' in claims:
+            if not _is_number(claims['nbf']):
+                raise InvalidToken("Malformed nbf claim")
+            if now < claims['nbf'] - self.leeway:
+                raise InvalidToken("Token not yet valid")
+        issuer = claims.get('iss')
+        if self.issuer and (not isinstance(issuer, str) or issuer.rstrip('/') != self.issuer):
+            raise InvalidToken("Unexpected issuer")
+        if self.audience:
+            audience = claims.get('aud') or []
+            if isinstance(audience, str):
+                audience = [audience]
+            if not isinstance(audience, list) or self.audience not in audience:
+                raise InvalidToken("Unexpected audience")
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hydra_auth.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed header value that makes the profiling middleware profile a request"
+
+    def handle(self, *args, **options):
+        header = getattr(settings, 'HYDRA_PROFILE_HEADER', 'X-Hydra-Profile')
+        self.stdout.write(f"{header}: {make_profile_token()}")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from hydra_auth.policies import skip_rates
+
+
+class Command(BaseCommand):
+    help = "Show per client how many accepted logins and consents skipped the page, from the audit log"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Days of audit events to count")
+        parser.add_argument('--limit', type=int, default=50, help="Rows to show, busiest first")
+
+    def handle(self, *args, **options):
+        rows = skip_rates(options['days'])[:options['limit']]
+        if not rows:
+            self.stdout.write("No accepted logins or consents in the audit log for that period")
+            return
+        self.stdout.write(f"{'client_id':40s} {'flow':8s} {'accepted':>9s} {'skipped':>9s} {'skip rate':>9s}")
+        for row in rows:
+            self.stdout.write(f"{row['client_id'] or '-':40s} {row['flow']:8s} {row['accepted']:9d} "
+                              f"{row['skipped']:9d} {row['skip_rate']:9.1%}")
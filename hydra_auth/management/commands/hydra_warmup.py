@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from hydra_auth.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Warm up Hydra connections, templates and the client metadata cache, and report the time taken"
+
+    def handle(self, *args, **options):
+        for name, seconds in warm_up().items():
+            self.stdout.write(f"{name:20s} {seconds * 1000:8.1f} ms")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from hydra_auth.audit import get_audit_log
+
+
+class Command(BaseCommand):
+    help = "Load audit events that were written to the fallback file into the database"
+
+    def handle(self, *args, **options):
+        audit_log = get_audit_log()
+        loaded = audit_log.load_fallback()
+        self.stdout.write(f"Loaded {loaded} audit events from {audit_log.fallback_path}")
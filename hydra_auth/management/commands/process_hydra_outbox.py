@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hydra_auth import outbox
+
+
+class Command(BaseCommand):
+    help = "Apply queued OAuth2 client changes to Hydra"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Entries claimed per batch")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new entries")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            applied, failed = outbox.drain(options['batch_size'])
+            if applied or failed:
+                self.stdout.write(f"Applied {applied} outbox entries ({failed} failed)")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
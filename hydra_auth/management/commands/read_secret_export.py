@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from hydra_auth.rotation import read_secret_export
+
+
+class Command(BaseCommand):
+    help = "Print the records of an encrypted secret rotation export as JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Export written by rotate_client_secrets")
+
+    def handle(self, *args, **options):
+        for record in read_secret_export(options['path']):
+            self.stdout.write(json.dumps(record))
@@ -0,0 +1,82 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hydra_auth.revocation import local_subjects, revoke_subjects
+from hydra_auth.routing import get_router
+
+
+class Command(BaseCommand):
+    help = "Revoke Hydra consent and login sessions for subjects, optionally limited to one client"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subject', action='append', default=[], help="Subject to revoke (repeatable)")
+        parser.add_argument('--subjects-file', help="File with one subject per line, '-' for stdin")
+        parser.add_argument('--all-users', action='store_true', help="Revoke for every local user")
+        parser.add_argument('--client', help="Only revoke consent granted to this client, and delete its tokens "
+                                             "(all local users unless subjects are given)")
+        parser.add_argument('--login', action='store_true', help="Also revoke login sessions")
+        parser.add_argument('--no-consent', action='store_true', help="Do not revoke consent sessions")
+        parser.add_argument('--concurrency', type=int, default=None, help="Hydra calls in flight")
+        parser.add_argument('--report', help="Write one JSON line per subject to this file")
+        parser.add_argument('--progress-every', type=float, default=2.0, help="Seconds between progress lines")
+
+    def _subjects(self, options):
+        yield from options['subject']
+        if options['subjects_file']:
+            stream = sys.stdin if options['subjects_file'] == '-' else open(options['subjects_file'])
+            with stream:
+                for line in stream:
+                    if line.strip():
+                        yield line.strip()
+        if options['all_users']:
+            yield from local_subjects()
+
+    def handle(self, *args, **options):
+        if not (options['subject'] or options['subjects_file'] or options['all_users'] or options['client']):
+            raise CommandError("Give --subject, --subjects-file, --all-users or --client")
+        if options['no_consent'] and not options['login']:
+            raise CommandError("Nothing to revoke, --no-consent needs --login")
+        if options['login'] and options['client']:
+            raise CommandError("Login sessions are not per client, --login cannot be combined with --client")
+        if not (options['subject'] or options['subjects_file']):
+            # With only --client, revoke the consent every local user granted it
+            options['all_users'] = True
+
+        hydra_client = None
+        if options['client']:
+            hydra_client = get_router().for_client_id(options['client'])
+            # Tokens already issued to the client stop working right away
+            if hydra_client.delete_oauth2_tokens(options['client']):
+                self.stdout.write(f"Deleted tokens issued to client '{options['client']}'")
+            else:
+                self.stderr.write(f"Failed to delete tokens issued to client '{options['client']}'")
+
+        report = open(options['report'], 'w') if options['report'] else None
+        done = failed = 0
+        start = last_progress = time.monotonic()
+        try:
+            for result in revoke_subjects(
+                self._subjects(options),
+                client_id=options['client'],
+                consent=not options['no_consent'],
+                login=options['login'],
+                concurrency=options['concurrency'],
+                hydra_client=hydra_client,
+            ):
+                done += 1
+                failed += not result.ok
+                if report:
+                    report.write(json.dumps(result._asdict()) + '\n')
+
+                now = time.monotonic()
+                if now - last_progress >= options['progress_every']:
+                    last_progress = now
+                    self.stdout.write(f"{done} subjects processed, {failed} failed ({done / (now - start):.0f}/s)")
+        finally:
+            if report:
+                report.close()
+
+        self.stdout.write(f"Done: {done} subjects processed, {failed} failed in {time.monotonic() - start:.1f}s")
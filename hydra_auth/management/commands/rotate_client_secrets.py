@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hydra_auth.rotation import (SecretExportWriter, activate_due_rotations,
+                                 rotatable_clients, stage_rotation)
+
+
+class Command(BaseCommand):
+    help = "Rotate the secrets of OAuth2 clients, announcing new secrets before they become active"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', action='append', default=[], help="Client to rotate (repeatable)")
+        parser.add_argument('--all', action='store_true', help="Rotate every client that authenticates with a secret")
+        parser.add_argument('--output', help="Encrypted file the new secrets are written to")
+        parser.add_argument('--grace', type=int, default=None, help="Seconds until the new secrets become active")
+        parser.add_argument('--activate', action='store_true', help="Push staged secrets that are due to Hydra")
+        parser.add_argument('--concurrency', type=int, default=None, help="Hydra calls in flight when activating")
+
+    def handle(self, *args, **options):
+        staging = options['all'] or options['client']
+        if not staging and not options['activate']:
+            raise CommandError("Give --client, --all or --activate")
+
+        if staging:
+            if not options['output']:
+                raise CommandError("--output is required when rotating secrets")
+            queryset = rotatable_clients(None if options['all'] else options['client'])
+            with SecretExportWriter(options['output']) as export:
+                staged = stage_rotation(queryset, export, grace=options['grace'])
+            self.stdout.write(f"Staged new secrets for {staged} clients, written to {options['output']}")
+
+        # Without a grace period the new secrets are due right away
+        if options['activate'] or options['grace'] == 0:
+            activated, failed = activate_due_rotations(options['concurrency'])
+            self.stdout.write(f"Activated {activated} secrets in Hydra ({failed} failed)")
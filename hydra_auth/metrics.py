@@ -0,0 +1,64 @@
+"""
+Lightweight in-process metrics for the Hydra integration.
+"""
+
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def increment(name, value=1, **labels):
+    """
+    Increment a counter, optionally qualified by labels.
+    """
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def get_counter(name, **labels):
+    """
+    Get the current value of a counter.
+    """
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def set_gauge(name, value, **labels):
+    """
+    Set a gauge to its current value.
+    """
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def get_gauge(name, **labels):
+    """
+    Get the current value of a gauge.
+    """
+    with _lock:
+        return _gauges.get(_key(name, labels), 0)
+
+
+def snapshot():
+    """
+    Return a copy of all counters and gauges keyed by (name, labels).
+    """
+    with _lock:
+        return {**_counters, **_gauges}
+
+
+def reset():
+    """
+    Clear all counters and gauges.
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
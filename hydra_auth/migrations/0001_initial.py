@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OAuth2Client',
+            fields=[
+                ('client_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('client_name', models.CharField(max_length=255)),
+                ('client_secret', models.CharField(blank=True, max_length=255, null=True)),
+                ('redirect_uris', models.TextField(help_text='Comma-separated list of redirect URIs')),
+                ('grant_types', models.TextField(blank=True, help_text='Comma-separated list of grant types')),
+                ('response_types', models.TextField(blank=True, help_text='Comma-separated list of response types')),
+                ('scope', models.TextField(blank=True, help_text='Space-separated list of scopes')),
+                ('token_endpoint_auth_method', models.CharField(choices=[('client_secret_basic', 'Client Secret Basic'), ('client_secret_post', 'Client Secret Post'), ('private_key_jwt', 'Private Key JWT'), ('none', 'None')], default='client_secret_basic', max_length=50)),
+                ('audience', models.TextField(blank=True, help_text='Comma-separated list of audiences')),
+                ('client_uri', models.URLField(blank=True, null=True)),
+                ('logo_uri', models.URLField(blank=True, null=True)),
+                ('contacts', models.TextField(blank=True, help_text='Comma-separated list of contact emails')),
+                ('tos_uri', models.URLField(blank=True, help_text='Terms of service URI', null=True)),
+                ('policy_uri', models.URLField(blank=True, help_text='Policy URI', null=True)),
+                ('jwks_uri', models.URLField(blank=True, help_text='JSON Web Key Set URI', null=True)),
+                ('allow_cors_requests', models.BooleanField(default=False)),
+                ('fingerprint', models.CharField(blank=True, editable=False, help_text='Hash of the client state last synchronized with Hydra', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
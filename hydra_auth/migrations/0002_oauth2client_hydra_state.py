@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydra_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oauth2client',
+            name='hydra_state',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Canonical client state last synchronized with Hydra'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 13:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydra_auth', '0003_hydraoutboxentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('login_accepted', 'Login accepted'), ('login_rejected', 'Login rejected'), ('login_failed', 'Login failed'), ('consent_accepted', 'Consent accepted'), ('consent_rejected', 'Consent rejected'), ('logout_accepted', 'Logout accepted'), ('logout_rejected', 'Logout rejected')], max_length=20)),
+                ('subject', models.CharField(blank=True, max_length=255)),
+                ('client_id', models.CharField(blank=True, max_length=255)),
+                ('remote_addr', models.GenericIPAddressField(blank=True, null=True)),
+                ('details', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_date', models.DateField(editable=False)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_date', 'event_type'], name='hydra_auth__created_8b2296_idx'), models.Index(fields=['created_date', 'subject'], name='hydra_auth__created_837ad7_idx'), models.Index(fields=['created_date', 'client_id'], name='hydra_auth__created_f6bc72_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydra_auth', '0004_auditevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oauth2client',
+            name='next_client_secret',
+            field=models.CharField(blank=True, editable=False, help_text='Rotated secret announced to the client owner, not yet active in Hydra', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='oauth2client',
+            name='next_secret_activates_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the rotated secret replaces the current one in Hydra', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydra_auth', '0005_oauth2client_secret_rotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hydraoutboxentry',
+            name='cluster',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='oauth2client',
+            name='hydra_cluster',
+            field=models.CharField(blank=True, editable=False, help_text='Hydra cluster the client lives on, assigned when it is first created there', max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydra_auth', '0007_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='oauth2client',
+            index=models.Index(fields=['token_endpoint_auth_method'], name='hydra_auth__token_e_ac78cd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='oauth2client',
+            index=models.Index(fields=['allow_cors_requests'], name='hydra_auth__allow_c_051c00_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='oauth2client',
+            index=models.Index(fields=['created_at', 'client_id'], name='hydra_auth__created_1d23ad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='oauth2client',
+            index=models.Index(fields=['updated_at', 'client_id'], name='hydra_auth__updated_52c8b5_idx'),
+        ),
+    ]
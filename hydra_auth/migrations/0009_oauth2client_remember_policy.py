@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydra_auth', '0008_oauth2client_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oauth2client',
+            name='consent_remember',
+            field=models.CharField(choices=[('ask', 'Ask the user'), ('always', 'Always remember'), ('never', 'Never remember')], default='ask', help_text='Whether Hydra remembers a consent, so the next one for this client skips the consent page', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='oauth2client',
+            name='consent_remember_for',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds a consent is remembered, 0 for ever, empty for HYDRA_CONSENT_REMEMBER_FOR', null=True),
+        ),
+        migrations.AddField(
+            model_name='oauth2client',
+            name='login_remember',
+            field=models.CharField(choices=[('ask', 'Ask the user'), ('always', 'Always remember'), ('never', 'Never remember')], default='ask', help_text='Whether Hydra remembers a login, so the next one for this client skips the login page', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='oauth2client',
+            name='login_remember_for',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds a login is remembered, 0 for the browser session, empty for HYDRA_LOGIN_REMEMBER_FOR', null=True),
+        ),
+    ]
@@ -1,4 +1,9 @@
+import hashlib
+import json
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 
 class OAuth2Client(models.Model):
@@ -6,6 +11,20 @@ class OAuth2Client(models.Model):
     Model to represent an OAuth2 client in the database.
     This model stores a local representation of clients managed through Hydra.
     """
+    SECRET_AUTH_METHODS = ('client_secret_basic', 'client_secret_post')
+    REMEMBER_ASK = 'ask'
+    REMEMBER_ALWAYS = 'always'
+    REMEMBER_NEVER = 'never'
+    REMEMBER_CHOICES = [
+        (REMEMBER_ASK, "Ask the user"),
+        (REMEMBER_ALWAYS, "Always remember"),
+        (REMEMBER_NEVER, "Never remember"),
+    ]
+    # How logins and consents for the client are remembered, applied by this app on accept
+    POLICY_FIELDS = ('login_remember', 'login_remember_for', 'consent_remember', 'consent_remember_for')
+    # Fields Hydra knows nothing about, kept when mirroring clients from Hydra
+    LOCAL_ONLY_FIELDS = ('next_client_secret', 'next_secret_activates_at', 'created_at', 'updated_at') + POLICY_FIELDS
+    
     client_id = models.CharField(max_length=255, primary_key=True)
     client_name = models.CharField(max_length=255)
     client_secret = models.CharField(max_length=255, blank=True, null=True)
@@ -31,9 +50,72 @@ class OAuth2Client(models.Model):
     policy_uri = models.URLField(blank=True, null=True, help_text="Policy URI")
     jwks_uri = models.URLField(blank=True, null=True, help_text="JSON Web Key Set URI")
     allow_cors_requests = models.BooleanField(default=False)
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        help_text="Hash of the client state last synchronized with Hydra"
+    )
+    hydra_state = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Canonical client state last synchronized with Hydra"
+    )
+    next_client_secret = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Rotated secret announced to the client owner, not yet active in Hydra"
+    )
+    next_secret_activates_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="When the rotated secret replaces the current one in Hydra"
+    )
+    hydra_cluster = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        help_text="Hydra cluster the client lives on, assigned when it is first created there"
+    )
+    login_remember = models.CharField(
+        max_length=10,
+        choices=REMEMBER_CHOICES,
+        default=REMEMBER_ASK,
+        help_text="Whether Hydra remembers a login, so the next one for this client skips the login page"
+    )
+    login_remember_for = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Seconds a login is remembered, 0 for the browser session, empty for HYDRA_LOGIN_REMEMBER_FOR"
+    )
+    consent_remember = models.CharField(
+        max_length=10,
+        choices=REMEMBER_CHOICES,
+        default=REMEMBER_ASK,
+        help_text="Whether Hydra remembers a consent, so the next one for this client skips the consent page"
+    )
+    consent_remember_for = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Seconds a consent is remembered, 0 for ever, empty for HYDRA_CONSENT_REMEMBER_FOR"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Admin list filters
+            models.Index(fields=['token_endpoint_auth_method']),
+            models.Index(fields=['allow_cors_requests']),
+            # Admin ordering, with the primary key Django adds to make it total
+            models.Index(fields=['created_at', 'client_id']),
+            models.Index(fields=['updated_at', 'client_id']),
+        ]
+    
     def __str__(self):
         return f"{self.client_name} ({self.client_id})"
     
@@ -110,6 +192,80 @@ class OAuth2Client(models.Model):
             'allow_cors_requests': self.allow_cors_requests,
         }
     
+    def get_remember_policy(self):
+        """
+        The login and consent remember policy, see hydra_auth.policies.
+        """
+        return {field: getattr(self, field) for field in self.POLICY_FIELDS}
+    
+    def to_canonical_dict(self):
+        """
+        Canonical form of to_hydra_dict used for change detection.
+        Empty strings and None are treated alike, since Hydra returns either,
+        and the secret is reduced to a hash so it is never stored twice.
+        """
+        canonical = {
+            key: (value if value not in ('', None) else None)
+            for key, value in self.to_hydra_dict().items()
+        }
+        if canonical['client_secret']:
+            canonical['client_secret'] = hashlib.sha256(canonical['client_secret'].encode('utf-8')).hexdigest()
+        return canonical
+    
+    @staticmethod
+    def _hash_state(state):
+        payload = json.dumps(state, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def compute_fingerprint(self):
+        """Hash the canonical Hydra representation of this client"""
+        return self._hash_state(self.to_canonical_dict())
+    
+    def is_synced(self):
+        """Check whether the client is unchanged since it was last synchronized with Hydra"""
+        return bool(self.fingerprint) and self.fingerprint == self.compute_fingerprint()
+    
+    def mark_synced(self):
+        """Record the current state as the one known to Hydra"""
+        self.hydra_state = self.to_canonical_dict()
+        self.fingerprint = self.compute_fingerprint()
+    
+    def mark_secret_synced(self):
+        """
+        Record that Hydra has the current secret, without marking other
+        unsynchronized local changes as synced.
+        """
+        if self.hydra_state:
+            self.hydra_state['client_secret'] = self.to_canonical_dict()['client_secret']
+            self.fingerprint = self._hash_state(self.hydra_state)
+    
+    def to_hydra_patch(self):
+        """
+        Build a JSON Patch (RFC 6902) with the fields that differ from the
+        last known Hydra state.
+        
+        Returns:
+            list: Patch operations, or None if no Hydra state is known yet
+        """
+        if not self.hydra_state:
+            return None
+        
+        data = self.to_hydra_dict()
+        patch = []
+        for key, value in self.to_canonical_dict().items():
+            if key == 'client_id' or self.hydra_state.get(key) == value:
+                continue
+            if key == 'client_secret' and value is None:
+                # An empty local secret means "keep the one Hydra has"
+                continue
+            # "add" replaces existing members and creates missing ones
+            patch.append({
+                'op': 'add',
+                'path': f'/{key}',
+                'value': data[key] if data[key] is not None else '',
+            })
+        return patch
+    
     @classmethod
     def from_hydra_client(cls, hydra_client):
         """
@@ -155,6 +311,186 @@ class OAuth2Client(models.Model):
             client.set_contacts_list(hydra_client.contacts)
         
         # Set CORS
-        client.allow_cors_requests = hydra_client.allow_cors_requests or False
+        client.allow_cors_requests = getattr(hydra_client, 'allow_cors_requests', None) or False
         
         return client
+    
+    @classmethod
+    def sync_from_hydra_clients(cls, hydra_clients, cluster=''):
+        """
+        Mirror Hydra clients into the database, writing only the rows whose
+        fingerprint differs from the stored one. Clients with pending outbox
+        entries keep their local state.
+        
+        Args:
+            hydra_clients (list): Clients listed by one Hydra cluster
+            cluster (str): Name of that cluster
+        
+        Returns:
+            tuple: (list of OAuth2Client instances, number of skipped writes)
+        """
+        incoming = [cls.from_hydra_client(hc) for hc in hydra_clients]
+        for client in incoming:
+            client.hydra_cluster = cluster
+        client_ids = [client.client_id for client in incoming]
+        existing = cls.objects.in_bulk(client_ids)
+        
+        # Clients with queued local changes must not be overwritten by Hydra
+        pending = set(
+            HydraOutboxEntry.objects.filter(client_id__in=client_ids).values_list('client_id', flat=True)
+        )
+        
+        clients = []
+        skipped = 0
+        for client in incoming:
+            current = existing.get(client.client_id)
+            if client.client_id in pending:
+                if current is not None:
+                    clients.append(current)
+                continue
+            if current is None:
+                client.mark_synced()
+                client.save()
+                clients.append(client)
+                continue
+            
+            # Hydra never returns stored secrets, so keep the local one
+            if client.client_secret is None:
+                client.client_secret = current.client_secret
+            # Hydra has no such field, the flag only exists locally
+            client.allow_cors_requests = current.allow_cors_requests
+            
+            if client.compute_fingerprint() == current.fingerprint:
+                skipped += 1
+            else:
+                for field in cls._meta.concrete_fields:
+                    if field.name not in cls.LOCAL_ONLY_FIELDS:
+                        setattr(current, field.attname, getattr(client, field.attname))
+                current.mark_synced()
+                current.save()
+            clients.append(current)
+        
+        return clients, skipped
+
+
+class HydraOutboxEntry(models.Model):
+    """
+    A Hydra write enqueued in the same transaction as the local change.
+    Entries are drained by the process_hydra_outbox management command and
+    removed once Hydra has accepted them.
+    """
+    OPERATION_CREATE = 'create'
+    OPERATION_UPDATE = 'update'
+    OPERATION_DELETE = 'delete'
+    
+    STATUS_PENDING = 'pending'
+    STATUS_FAILED = 'failed'
+    
+    idempotency_key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    client_id = models.CharField(max_length=255, db_index=True)
+    # Deletes outlive the local row, so they carry the client's cluster
+    cluster = models.CharField(max_length=64, blank=True)
+    operation = models.CharField(
+        max_length=10,
+        choices=[
+            (OPERATION_CREATE, "Create"),
+            (OPERATION_UPDATE, "Update"),
+            (OPERATION_DELETE, "Delete"),
+        ]
+    )
+    status = models.CharField(
+        max_length=10,
+        default=STATUS_PENDING,
+        choices=[
+            (STATUS_PENDING, "Pending"),
+            (STATUS_FAILED, "Failed"),
+        ]
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        verbose_name_plural = "Hydra outbox entries"
+    
+    def __str__(self):
+        return f"{self.operation} {self.client_id} ({self.status})"
+
+
+class AuditEvent(models.Model):
+    """
+    A login, consent or logout decision. Events are buffered in-process and
+    written in batches by hydra_auth.audit, never one INSERT per request.
+    
+    Queries should filter on created_date, which every index leads with, so
+    the table can also be range-partitioned by date on PostgreSQL.
+    """
+    LOGIN_ACCEPTED = 'login_accepted'
+    LOGIN_REJECTED = 'login_rejected'
+    LOGIN_FAILED = 'login_failed'
+    CONSENT_ACCEPTED = 'consent_accepted'
+    CONSENT_REJECTED = 'consent_rejected'
+    LOGOUT_ACCEPTED = 'logout_accepted'
+    LOGOUT_REJECTED = 'logout_rejected'
+    
+    event_type = models.CharField(
+        max_length=20,
+        choices=[
+            (LOGIN_ACCEPTED, "Login accepted"),
+            (LOGIN_REJECTED, "Login rejected"),
+            (LOGIN_FAILED, "Login failed"),
+            (CONSENT_ACCEPTED, "Consent accepted"),
+            (CONSENT_REJECTED, "Consent rejected"),
+            (LOGOUT_ACCEPTED, "Logout accepted"),
+            (LOGOUT_REJECTED, "Logout rejected"),
+        ]
+    )
+    subject = models.CharField(max_length=255, blank=True)
+    client_id = models.CharField(max_length=255, blank=True)
+    remote_addr = models.GenericIPAddressField(blank=True, null=True)
+    details = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    created_date = models.DateField(editable=False)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_date', 'event_type']),
+            models.Index(fields=['created_date', 'subject']),
+            models.Index(fields=['created_date', 'client_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.subject} ({self.created_at:%Y-%m-%d %H:%M:%S})"
+    
+    def save(self, *args, **kwargs):
+        self.created_date = self.created_at.date()
+        super().save(*args, **kwargs)
+
+
+class RequestProfile(models.Model):
+    """
+    A sampled profile of one request, written by hydra_auth.profiling.
+    The collapsed stacks are stored in HYDRA_PROFILE_DIR under file_name.
+    """
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    view_name = models.CharField(max_length=255, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    samples = models.PositiveIntegerField()
+    hydra_calls = models.PositiveIntegerField()
+    hydra_ms = models.FloatField()
+    file_name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
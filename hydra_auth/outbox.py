@@ -0,0 +1,231 @@
+"""
+Transactional outbox for writes from OAuth2Client to Hydra.
+
+Local changes call enqueue() inside the transaction that saves them, so a
+Hydra operation is queued if and only if the change is committed. drain()
+claims due entries in batches, applies them to Hydra and retries failures
+with exponential backoff until Hydra converges with the database.
+"""
+
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .client_cache import invalidate_client_metadata
+from .models import HydraOutboxEntry, OAuth2Client
+from .routing import get_router
+
+
+def enqueue(client_id, operation, cluster=''):
+    """
+    Queue a Hydra operation for a client.
+
+    Must be called inside the transaction that writes the local row.
+    Deletes should pass the client's hydra_cluster, as the row will be gone.
+    """
+    return HydraOutboxEntry.objects.create(client_id=client_id, operation=operation, cluster=cluster)
+
+
+def enqueue_many(client_ids, operation, clusters=None):
+    """
+    Queue the same Hydra operation for several clients in one insert.
+
+    Args:
+        clusters (dict, optional): Cluster of each client_id, for deletes
+    """
+    clusters = clusters or {}
+    return HydraOutboxEntry.objects.bulk_create([
+        HydraOutboxEntry(client_id=client_id, operation=operation, cluster=clusters.get(client_id, ''))
+        for client_id in client_ids
+    ])
+
+
+def claim_batch(batch_size):
+    """
+    Claim up to batch_size due entries.
+
+    Claimed entries are leased by pushing next_attempt_at into the future,
+    so concurrent workers skip them and a crashed worker's entries become
+    due again once the lease expires.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'HYDRA_OUTBOX_LEASE_SECONDS', 60))
+
+    with transaction.atomic():
+        entries = list(
+            HydraOutboxEntry.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=HydraOutboxEntry.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        if entries:
+            HydraOutboxEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+                next_attempt_at=now + lease,
+                attempts=F('attempts') + 1,
+            )
+
+    for entry in entries:
+        entry.attempts += 1
+    return entries
+
+
+def _mark_synced(client, extra_fields=()):
+    client.mark_synced()
+    client.save(update_fields=['fingerprint', 'hydra_state', *extra_fields])
+
+
+def _record_created(hydra_client, client, hydra_response):
+    """
+    Write back what Hydra assigned when it created a client.
+
+    Returns:
+        list: Fields of client that still need saving
+    """
+    # Pin the client to the cluster it now lives on, even if re-keyed below
+    client.hydra_cluster = hydra_client.cluster
+    extra_fields = ['hydra_cluster']
+    if hydra_response.client_secret and not client.client_secret:
+        client.client_secret = hydra_response.client_secret
+        extra_fields.append('client_secret')
+
+    if hydra_response.client_id and hydra_response.client_id != client.client_id:
+        # Hydra assigned its own ID: re-key the row and any later entries
+        OAuth2Client.objects.filter(pk=client.client_id).update(client_id=hydra_response.client_id)
+        HydraOutboxEntry.objects.filter(client_id=client.client_id).update(client_id=hydra_response.client_id)
+        invalidate_client_metadata(client.client_id)
+        client.client_id = hydra_response.client_id
+
+    return extra_fields
+
+
+def _create(hydra_client, client, entry):
+    """
+    Create a client in Hydra, tagged with the entry's idempotency key, and
+    write back any generated identifiers.
+    """
+    client_data = client.to_hydra_dict()
+    client_data['metadata'] = {'idempotency_key': str(entry.idempotency_key)}
+    hydra_response = hydra_client.create_oauth2_client(client_data)
+    if not hydra_response:
+        return False
+
+    _mark_synced(client, _record_created(hydra_client, client, hydra_response))
+    return True
+
+
+def _find_created(hydra_client, client, entry):
+    """
+    Find the Hydra client an earlier attempt of a create entry made.
+
+    Hydra may have assigned its own ID, so clients of the same name are
+    matched by the idempotency key in their metadata.
+    """
+    existing = hydra_client.get_oauth2_client(client.client_id)
+    if existing:
+        return existing
+
+    key = str(entry.idempotency_key)
+    for candidate in hydra_client.list_oauth2_clients(client_name=client.client_name):
+        if (getattr(candidate, 'metadata', None) or {}).get('idempotency_key') == key:
+            return candidate
+    return None
+
+
+def apply_entry(hydra_client, entry):
+    """
+    Apply one outbox entry to Hydra.
+
+    Every operation is idempotent: creates and updates read the current
+    local row, so replays and superseded entries become no-ops, a retried
+    create adopts the client an earlier attempt made (found by the entry's
+    idempotency key), and a delete of a client Hydra no longer has counts
+    as done.
+
+    Args:
+        hydra_client (HydraClient): Client to use, or None to route the
+            entry to the cluster of its OAuth2 client
+
+    Returns:
+        bool: True once Hydra reflects the local state
+    """
+    router = get_router()
+    if entry.operation == HydraOutboxEntry.OPERATION_DELETE:
+        hydra_client = hydra_client or router.for_cluster(entry.cluster or router.cluster_for_key(entry.client_id))
+        if not hydra_client.delete_oauth2_client(entry.client_id):
+            return False
+        # The entry may have been re-cached from Hydra since the local delete
+        invalidate_client_metadata(entry.client_id)
+        return True
+
+    client = OAuth2Client.objects.filter(client_id=entry.client_id).first()
+    if client is None:
+        # Deleted locally in the meantime, the delete entry handles Hydra
+        return True
+
+    hydra_client = hydra_client or router.for_client(client)
+
+    if client.is_synced():
+        metrics.increment('hydra_client_writes_skipped', source='outbox')
+        return True
+
+    if entry.operation == HydraOutboxEntry.OPERATION_CREATE and not client.fingerprint:
+        # A retried create may already have reached Hydra before failing
+        created = _find_created(hydra_client, client, entry) if entry.attempts > 1 else None
+        if not created:
+            return _create(hydra_client, client, entry)
+        # Adopt it, then bring it up to date with the local row below
+        client.save(update_fields=_record_created(hydra_client, client, created))
+
+    if not hydra_client.push_oauth2_client(client):
+        return False
+    _mark_synced(client)
+    return True
+
+
+def _reschedule(entry, error):
+    max_attempts = getattr(settings, 'HYDRA_OUTBOX_MAX_ATTEMPTS', 10)
+    base_delay = getattr(settings, 'HYDRA_OUTBOX_RETRY_DELAY', 5)
+
+    entry.last_error = error
+    if entry.attempts >= max_attempts:
+        entry.status = HydraOutboxEntry.STATUS_FAILED
+    else:
+        delay = min(base_delay * 2 ** (entry.attempts - 1), 3600)
+        entry.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    entry.save(update_fields=['status', 'next_attempt_at', 'last_error'])
+
+
+def drain(batch_size=None, hydra_client=None):
+    """
+    Process one batch of due outbox entries, each routed to its cluster
+    unless hydra_client is given.
+
+    Returns:
+        tuple: (number of entries applied, number of entries that failed)
+    """
+    batch_size = batch_size or getattr(settings, 'HYDRA_OUTBOX_BATCH_SIZE', 100)
+
+    applied = []
+    failed = 0
+    for entry in claim_batch(batch_size):
+        try:
+            ok = apply_entry(hydra_client, entry)
+            error = '' if ok else f"Hydra did not accept the {entry.operation} request"
+        except Exception as e:
+            ok = False
+            error = str(e)
+
+        metrics.increment('hydra_outbox_processed', operation=entry.operation, result='ok' if ok else 'error')
+        if ok:
+            applied.append(entry.pk)
+        else:
+            failed += 1
+            _reschedule(entry, error)
+
+    HydraOutboxEntry.objects.filter(pk__in=applied).delete()
+    return len(applied), failed
@@ -0,0 +1,75 @@
+"""
+Pagination for very large tables.
+
+An exact COUNT(*) scans the whole table, which takes longer than the rest of
+an admin page once a table holds millions of rows. EstimatedCountPaginator
+asks the database statistics for the row count of unfiltered querysets and
+uses it once it is above HYDRA_ADMIN_COUNT_ESTIMATE_THRESHOLD. Filtered
+querysets, and tables the database keeps no statistics for, are counted
+exactly; small results are counted on a slice that stops past the threshold.
+"""
+
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Get the row count the database statistics hold for a model's table.
+
+    Returns:
+        int: The estimated number of rows, or None if the database keeps no
+            statistics for the table (on SQLite, until ANALYZE has run)
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)"
+    elif connection.vendor == 'mysql':
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+    elif connection.vendor == 'sqlite':
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except Exception:
+        # sqlite_stat1 only exists once ANALYZE has run
+        return None
+    if row is None or row[0] is None:
+        return None
+    # SQLite stores "rows [rows per key ...]" as text
+    estimate = int(str(row[0]).split()[0])
+    # PostgreSQL reports -1 for tables that were never analyzed
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that does not count very large querysets exactly.
+    """
+
+    def __init__(self, *args, threshold=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold or getattr(settings, 'HYDRA_ADMIN_COUNT_ESTIMATE_THRESHOLD', 10000)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.threshold:
+                return estimate
+        queryset = queryset.order_by()
+        # Counting a slice stops past the threshold instead of scanning every match
+        count = queryset[:self.threshold + 1].count()
+        if count <= self.threshold:
+            return count
+        # Beyond the threshold only an exact count keeps every page reachable
+        return queryset.count()
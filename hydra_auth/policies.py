@@ -0,0 +1,100 @@
+"""
+Per-client remember policies and skip-rate analytics.
+
+Hydra skips the login and consent pages when it remembers an earlier login
+or consent of the user for the client. Each OAuth2Client chooses whether
+its logins and consents are remembered (ask the user, always or never) and
+for how long; the views apply that policy whenever they accept a request.
+The policy is read from the client metadata cache, so it costs no query
+once a client has been seen.
+
+Every login and consent challenge is counted in the hydra_challenges
+metric by flow, client and whether Hydra skipped the page. skip_rates()
+computes the same rates over a period from the audit log, to judge
+whether a policy is worth changing.
+"""
+
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import metrics
+from .client_cache import get_client_metadata
+from .models import AuditEvent, OAuth2Client
+
+
+def get_remember_policy(client_id, hydra_client=None, hydra_data=None):
+    """
+    Get a client's remember policy, with the defaults filled in.
+
+    Returns:
+        dict: login_remember, login_remember_for, consent_remember and
+            consent_remember_for
+    """
+    policy = {
+        'login_remember': OAuth2Client.REMEMBER_ASK,
+        'login_remember_for': None,
+        'consent_remember': OAuth2Client.REMEMBER_ASK,
+        'consent_remember_for': None,
+    }
+    metadata = get_client_metadata(client_id, hydra_client, hydra_data) if client_id else None
+    if metadata is not None:
+        policy.update(metadata.get('remember_policy') or {})
+    if policy['login_remember_for'] is None:
+        policy['login_remember_for'] = getattr(settings, 'HYDRA_LOGIN_REMEMBER_FOR', 3600)
+    if policy['consent_remember_for'] is None:
+        policy['consent_remember_for'] = getattr(settings, 'HYDRA_CONSENT_REMEMBER_FOR', 3600)
+    return policy
+
+
+def remember_decision(policy, flow, requested):
+    """
+    Decide how Hydra remembers an accepted login or consent.
+
+    Args:
+        policy (dict): The client's policy from get_remember_policy()
+        flow (str): 'login' or 'consent'
+        requested (bool): Whether the user asked to be remembered
+
+    Returns:
+        tuple: (remember, remember_for) for the accept request
+    """
+    mode = policy[f'{flow}_remember']
+    remember = requested if mode == OAuth2Client.REMEMBER_ASK else mode == OAuth2Client.REMEMBER_ALWAYS
+    return remember, policy[f'{flow}_remember_for']
+
+
+def record_challenge(flow, client_id, skipped):
+    """
+    Count a login or consent challenge that Hydra skipped or that showed a page.
+    """
+    metrics.increment('hydra_challenges', flow=flow, client=client_id or '', skip=str(bool(skipped)).lower())
+
+
+def skip_rates(days=7):
+    """
+    Share of accepted logins and consents per client that skipped the page,
+    from the audit log of the last days.
+
+    Returns:
+        list: Dicts with client_id, flow, accepted, skipped and skip_rate,
+            busiest first
+    """
+    since = timezone.localdate() - timedelta(days=days)
+    flows = {AuditEvent.LOGIN_ACCEPTED: 'login', AuditEvent.CONSENT_ACCEPTED: 'consent'}
+    rows = (
+        AuditEvent.objects.filter(created_date__gte=since, event_type__in=flows)
+        .values('client_id', 'event_type')
+        .annotate(accepted=Count('id'), skipped=Count('id', filter=Q(details__skip=True)))
+        .order_by('-accepted', 'client_id')
+    )
+    return [{
+        'client_id': row['client_id'],
+        'flow': flows[row['event_type']],
+        'accepted': row['accepted'],
+        'skipped': row['skipped'],
+        'skip_rate': row['skipped'] / row['accepted'],
+    } for row in rows]
@@ -0,0 +1,163 @@
+"""
+On-demand sampling profiler for requests.
+
+ProfilingMiddleware profiles a request when it carries a valid signed
+HYDRA_PROFILE_HEADER (see the hydra_profile_token command) or is picked at
+HYDRA_PROFILE_SAMPLE_RATE. A sampler thread then records the request
+thread's Python stack every HYDRA_PROFILE_INTERVAL seconds. Views, template
+rendering and Hydra calls waiting on the network all show up in the stacks.
+The samples are written in collapsed-stack format, one "frame;frame;... count"
+line per stack, which flamegraph.pl and speedscope read directly, to
+HYDRA_PROFILE_DIR. Each profile is listed in the admin as a RequestProfile.
+
+Requests that are not profiled only pay for a header lookup and, with a
+sampling rate set, one random number.
+"""
+
+
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+from .instrumentation import track_hydra_calls
+from .models import RequestProfile
+
+SIGNING_SALT = 'hydra_auth.profiling'
+
+
+def make_profile_token():
+    """
+    Create a value for HYDRA_PROFILE_HEADER, valid for HYDRA_PROFILE_TOKEN_MAX_AGE seconds.
+    """
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def _token_is_valid(token):
+    max_age = getattr(settings, 'HYDRA_PROFILE_TOKEN_MAX_AGE', 3600)
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=max_age)
+        return True
+    except signing.BadSignature:
+        return False
+
+
+def get_profile_dir():
+    return getattr(settings, 'HYDRA_PROFILE_DIR', None) or os.path.join(settings.BASE_DIR, 'profiles')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """
+    Sample the stack of one thread from a background thread.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='hydra-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+
+class ProfilingMiddleware:
+    """
+    Profile selected requests under HYDRA_PROFILE_PATHS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'HYDRA_PROFILE_HEADER', 'X-Hydra-Profile')
+        self.sample_rate = getattr(settings, 'HYDRA_PROFILE_SAMPLE_RATE', 0.0)
+        self.paths = tuple(getattr(settings, 'HYDRA_PROFILE_PATHS', ('/hydra/',)))
+        self.interval = getattr(settings, 'HYDRA_PROFILE_INTERVAL', 0.005)
+        self.directory = get_profile_dir()
+        self.keep = getattr(settings, 'HYDRA_PROFILE_KEEP', 200)
+
+    def _should_profile(self, request):
+        token = request.headers.get(self.header)
+        if token is not None:
+            return _token_is_valid(token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if not request.path_info.startswith(self.paths) or not self._should_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            with track_hydra_calls() as calls:
+                response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        duration = time.perf_counter() - start
+
+        try:
+            self._save(request, response, stacks, duration, calls)
+        except Exception as e:
+            # Profiling is best effort, it must never fail the request
+            print(f"Exception when saving a request profile: {e}")
+        return response
+
+    def _save(self, request, response, stacks, duration, calls):
+        os.makedirs(self.directory, exist_ok=True)
+        match = request.resolver_match
+        view_name = match.view_name if match else ''
+        file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{view_name or 'unresolved'}-{uuid.uuid4().hex[:8]}.collapsed"
+        with open(os.path.join(self.directory, file_name), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        RequestProfile.objects.create(
+            method=request.method,
+            path=request.path_info[:255],
+            view_name=view_name,
+            status_code=response.status_code,
+            duration_ms=duration * 1000,
+            samples=sum(stacks.values()),
+            hydra_calls=len(calls),
+            hydra_ms=sum(call.elapsed for call in calls) * 1000,
+            file_name=file_name,
+        )
+        self._prune()
+
+    def _prune(self):
+        stale = list(RequestProfile.objects.order_by('-created_at', '-pk').values_list('pk', 'file_name')[self.keep:])
+        if not stale:
+            return
+        RequestProfile.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+        for _, file_name in stale:
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except FileNotFoundError:
+                pass
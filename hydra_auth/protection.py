@@ -0,0 +1,169 @@
+"""
+Protection of Django endpoints with Hydra-issued access tokens.
+
+JWT access tokens are verified locally against Hydra's cached JWKS. Opaque
+tokens are introspected through Hydra's admin API and the result is cached
+in-process, positive results until the token expires and negative results
+for a short while, so each token costs one Hydra call per lifetime.
+"""
+
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import metrics
+from .caching import MISSING, LRUCache
+from .jwt_verifier import InvalidToken, JWTVerifier, looks_like_jwt
+from .routing import get_router
+
+
+class TokenIntrospector:
+    """
+    Cached, coalesced token introspection.
+    """
+
+    def __init__(self, hydra_client=None):
+        self.hydra_client = hydra_client or get_router().for_cluster()
+        self.negative_ttl = getattr(settings, 'HYDRA_INTROSPECTION_NEGATIVE_TTL', 60)
+        self._cache = LRUCache(maxsize=getattr(settings, 'HYDRA_INTROSPECTION_CACHE_SIZE', 10000))
+
+    def introspect(self, token):
+        """
+        Get the claims of an active token.
+
+        Returns:
+            dict: The introspection result for an active token, or None if the
+                token is inactive or Hydra could not be reached
+        """
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self._cache.get(key)
+        if claims is not MISSING:
+            metrics.increment('hydra_introspection_requests', result='hit')
+            return claims
+        metrics.increment('hydra_introspection_requests', result='miss')
+
+        # Concurrent introspections of the same token share one Hydra call
+        response = self.hydra_client.introspect_token(token)
+        if response is None:
+            return None
+
+        if response.active:
+            claims = response.to_dict()
+            # Tokens without an expiry are only cached briefly
+            ttl = claims['exp'] - time.time() if claims.get('exp') else self.negative_ttl
+            if ttl > 0:
+                self._cache.set(key, claims, ttl)
+            return claims
+
+        self._cache.set(key, None, self.negative_ttl)
+        return None
+
+
+_introspector = None
+
+
+def get_introspector():
+    global _introspector
+    if _introspector is None:
+        _introspector = TokenIntrospector()
+    return _introspector
+
+
+_jwt_verifier = None
+
+
+def get_jwt_verifier():
+    global _jwt_verifier
+    if _jwt_verifier is None:
+        _jwt_verifier = JWTVerifier()
+    return _jwt_verifier
+
+
+def verify_token(token):
+    """
+    Verify a bearer token and return its claims, or None if it is not valid.
+
+    HYDRA_TOKEN_VERIFICATION selects how: 'introspect' always asks Hydra,
+    'jwt' only accepts locally verified JWTs and 'auto' (the default)
+    verifies JWT-shaped tokens locally and introspects the rest.
+    """
+    mode = getattr(settings, 'HYDRA_TOKEN_VERIFICATION', 'auto')
+    if mode == 'jwt' or (mode == 'auto' and looks_like_jwt(token)):
+        try:
+            claims = get_jwt_verifier().verify(token)
+        except InvalidToken:
+            metrics.increment('hydra_jwt_verifications', result='invalid')
+            return None
+        metrics.increment('hydra_jwt_verifications', result='valid')
+        return claims
+    return get_introspector().introspect(token)
+
+
+def get_bearer_token(request):
+    """
+    Extract the bearer token from the Authorization header.
+    """
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def _error_response(status, error, description):
+    response = JsonResponse({'error': error, 'error_description': description}, status=status)
+    response['WWW-Authenticate'] = f'Bearer error="{error}", error_description="{description}"'
+    return response
+
+
+def authenticate_request(request):
+    """
+    Attach the claims of the request's bearer token as request.oauth2_token.
+    """
+    if not hasattr(request, 'oauth2_token'):
+        token = get_bearer_token(request)
+        request.oauth2_token = verify_token(token) if token else None
+    return request.oauth2_token
+
+
+def token_required(scopes=()):
+    """
+    Decorator requiring a valid Hydra access token with the given scopes.
+    """
+    required = set(scopes.split() if isinstance(scopes, str) else scopes)
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            claims = authenticate_request(request)
+            if claims is None:
+                return _error_response(401, 'invalid_token', 'The access token is missing, expired or revoked')
+            granted = set((claims.get('scope') or '').split())
+            if not required <= granted:
+                return _error_response(403, 'insufficient_scope', 'The access token lacks the required scopes')
+            return view_func(request, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class HydraTokenMiddleware:
+    """
+    Reject requests without a valid bearer token under the path prefixes
+    listed in HYDRA_TOKEN_PROTECTED_PATHS. Other requests are authenticated
+    lazily by token_required.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.protected_paths = tuple(getattr(settings, 'HYDRA_TOKEN_PROTECTED_PATHS', ()))
+
+    def __call__(self, request):
+        if self.protected_paths and request.path.startswith(self.protected_paths):
+            if authenticate_request(request) is None:
+                return _error_response(401, 'invalid_token', 'The access token is missing, expired or revoked')
+        return self.get_response(request)
@@ -0,0 +1,62 @@
+"""
+Lightweight records decoded from raw Hydra responses.
+
+With HYDRA_RAW_RESPONSES on, HydraClient reads the OAuth2 client endpoints
+as raw bytes, decodes them with orjson (the json module if it is not
+installed) and wraps each client in a HydraClientRecord instead of building
+ory_client pydantic models. Records have the attributes and the to_dict()
+that OAuth2Client.from_hydra_client and the client metadata cache read, but
+skip validation and model construction, which dominate the cost of listing
+clients.
+"""
+
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    loads = json.loads
+
+
+class HydraClientRecord:
+    """
+    An OAuth2 client as returned by Hydra, not validated.
+    """
+
+    __slots__ = (
+        'client_id', 'client_name', 'client_secret', 'redirect_uris', 'grant_types', 'response_types',
+        'scope', 'token_endpoint_auth_method', 'audience', 'client_uri', 'logo_uri', 'tos_uri',
+        'policy_uri', 'jwks_uri', 'contacts', 'metadata', '_data',
+    )
+
+    def __init__(self, data):
+        get = data.get
+        self.client_id = get('client_id')
+        self.client_name = get('client_name')
+        self.client_secret = get('client_secret')
+        self.redirect_uris = get('redirect_uris')
+        self.grant_types = get('grant_types')
+        self.response_types = get('response_types')
+        self.scope = get('scope')
+        self.token_endpoint_auth_method = get('token_endpoint_auth_method')
+        self.audience = get('audience')
+        self.client_uri = get('client_uri')
+        self.logo_uri = get('logo_uri')
+        self.tos_uri = get('tos_uri')
+        self.policy_uri = get('policy_uri')
+        self.jwks_uri = get('jwks_uri')
+        self.contacts = get('contacts')
+        self.metadata = get('metadata')
+        self._data = data
+
+    def to_dict(self):
+        """
+        The client as a dict, without unset fields like the ory_client models give.
+        """
+        return {key: value for key, value in self._data.items() if value is not None}
+
+    def __repr__(self):
+        return f'HydraClientRecord({self.client_id!r})'
@@ -0,0 +1,124 @@
+"""
+Bulk revocation of Hydra login and consent sessions.
+
+revoke_subjects() streams over any iterable of subjects, keeps a bounded
+number of Hydra calls in flight and yields one result per subject as soon
+as it completes, so jobs over tens of thousands of subjects run in
+constant memory and can report progress while they go.
+"""
+
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from . import metrics
+from .executors import map_bounded
+from .routing import get_router
+
+RevocationResult = namedtuple('RevocationResult', ['subject', 'ok', 'error'])
+
+
+def revoke_subject(hydra_clients, subject, client_id=None, consent=True, login=False):
+    """
+    Revoke the sessions of one subject.
+
+    Args:
+        hydra_clients (list): HydraClients of the clusters to revoke on
+        client_id (str, optional): Only revoke consent granted to this client
+        consent (bool): Revoke consent sessions
+        login (bool): Revoke login sessions
+    """
+    failed = []
+    try:
+        for hydra_client in hydra_clients:
+            if consent and not hydra_client.revoke_consent_sessions(subject, client_id):
+                failed.append(f'{hydra_client.cluster} consent')
+            if login and not hydra_client.revoke_login_sessions(subject):
+                failed.append(f'{hydra_client.cluster} login')
+    except Exception as e:
+        result = RevocationResult(subject, False, str(e))
+    else:
+        error = f"Hydra did not revoke the {' and '.join(failed)} sessions" if failed else ''
+        result = RevocationResult(subject, not failed, error)
+
+    metrics.increment('hydra_session_revocations', result='ok' if result.ok else 'error')
+    return result
+
+
+def revoke_subjects(subjects, client_id=None, consent=True, login=False, concurrency=None, hydra_client=None):
+    """
+    Revoke sessions for many subjects with bounded parallelism.
+
+    Without hydra_client, sessions are revoked on the cluster of client_id,
+    or on every cluster when no client is given, since users can sign in
+    through any of them.
+
+    Returns:
+        iterator: One RevocationResult per subject, in completion order
+    """
+    concurrency = concurrency or getattr(settings, 'HYDRA_REVOCATION_CONCURRENCY', 16)
+    if hydra_client is not None:
+        hydra_clients = [hydra_client]
+    elif client_id is not None:
+        hydra_clients = [get_router().for_client_id(client_id)]
+    else:
+        hydra_clients = list(get_router().all().values())
+
+    return map_bounded(
+        lambda subject: revoke_subject(hydra_clients, subject, client_id, consent, login),
+        subjects,
+        concurrency,
+        name='revoke',
+    )
+
+
+def local_subjects(chunk_size=2000):
+    """
+    Stream the subjects of all local users, which login_view uses as Hydra subjects.
+    """
+    User = get_user_model()
+    return User.objects.order_by('pk').values_list(User.USERNAME_FIELD, flat=True).iterator(chunk_size=chunk_size)
+
+
+def _count_results(results, description):
+    """
+    Drain the results of a background revocation, reporting failures.
+
+    Returns:
+        tuple: (number of subjects processed, number that failed)
+    """
+    done = failed = 0
+    try:
+        for result in results:
+            done += 1
+            failed += not result.ok
+    except Exception as e:
+        print(f"Exception when revoking {description}: {e}")
+    if failed:
+        print(f"Exception when revoking {description}: {failed} of {done} subjects failed")
+    return done, failed
+
+
+def revoke_client_consent(client_id, hydra_client=None):
+    """
+    Revoke the consent every local user granted a client. Admin actions run
+    this in the background on the revocation executor.
+
+    Returns:
+        tuple: (number of subjects processed, number that failed)
+    """
+    results = revoke_subjects(local_subjects(), client_id=client_id, hydra_client=hydra_client)
+    return _count_results(results, f"consent to client {client_id}")
+
+
+def revoke_user_sessions(subjects):
+    """
+    Revoke the login and consent sessions of users on every cluster. Admin
+    actions run this in the background on the revocation executor.
+
+    Returns:
+        tuple: (number of subjects processed, number that failed)
+    """
+    return _count_results(revoke_subjects(subjects, login=True), "user sessions")
@@ -0,0 +1,196 @@
+"""
+Client secret rotation.
+
+Hydra holds a single secret per client, so rotation runs in two steps to
+give client owners an overlap. stage_rotation() generates the new secrets,
+stores them as next_client_secret with an activation time
+HYDRA_SECRET_ROTATION_GRACE seconds ahead and streams them to an encrypted
+export for distribution, while the current secrets keep working.
+activate_due_rotations() then pushes the secrets whose activation time has
+passed to Hydra with bounded concurrency and writes them back in bulk.
+
+Exports hold one Fernet token per line, each an encrypted JSON record, so
+they are written and read as a stream. The key is HYDRA_SECRET_EXPORT_KEY
+(generate one with cryptography.fernet.Fernet.generate_key()).
+"""
+
+
+import json
+import os
+import secrets
+from datetime import timedelta
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .executors import map_bounded
+from .models import OAuth2Client
+from .routing import get_router
+
+
+def generate_secret():
+    return secrets.token_urlsafe(32)
+
+
+def get_export_key():
+    key = getattr(settings, 'HYDRA_SECRET_EXPORT_KEY', None)
+    if not key:
+        raise ImproperlyConfigured("HYDRA_SECRET_EXPORT_KEY must be set to export rotated secrets")
+    return key
+
+
+def get_export_dir():
+    # No default, so exports never land in the project tree by accident
+    export_dir = getattr(settings, 'HYDRA_SECRET_EXPORT_DIR', None)
+    if not export_dir:
+        raise ImproperlyConfigured("HYDRA_SECRET_EXPORT_DIR must be set to export rotated secrets from the admin")
+    return export_dir
+
+
+class SecretExportWriter:
+    """
+    Stream rotated secrets to a file readable only by its owner.
+    """
+
+    def __init__(self, path, key=None):
+        self._fernet = Fernet(key or get_export_key())
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # The mode only applies to new files, so tighten an existing one too
+        os.fchmod(fd, 0o600)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, record):
+        self._file.write(self._fernet.encrypt(json.dumps(record).encode('utf-8')) + b'\n')
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_secret_export(path, key=None):
+    """
+    Yield the records of an export written by SecretExportWriter.
+    """
+    fernet = Fernet(key or get_export_key())
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(fernet.decrypt(line.strip()))
+
+
+def rotatable_clients(client_ids=None):
+    """
+    Clients that authenticate with a secret, optionally limited to some IDs.
+    """
+    queryset = OAuth2Client.objects.filter(token_endpoint_auth_method__in=OAuth2Client.SECRET_AUTH_METHODS)
+    if client_ids is not None:
+        queryset = queryset.filter(client_id__in=client_ids)
+    return queryset
+
+
+def _chunks(queryset, chunk_size):
+    # Keyset pagination, so rows updated while iterating are neither skipped nor revisited
+    last_pk = None
+    while True:
+        chunk_queryset = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def stage_rotation(queryset, export, grace=None, chunk_size=500):
+    """
+    Generate new secrets for the clients in queryset and announce them.
+
+    Args:
+        queryset: OAuth2Client queryset, usually from rotatable_clients()
+        export (SecretExportWriter): Where the new secrets are written
+        grace (int, optional): Seconds until the new secrets become active
+
+    Returns:
+        int: The number of clients staged
+    """
+    grace = grace if grace is not None else getattr(settings, 'HYDRA_SECRET_ROTATION_GRACE', 86400)
+    activates_at = timezone.now() + timedelta(seconds=grace)
+
+    staged = 0
+    for chunk in _chunks(queryset, chunk_size):
+        for client in chunk:
+            client.next_client_secret = generate_secret()
+            client.next_secret_activates_at = activates_at
+            # Exported first, so no staged secret is ever unknown to its owner
+            export.write({
+                'client_id': client.client_id,
+                'client_name': client.client_name,
+                'client_secret': client.next_client_secret,
+                'activates_at': activates_at.isoformat(),
+            })
+        OAuth2Client.objects.bulk_update(chunk, ['next_client_secret', 'next_secret_activates_at'])
+        staged += len(chunk)
+
+    metrics.increment('hydra_secret_rotations', staged, result='staged')
+    return staged
+
+
+def activate_due_rotations(concurrency=None, hydra_client=None, chunk_size=500):
+    """
+    Push staged secrets whose activation time has passed to Hydra, each
+    to its client's cluster unless hydra_client is given.
+
+    Returns:
+        tuple: (number of clients activated, number of clients that failed)
+    """
+    concurrency = concurrency or getattr(settings, 'HYDRA_ROTATION_CONCURRENCY', 8)
+    router = get_router()
+    due = OAuth2Client.objects.filter(
+        next_secret_activates_at__lte=timezone.now(),
+        next_client_secret__isnull=False,
+    )
+
+    def push(client):
+        patch = [{'op': 'add', 'path': '/client_secret', 'value': client.next_client_secret}]
+        try:
+            target = hydra_client or router.for_client(client)
+            return client, target.patch_oauth2_client(client.client_id, patch) is not None
+        except Exception as e:
+            print(f"Exception when rotating the secret of {client.client_id}: {e}")
+            return client, False
+
+    activated = failed = 0
+    for chunk in _chunks(due, chunk_size):
+        updated = []
+        for client, ok in map_bounded(push, chunk, concurrency, name='rotate'):
+            if not ok:
+                # Left staged, so the next run retries it
+                failed += 1
+                continue
+            client.client_secret = client.next_client_secret
+            client.next_client_secret = None
+            client.next_secret_activates_at = None
+            client.mark_secret_synced()
+            updated.append(client)
+
+        with transaction.atomic():
+            OAuth2Client.objects.bulk_update(updated, [
+                'client_secret', 'next_client_secret', 'next_secret_activates_at', 'hydra_state', 'fingerprint',
+            ])
+        activated += len(updated)
+
+    metrics.increment('hydra_secret_rotations', activated, result='activated')
+    metrics.increment('hydra_secret_rotations', failed, result='failed')
+    return activated, failed
@@ -0,0 +1,126 @@
+"""
+Routing of Hydra calls across several Hydra clusters.
+
+HYDRA_CLUSTERS names the clusters and their admin and public URLs. Each
+cluster gets its own HydraClient, and so its own connection pools and
+circuit breakers. A new OAuth2 client is placed on a cluster by consistent
+hashing of its client_id (or of a key pinned in HYDRA_CLUSTER_PINS), and the
+cluster is stored on the local row, so adding a cluster later moves no
+existing clients.
+
+Login, consent and logout challenges are answered by the cluster that
+issued them: point each cluster's urls.login, urls.consent and urls.logout
+at this app with a ?hydra_cluster=<name> query parameter.
+"""
+
+
+import bisect
+import hashlib
+import threading
+
+from django.conf import settings
+
+from .hydra_client import HydraClient
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes.
+    """
+
+    def __init__(self, nodes, replicas=128):
+        ring = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self._hashes = [h for h, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def get_node(self, key):
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class HydraRouter:
+    """
+    Map clients and keys to the HydraClient of their cluster.
+    """
+
+    def __init__(self, clusters=None, pins=None):
+        clusters = clusters if clusters is not None else getattr(settings, 'HYDRA_CLUSTERS', None)
+        if not clusters:
+            clusters = {'default': {'admin_url': settings.HYDRA_ADMIN_URL, 'public_url': settings.HYDRA_PUBLIC_URL}}
+        self.clusters = clusters
+        self.default_cluster = next(iter(clusters))
+        self.pins = pins if pins is not None else getattr(settings, 'HYDRA_CLUSTER_PINS', {})
+        self.ring = HashRing(clusters)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def cluster_for_key(self, key):
+        """
+        Get the cluster name for a client_id or tenant key.
+        """
+        return self.pins.get(key) or self.ring.get_node(key)
+
+    def for_cluster(self, name=None):
+        """
+        Get the HydraClient of a cluster, the default one if name is empty.
+
+        Raises:
+            KeyError: If no cluster has that name
+        """
+        name = name or self.default_cluster
+        client = self._clients.get(name)
+        if client is None:
+            config = self.clusters[name]
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = HydraClient(config['admin_url'], config.get('public_url'), cluster=name)
+                    self._clients[name] = client
+        return client
+
+    def for_key(self, key):
+        return self.for_cluster(self.cluster_for_key(key))
+
+    def for_client(self, client):
+        """
+        Get the HydraClient for an OAuth2Client, honouring its stored cluster.
+        """
+        return self.for_cluster(client.hydra_cluster or self.cluster_for_key(client.client_id))
+
+    def for_client_id(self, client_id):
+        """
+        Like for_client(), looking the stored cluster up by client_id.
+        """
+        from .models import OAuth2Client
+
+        cluster = OAuth2Client.objects.filter(client_id=client_id).values_list('hydra_cluster', flat=True).first()
+        return self.for_cluster(cluster or self.cluster_for_key(client_id))
+
+    def all(self):
+        """
+        Get the HydraClient of every cluster, keyed by cluster name.
+        """
+        return {name: self.for_cluster(name) for name in self.clusters}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = HydraRouter()
+        return _router
+
+
+def cluster_from_request(request):
+    """
+    Get the cluster named by a challenge request, or None for the default.
+    """
+    return request.GET.get('hydra_cluster') or None
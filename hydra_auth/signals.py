@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .claims import invalidate_subject_claims
+from .client_cache import invalidate_client_metadata
+from .models import OAuth2Client
+
+
+@receiver([post_save, post_delete], sender=OAuth2Client)
+def invalidate_client_caches(sender, instance, **kwargs):
+    """
+    Drop cached metadata whenever a client row changes.
+    """
+    invalidate_client_metadata(instance.client_id)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_user_claims(sender, instance, **kwargs):
+    """
+    Drop cached claims whenever a user changes.
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= {'last_login'}:
+        # Every login touches last_login, which no claim depends on
+        return
+    invalidate_subject_claims(instance.get_username())
@@ -0,0 +1,125 @@
+"""
+Request coalescing ("single-flight") for duplicate Hydra reads.
+"""
+
+
+import functools
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls that share a key.
+
+    Within a process, the first caller for a key runs the function and every
+    caller arriving while it is in flight waits for and shares its result.
+    When HYDRA_SINGLEFLIGHT_CACHE names a cache alias, the leader also takes
+    a short lock in that cache and publishes its result there, so leaders in
+    other processes wait for it instead of calling Hydra themselves.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.increment('hydra_singleflight_calls', group=self.name, role='shared')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment('hydra_singleflight_calls', group=self.name, role='leader')
+        try:
+            call.result = self._run(key, fn, args, kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _run(self, key, fn, args, kwargs):
+        alias = getattr(settings, 'HYDRA_SINGLEFLIGHT_CACHE', None)
+        if not alias:
+            return fn(*args, **kwargs)
+
+        cache = caches[alias]
+        timeout = getattr(settings, 'HYDRA_SINGLEFLIGHT_TIMEOUT', 5)
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        lock_key = f'hydra:singleflight:{self.name}:lock:{digest}'
+        result_prefix = f'hydra:singleflight:{self.name}:result:{digest}'
+
+        # The lock holds the leader's token and the result is published
+        # under it, so waiters only ever share the result of the call they
+        # waited for, never one left behind by an earlier leader
+        token = uuid.uuid4().hex
+        if not cache.add(lock_key, token, timeout):
+            # Another process is already calling Hydra, wait for its result
+            leader_token = cache.get(lock_key)
+            result_key = f'{result_prefix}:{leader_token}'
+            deadline = time.monotonic() + timeout
+            while leader_token is not None and time.monotonic() < deadline:
+                time.sleep(0.01)
+                released = cache.get(lock_key) != leader_token
+                result = cache.get(result_key, _MISSING)
+                if result is not _MISSING:
+                    metrics.increment('hydra_singleflight_calls', group=self.name, role='shared_remote')
+                    return result
+                if released:
+                    break
+            return fn(*args, **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+            if result is not None:
+                cache.set(f'{result_prefix}:{token}', result, timeout)
+            return result
+        finally:
+            # The lock may have expired and been taken by another leader
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+
+def single_flight(method):
+    """
+    Coalesce concurrent identical calls of a HydraClient read method.
+
+    Calls are keyed by method name, Hydra admin host and arguments, and
+    shared across all HydraClient instances in the process.
+    """
+    group = SingleFlight(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (self.admin_configuration.host, args, tuple(sorted(kwargs.items())))
+        return group.do(key, method, self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,236 @@
+"""
+Test helpers: a fake Hydra and budgets for database queries and Hydra calls.
+
+FakeHydra replaces the HTTP transport of the Ory client, so HydraClient, its
+circuit breakers and its instrumentation run unchanged, and records every
+request that would have reached Hydra, whichever thread sent it.
+Budget counts the queries on the default database and the Hydra requests
+made inside a block and fails the test when either exceeds its limit, so a
+change that adds an N+1 pattern or an extra Hydra round trip breaks the
+build instead of production.
+"""
+
+
+import json
+import threading
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from ory_client.rest import RESTClientObject, RESTResponse
+
+FakeRequest = namedtuple('FakeRequest', ['method', 'path', 'query', 'body'])
+
+
+class _HttpResponse(namedtuple('_HttpResponse', ['status', 'reason', 'data', 'headers'])):
+    # The parts of urllib3's HTTPResponse the Ory client uses
+    def release_conn(self):
+        pass
+
+
+def _response(status, payload=None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    return RESTResponse(_HttpResponse(status, 'OK' if status < 400 else 'Error', data,
+                                      {'content-type': 'application/json'}))
+
+
+class FakeHydra:
+    """
+    In-memory stand-in for the Hydra admin API.
+
+    Challenges are created with add_login_request(), add_consent_request()
+    and add_logout_request(), OAuth2 clients with add_client() and access
+    tokens known to the introspection endpoint with add_token(). The token
+    endpoint issues client_credentials tokens valid for token_lifespan
+    seconds. Use it as a context manager; requests lists every call received.
+    """
+
+    REDIRECT = 'http://hydra.test/oauth2/auth?redirected=1'
+
+    def __init__(self):
+        self.clients = {}
+        self.login_requests = {}
+        self.consent_requests = {}
+        self.logout_requests = {}
+        self.tokens = {}
+        self.requests = []
+        self.token_lifespan = 3600
+        self.issued_tokens = 0
+        self._lock = threading.Lock()
+        self._original = None
+
+    def add_client(self, client_id, **fields):
+        client = {
+            'client_id': client_id,
+            'client_name': fields.pop('client_name', client_id),
+            'redirect_uris': ['http://app.test/callback'],
+            'grant_types': ['authorization_code', 'refresh_token'],
+            'response_types': ['code'],
+            'scope': 'openid profile email',
+            'token_endpoint_auth_method': 'client_secret_basic',
+        }
+        client.update(fields)
+        self.clients[client_id] = client
+        return client
+
+    def _client_for(self, client_id):
+        return self.clients.get(client_id) or self.add_client(client_id)
+
+    def add_login_request(self, challenge, client_id='app', subject='', skip=False):
+        self.login_requests[challenge] = {
+            'challenge': challenge,
+            'client': self._client_for(client_id),
+            'request_url': 'http://hydra.test/oauth2/auth',
+            'requested_scope': ['openid', 'profile'],
+            'requested_access_token_audience': [],
+            'skip': skip,
+            'subject': subject,
+        }
+
+    def add_consent_request(self, challenge, subject, client_id='app', skip=False,
+                            scopes=('openid', 'profile', 'email')):
+        self.consent_requests[challenge] = {
+            'challenge': challenge,
+            'client': self._client_for(client_id),
+            'requested_scope': list(scopes),
+            'requested_access_token_audience': [],
+            'skip': skip,
+            'subject': subject,
+        }
+
+    def add_logout_request(self, challenge, subject, sid='session'):
+        self.logout_requests[challenge] = {
+            'challenge': challenge,
+            'subject': subject,
+            'sid': sid,
+            'rp_initiated': True,
+        }
+
+    def add_token(self, token, subject='alice', scope='openid', exp=None, **claims):
+        self.tokens[token] = {'active': True, 'sub': subject, 'scope': scope, 'exp': exp, **claims}
+
+    def __enter__(self):
+        fake = self
+
+        def request(rest_client, method, url, headers=None, body=None, post_params=None, _request_timeout=None):
+            return fake.handle(method, url, body if body is not None else post_params)
+
+        self._original = RESTClientObject.request
+        RESTClientObject.request = request
+        return self
+
+    def __exit__(self, *exc_info):
+        RESTClientObject.request = self._original
+
+    def handle(self, method, url, body=None):
+        """
+        Answer one HTTP request the way Hydra would.
+        """
+        parts = urlsplit(url)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        path = parts.path.rstrip('/')
+        with self._lock:
+            self.requests.append(FakeRequest(method, path, query, body))
+
+        if path == '/oauth2/token' and method == 'POST':
+            form = dict(body or ())
+            with self._lock:
+                self.issued_tokens += 1
+                access_token = f'token-{self.issued_tokens}'
+            return _response(200, {'access_token': access_token, 'token_type': 'bearer',
+                                   'expires_in': self.token_lifespan, 'scope': form.get('scope', '')})
+
+        if path == '/admin/oauth2/introspect' and method == 'POST':
+            form = dict(body or ())
+            return _response(200, self.tokens.get(form.get('token'), {'active': False}))
+
+        if path == '/health/ready':
+            return _response(200, {'status': 'ok'})
+
+        for kind, store in (('login', self.login_requests), ('consent', self.consent_requests),
+                            ('logout', self.logout_requests)):
+            prefix = f'/admin/oauth2/auth/requests/{kind}'
+            if path.startswith(prefix):
+                challenge = query.get(f'{kind}_challenge')
+                if challenge not in store:
+                    return _response(404, {'error': 'Not Found'})
+                if path == prefix and method == 'GET':
+                    return _response(200, store[challenge])
+                if path.endswith('/reject') and kind == 'logout':
+                    return _response(204)
+                return _response(200, {'redirect_to': self.REDIRECT})
+
+        if path in ('/admin/oauth2/tokens', '/admin/oauth2/auth/sessions/consent',
+                    '/admin/oauth2/auth/sessions/login'):
+            return _response(204)
+
+        if path == '/admin/clients':
+            if method == 'POST':
+                client = dict(body)
+                self.clients[client['client_id']] = client
+                return _response(201, client)
+            name = query.get('client_name')
+            return _response(200, [client for client in self.clients.values()
+                                   if name is None or client.get('client_name') == name])
+
+        if path.startswith('/admin/clients/'):
+            client_id = path.rsplit('/', 1)[1]
+            if client_id not in self.clients:
+                return _response(404, {'error': 'Not Found'})
+            if method == 'DELETE':
+                del self.clients[client_id]
+                return _response(204)
+            if method == 'PUT':
+                self.clients[client_id] = dict(body)
+            elif method == 'PATCH':
+                for operation in body:
+                    self.clients[client_id][operation['path'].lstrip('/')] = operation.get('value')
+            return _response(200, self.clients[client_id])
+
+        return _response(404, {'error': 'Not Found'})
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+class Budget:
+    """
+    Context manager asserting that a block stays within a number of
+    database queries and Hydra requests.
+
+    Args:
+        hydra (FakeHydra): The fake Hydra whose requests are counted
+        queries (int): Maximum number of queries on the default database
+        hydra_calls (int): Maximum number of requests sent to Hydra
+        label (str): Shown in the failure message
+    """
+
+    def __init__(self, hydra, queries, hydra_calls, label=''):
+        self.hydra = hydra
+        self.max_queries = queries
+        self.max_hydra_calls = hydra_calls
+        self.label = label
+        self._queries = CaptureQueriesContext(connection)
+
+    def __enter__(self):
+        self._hydra_start = len(self.hydra.requests)
+        self._queries.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queries.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+
+        self.queries = [query['sql'] for query in self._queries.captured_queries]
+        self.hydra_calls = [f'{r.method} {r.path}' for r in self.hydra.requests[self._hydra_start:]]
+        problems = []
+        if len(self.queries) > self.max_queries:
+            problems.append(f'{len(self.queries)} queries, budget {self.max_queries}:\n  ' + '\n  '.join(self.queries))
+        if len(self.hydra_calls) > self.max_hydra_calls:
+            problems.append(f'{len(self.hydra_calls)} Hydra calls, budget {self.max_hydra_calls}:\n  '
+                            + '\n  '.join(self.hydra_calls))
+        if problems:
+            raise BudgetExceeded(f"{self.label or 'Block'} is over budget with " + '\nand '.join(problems))
@@ -1,3 +1,1629 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+from urllib.parse import quote
 
-# Create your tests here.
+import ory_client
+from cryptography.fernet import Fernet
+from cryptography.fernet import InvalidToken as InvalidFernetToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (admission, audit, claims, client_cache, health, invalidation,
+               metrics, outbox, warmup)
+from .caching import MISSING
+from .client_cache import get_client_metadata
+from .executors import BoundedExecutor, ExecutorOverloaded
+from .hydra_client import HydraClient
+from .instrumentation import record_hydra_call
+from .invalidation import CacheBackend, InvalidationBus, LocalBackend
+from .jwt_verifier import InvalidToken, JWKSCache, JWTVerifier, looks_like_jwt
+from .models import AuditEvent, HydraOutboxEntry, OAuth2Client, RequestProfile
+from .pagination import EstimatedCountPaginator
+from .policies import skip_rates
+from .profiling import make_profile_token
+from .protection import TokenIntrospector
+from .records import HydraClientRecord
+from .rotation import read_secret_export
+from .routing import HashRing, HydraRouter
+from .singleflight import SingleFlight
+from .testing import Budget, FakeHydra
+from .tokens import ClientCredentialsTokenProvider
+from .transports import (Http2PoolManager, UnixSocketPoolManager,
+                         make_pool_manager)
+
+# (database queries, Hydra calls) allowed per request. Client lists and admin
+# actions are checked with several sizes of data, so their budgets must hold
+# whatever the number of clients: a budget that has to grow with the data is
+# an N+1 pattern. Caches start cold, so login and consent pay one query to
+# read the client's remember policy into the client metadata cache.
+BUDGETS = {
+    'login': (1, 1),
+    'login skip': (1, 2),
+    'login post': (10, 2),
+    'login_reject': (0, 1),
+    'consent': (1, 1),
+    'consent skip': (2, 2),
+    'consent post': (2, 2),
+    'consent_reject': (0, 1),
+    'logout': (0, 1),
+    'logout confirm': (4, 2),
+    'logout cancel': (0, 2),
+    'logout_reject': (0, 1),
+    'client_list': (4, 1),
+    'client_create': (7, 0),
+    'client_update': (5, 1),
+    'client_update post': (9, 1),
+    'client_delete': (3, 0),
+    'client_delete post': (7, 0),
+    'admin sync_with_hydra': (6, 0),
+    'admin revoke_client_sessions': (6, 1),
+    'admin rotate_client_secrets': (7, 0),
+    'admin delete_selected': (14, 0),
+    'admin changelist': (5, 0),
+}
+
+CLIENT_COUNTS = (1, 10)
+
+
+def _run_inline(executor, fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+_run_on_worker = BoundedExecutor.run
+
+
+@override_settings(HYDRA_AUDIT_ENABLED=False)
+class BudgetTestCase(TestCase):
+    """
+    Base class running each test against a FakeHydra with cold caches.
+    """
+
+    def setUp(self):
+        self.hydra = FakeHydra()
+        self.hydra.__enter__()
+        self.addCleanup(self.hydra.__exit__, None, None, None)
+        cache.clear()
+        client_cache._cache.local.clear()
+        claims._cache.local.clear()
+        # Password checks run on a worker thread, whose queries would go
+        # uncounted and could not see the test transaction
+        patcher = mock.patch.object(BoundedExecutor, 'run', _run_inline)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create_user('alice', 'alice@example.com', 'secret-password')
+
+    def budget(self, name):
+        queries, hydra_calls = BUDGETS[name]
+        return Budget(self.hydra, queries, hydra_calls, label=name)
+
+    def create_clients(self, count):
+        """
+        Create clients in the fake Hydra and their synchronized local rows.
+        """
+        clients = []
+        for i in range(OAuth2Client.objects.count(), count):
+            data = self.hydra.add_client(f'client-{i}')
+            client = OAuth2Client.from_hydra_client(ory_client.OAuth2Client.from_dict(data))
+            client.client_secret = 'secret'
+            client.hydra_cluster = 'default'
+            client.mark_synced()
+            clients.append(client)
+        OAuth2Client.objects.bulk_create(clients)
+        return list(OAuth2Client.objects.order_by('client_id'))
+
+
+class ChallengeBudgetTests(BudgetTestCase):
+
+    def test_login(self):
+        self.hydra.add_login_request('login-1')
+        with self.budget('login'):
+            response = self.client.get(reverse('login'), {'login_challenge': 'login-1'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_skip(self):
+        self.hydra.add_login_request('login-1', subject='alice', skip=True)
+        with self.budget('login skip'):
+            response = self.client.get(reverse('login'), {'login_challenge': 'login-1'})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_login_post(self):
+        self.hydra.add_login_request('login-1')
+        url = reverse('login') + '?login_challenge=login-1'
+        with self.budget('login post'):
+            response = self.client.post(url, {'username': 'alice', 'password': 'secret-password'})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_login_reject(self):
+        self.hydra.add_login_request('login-1')
+        with self.budget('login_reject'):
+            response = self.client.get(reverse('login_reject'), {'login_challenge': 'login-1'})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_consent(self):
+        self.hydra.add_consent_request('consent-1', 'alice')
+        with self.budget('consent'):
+            response = self.client.get(reverse('consent'), {'consent_challenge': 'consent-1'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_consent_skip(self):
+        self.hydra.add_consent_request('consent-1', 'alice', skip=True)
+        with self.budget('consent skip'):
+            response = self.client.get(reverse('consent'), {'consent_challenge': 'consent-1'})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_consent_post(self):
+        self.hydra.add_consent_request('consent-1', 'alice')
+        url = reverse('consent') + '?consent_challenge=consent-1'
+        with self.budget('consent post'):
+            response = self.client.post(url, {'scopes': ['openid', 'profile', 'email']})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_consent_reject(self):
+        self.hydra.add_consent_request('consent-1', 'alice')
+        with self.budget('consent_reject'):
+            response = self.client.get(reverse('consent_reject'), {'consent_challenge': 'consent-1'})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_logout(self):
+        self.hydra.add_logout_request('logout-1', 'alice')
+        with self.budget('logout'):
+            response = self.client.get(reverse('logout'), {'logout_challenge': 'logout-1'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_confirm(self):
+        self.client.force_login(self.user)
+        self.hydra.add_logout_request('logout-1', 'alice')
+        url = reverse('logout') + '?logout_challenge=logout-1'
+        with self.budget('logout confirm'):
+            response = self.client.post(url, {'confirm': 'yes'})
+        self.assertRedirects(response, FakeHydra.REDIRECT, fetch_redirect_response=False)
+
+    def test_logout_cancel(self):
+        self.hydra.add_logout_request('logout-1', 'alice')
+        url = reverse('logout') + '?logout_challenge=logout-1'
+        with self.budget('logout cancel'):
+            response = self.client.post(url, {})
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout_reject(self):
+        self.hydra.add_logout_request('logout-1', 'alice')
+        with self.budget('logout_reject'):
+            response = self.client.get(reverse('logout_reject'), {'logout_challenge': 'logout-1'})
+        self.assertEqual(response.status_code, 302)
+
+
+class ClientViewBudgetTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_client_list(self):
+        for count in CLIENT_COUNTS:
+            self.create_clients(count)
+            with self.subTest(clients=count), self.budget('client_list'):
+                response = self.client.get(reverse('client_list'))
+            self.assertEqual(len(response.context['clients']), count)
+
+    def test_client_create(self):
+        data = {
+            'client_name': 'New app',
+            'redirect_uris': 'http://app.test/callback',
+            'grant_types': ['authorization_code'],
+            'response_types': ['code'],
+            'token_endpoint_auth_method': 'client_secret_basic',
+        }
+        with self.budget('client_create'):
+            response = self.client.post(reverse('client_create'), data)
+        self.assertRedirects(response, reverse('client_list'), fetch_redirect_response=False)
+        self.assertEqual(HydraOutboxEntry.objects.filter(operation=HydraOutboxEntry.OPERATION_CREATE).count(), 1)
+
+    def test_client_update(self):
+        client = self.create_clients(1)[0]
+        url = reverse('client_update', args=[client.client_id])
+        with self.budget('client_update'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        data = {
+            'client_name': 'Renamed',
+            'redirect_uris': client.redirect_uris,
+            'grant_types': client.get_grant_types_list(),
+            'response_types': client.get_response_types_list(),
+            'scope': client.scope,
+            'token_endpoint_auth_method': client.token_endpoint_auth_method,
+        }
+        with self.budget('client_update post'):
+            response = self.client.post(url, data)
+        self.assertRedirects(response, reverse('client_list'), fetch_redirect_response=False)
+        client = OAuth2Client.objects.get(pk=client.pk)
+        self.assertEqual(client.client_name, 'Renamed')
+        self.assertEqual(client.client_secret, 'secret')
+
+    def test_client_delete(self):
+        client = self.create_clients(1)[0]
+        url = reverse('client_delete', args=[client.client_id])
+        with self.budget('client_delete'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        with self.budget('client_delete post'):
+            response = self.client.post(url)
+        self.assertRedirects(response, reverse('client_list'), fetch_redirect_response=False)
+        self.assertFalse(OAuth2Client.objects.filter(pk=client.pk).exists())
+
+
+class AdminActionBudgetTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin-password')
+        self.client.force_login(self.admin)
+        self.changelist = reverse('admin:hydra_auth_oauth2client_changelist')
+
+    def test_changelist(self):
+        for count in CLIENT_COUNTS:
+            self.create_clients(count)
+            with self.subTest(clients=count), self.budget('admin changelist'):
+                response = self.client.get(self.changelist)
+            self.assertEqual(response.context['cl'].result_count, count)
+            # Only the listed columns are loaded
+            client = response.context['cl'].result_list[0]
+            self.assertIn('redirect_uris', client.get_deferred_fields())
+
+    def run_action(self, action, clients, **extra):
+        data = {'action': action, '_selected_action': [client.pk for client in clients], **extra}
+        with self.budget(f'admin {action}'):
+            response = self.client.post(self.changelist, data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_sync_with_hydra(self):
+        for count in CLIENT_COUNTS:
+            clients = self.create_clients(count)
+            # Half of the clients have local changes to push
+            OAuth2Client.objects.filter(pk__in=[client.pk for client in clients[::2]]).update(client_name='Changed')
+            with self.subTest(clients=count):
+                self.run_action('sync_with_hydra', clients)
+
+    def test_revoke_client_sessions(self):
+        # Hydra is called once per client to delete its tokens, so this runs
+        # for one client. Consent is revoked in the background.
+        clients = self.create_clients(1)
+        with mock.patch.object(BoundedExecutor, 'submit') as submit:
+            self.run_action('revoke_client_sessions', clients)
+        self.assertEqual(submit.call_count, 1)
+
+    def test_rotate_client_secrets(self):
+        export_dir = self.enterContext(tempfile.TemporaryDirectory())
+        with self.settings(HYDRA_SECRET_EXPORT_KEY=Fernet.generate_key(), HYDRA_SECRET_EXPORT_DIR=export_dir):
+            for count in CLIENT_COUNTS:
+                clients = self.create_clients(count)
+                with self.subTest(clients=count):
+                    self.run_action('rotate_client_secrets', clients)
+        self.assertEqual(OAuth2Client.objects.filter(next_client_secret__isnull=False).count(), max(CLIENT_COUNTS))
+
+    def test_delete_selected(self):
+        for count in CLIENT_COUNTS:
+            clients = self.create_clients(count)
+            with self.subTest(clients=count):
+                self.run_action('delete_selected', clients, post='yes')
+            self.assertFalse(OAuth2Client.objects.exists())
+
+
+class RawResponseTests(BudgetTestCase):
+
+    def test_records_convert_like_models(self):
+        self.hydra.add_client('app', audience=['api'], contacts=['ops@example.com'], client_uri='http://app.test')
+        with override_settings(HYDRA_RAW_RESPONSES=True):
+            raw = HydraClient().list_oauth2_clients()
+        models = HydraClient().list_oauth2_clients()
+
+        self.assertIsInstance(raw[0], HydraClientRecord)
+        self.assertEqual(
+            OAuth2Client.from_hydra_client(raw[0]).to_canonical_dict(),
+            OAuth2Client.from_hydra_client(models[0]).to_canonical_dict(),
+        )
+
+    def test_get_client(self):
+        self.hydra.add_client('app')
+        with override_settings(HYDRA_RAW_RESPONSES=True):
+            hydra_client = HydraClient()
+        self.assertEqual(hydra_client.get_oauth2_client('app').client_id, 'app')
+        self.assertIsNone(hydra_client.get_oauth2_client('missing'))
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    def setUp(self):
+        for i in range(20):
+            OAuth2Client.objects.create(client_id=f'client-{i}', client_name=f'Client {i}', redirect_uris='')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_uses_estimate_above_threshold(self):
+        paginator = EstimatedCountPaginator(OAuth2Client.objects.order_by('pk'), 5, threshold=10)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 20)
+
+    def test_counts_exactly_below_threshold(self):
+        OAuth2Client.objects.filter(client_id='client-0').delete()
+        paginator = EstimatedCountPaginator(OAuth2Client.objects.order_by('pk'), 5, threshold=100)
+        self.assertEqual(paginator.count, 19)
+
+    def test_counts_filtered_queryset_past_threshold(self):
+        queryset = OAuth2Client.objects.filter(client_name__startswith='Client').order_by('pk')
+        paginator = EstimatedCountPaginator(queryset, 5, threshold=10)
+        self.assertEqual(paginator.count, 20)
+        self.assertEqual(paginator.num_pages, 4)
+        self.assertEqual(len(paginator.page(4).object_list), 5)
+        self.assertEqual(EstimatedCountPaginator(queryset, 5, threshold=100).count, 20)
+
+    def test_counts_exactly_without_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM sqlite_stat1')
+        paginator = EstimatedCountPaginator(OAuth2Client.objects.order_by('pk'), 5, threshold=10)
+        self.assertEqual(paginator.count, 20)
+        self.assertEqual(paginator.num_pages, 4)
+
+
+class _UnixHydraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({'status': 'ok', 'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TransportTests(TestCase):
+
+    def test_scheme_selects_transport(self):
+        def pool_manager(host):
+            return make_pool_manager(ory_client.Configuration(host=host))
+
+        self.assertIsNone(pool_manager('http://hydra:4445'))
+        self.assertIsNone(pool_manager('https://hydra:4445'))
+        unix = pool_manager('http+unix://%2Frun%2Fhydra%2Fadmin.sock')
+        self.assertIsInstance(unix, UnixSocketPoolManager)
+        self.assertEqual(unix.socket_path, '/run/hydra/admin.sock')
+
+    @skipUnless(find_spec('httpx') and find_spec('h2'), "needs the http2 extra")
+    def test_http2_scheme_selects_transport(self):
+        pool_manager = make_pool_manager(ory_client.Configuration(host='h2c://hydra:4445'))
+        self.assertIsInstance(pool_manager, Http2PoolManager)
+        self.assertEqual(pool_manager.scheme, 'http')
+
+    def test_unix_socket_round_trip(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'hydra-admin.sock')
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _UnixHydraHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        url = f"http+unix://{quote(socket_path, safe='')}"
+        hydra_client = HydraClient(url, url, cluster='unix-test')
+        self.assertTrue(hydra_client.is_ready())
+        self.assertTrue(hydra_client.is_ready())
+        pool = hydra_client.admin_api.rest_client.pool_manager.pool
+        self.assertEqual(pool.num_connections, 1)
+
+
+class TokenProviderTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = ClientCredentialsTokenProvider(HydraClient())
+
+    def token_requests(self):
+        return [r for r in self.hydra.requests if r.path == '/oauth2/token']
+
+    def test_reuses_token(self):
+        token = self.provider.get_token('service', 'secret', scope=['read', 'write'])
+        self.assertEqual(self.provider.get_token('service', 'secret', scope=['write', 'read']), token)
+        self.assertNotEqual(self.provider.get_token('service', 'secret', scope=['read']), token)
+        self.assertEqual(len(self.token_requests()), 2)
+        self.assertIn(('grant_type', 'client_credentials'), self.token_requests()[0].body)
+
+    def test_shares_token_across_workers(self):
+        token = self.provider.get_token('service', 'secret')
+        other_worker = ClientCredentialsTokenProvider(HydraClient())
+        self.assertEqual(other_worker.get_token('service', 'secret'), token)
+        self.assertEqual(len(self.token_requests()), 1)
+
+    def test_refreshes_before_expiry(self):
+        token = self.provider.get_token('service', 'secret')
+        later = time.time() + self.hydra.token_lifespan - 30
+        with mock.patch('hydra_auth.tokens.time.time', return_value=later):
+            # Another caller is already refreshing, the current token is still valid
+            self.assertTrue(self.provider._claim_refresh(self.provider._key('service', (), ())))
+            self.assertEqual(self.provider.get_token('service', 'secret'), token)
+            self.provider._release_refresh(self.provider._key('service', (), ()))
+
+            fresh = self.provider.get_token('service', 'secret')
+            self.assertNotEqual(fresh, token)
+            self.assertEqual(self.provider.get_token('service', 'secret'), fresh)
+        self.assertEqual(len(self.token_requests()), 2)
+
+    def test_keeps_token_while_hydra_is_down(self):
+        token = self.provider.get_token('service', 'secret')
+        later = time.time() + self.hydra.token_lifespan - 30
+        with mock.patch('hydra_auth.tokens.time.time', return_value=later), \
+                mock.patch.object(HydraClient, 'request_client_credentials_token', return_value=None):
+            self.assertEqual(self.provider.get_token('service', 'secret'), token)
+
+
+class WarmUpTests(BudgetTestCase):
+
+    def test_preloads_hot_clients(self):
+        self.create_clients(3)
+        AuditEvent.objects.create(event_type=AuditEvent.CONSENT_ACCEPTED, subject='alice', client_id='client-1')
+        self.assertEqual(warmup.hot_client_ids(1), ['client-1'])
+        self.assertEqual(len(warmup.hot_client_ids(5)), 3)
+
+        timings = warmup.warm_up()
+        self.assertEqual(list(timings), ['urls', 'models', 'templates', 'hydra:default', 'clients'])
+        with Budget(self.hydra, 0, 0, label='warm client metadata'):
+            for i in range(3):
+                self.assertEqual(get_client_metadata(f'client-{i}')['client_id'], f'client-{i}')
+
+    def test_opens_connections(self):
+        self.assertEqual(warmup.open_connections(HydraClient(), 4), 4)
+        self.assertEqual(len([r for r in self.hydra.requests if r.path == '/health/ready']), 4)
+
+    def test_unreachable_cluster_keeps_circuit_closed(self):
+        url = f"http+unix://{quote(os.path.join(tempfile.mkdtemp(), 'missing.sock'), safe='')}"
+        self.hydra.__exit__(None, None, None)
+        hydra_client = HydraClient(url, url, cluster='unreachable')
+        with mock.patch('builtins.print'):
+            self.assertEqual(warmup.open_connections(hydra_client, 8), 0)
+        self.assertEqual(hydra_client.admin_circuit.state, 'closed')
+
+
+def _subscribed_bus(backend, origin):
+    # A bus as ensure_started() leaves it, without its background thread
+    bus = InvalidationBus(backend, interval=0.01)
+    backend.subscribe()
+    bus.origin = origin
+    bus._worker_pid = os.getpid()
+    return bus
+
+
+class InvalidationBusTests(BudgetTestCase):
+
+    def test_client_save_reaches_other_processes(self):
+        client = self.create_clients(1)[0]
+        this = _subscribed_bus(LocalBackend(), 'this')
+        other = _subscribed_bus(LocalBackend(), 'other')
+        with mock.patch.object(invalidation, '_bus', this):
+            with self.captureOnCommitCallbacks(execute=True):
+                client.client_name = 'Renamed'
+                client.save()
+        # The copy another process still holds
+        client_cache._cache.local.set(client.client_id, {'client_name': 'Client 0'})
+
+        this.flush()
+        self.assertEqual(this.poll(), 0)
+        self.assertEqual(other.poll(), 1)
+        self.assertIs(client_cache._cache.local.get(client.client_id), MISSING)
+
+    def test_flush_splits_large_batches(self):
+        backend = LocalBackend()
+        backend.max_payload = 300
+        this = _subscribed_bus(backend, 'this')
+        other_backend = LocalBackend()
+        other = _subscribed_bus(other_backend, 'other')
+        for i in range(20):
+            this.publish('client_metadata', f'client-{i}')
+        this.flush()
+        payloads = other_backend.receive(0)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload) <= 300 for payload in payloads))
+        for payload in payloads:
+            other_backend.publish(payload)
+        self.assertEqual(other.poll(), 20)
+
+    def test_cache_backend(self):
+        publisher = CacheBackend()
+        subscriber = CacheBackend(grace=10)
+        subscriber.subscribe()
+        publisher.publish('first')
+        publisher.publish('second')
+        self.assertEqual(subscriber.receive(0), ['first', 'second'])
+
+        # Numbered but not written yet: waited for within the grace period
+        cache.incr(publisher.sequence_key)
+        publisher.publish('third')
+        self.assertEqual(subscriber.receive(0), [])
+        cache.set('hydra:invalidation:3', 'late')
+        self.assertEqual(subscriber.receive(0), ['late', 'third'])
+
+    def test_gap_clears_local_tiers(self):
+        bus = _subscribed_bus(CacheBackend(grace=0), 'this')
+        client_cache._cache.local.set('client-0', {'client_name': 'Client 0'})
+        cache.incr(bus.backend.sequence_key)
+        with mock.patch('builtins.print'):
+            self.assertEqual(bus.poll(), 0)
+        self.assertEqual(len(client_cache._cache.local), 0)
+
+
+class RememberPolicyTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_clients(1)
+        self.hydra.add_login_request('login-1', client_id='client-0')
+        self.hydra.add_consent_request('consent-1', 'alice', client_id='client-0')
+
+    def set_policy(self, **policy):
+        OAuth2Client.objects.filter(client_id='client-0').update(**policy)
+
+    def accept_body(self, kind):
+        path = f'/admin/oauth2/auth/requests/{kind}/accept'
+        return [r.body for r in self.hydra.requests if r.path == path][-1]
+
+    def test_default_asks_the_user(self):
+        response = self.client.get(reverse('login'), {'login_challenge': 'login-1'})
+        self.assertContains(response, 'name="remember"')
+        self.client.post(reverse('login') + '?login_challenge=login-1',
+                         {'username': 'alice', 'password': 'secret-password', 'remember': 'on'})
+        body = self.accept_body('login')
+        self.assertEqual((body['remember'], body['remember_for']), (True, 3600))
+
+    def test_always_remembers(self):
+        self.set_policy(login_remember=OAuth2Client.REMEMBER_ALWAYS, login_remember_for=86400)
+        response = self.client.get(reverse('login'), {'login_challenge': 'login-1'})
+        self.assertNotContains(response, 'name="remember"')
+        self.client.post(reverse('login') + '?login_challenge=login-1',
+                         {'username': 'alice', 'password': 'secret-password'})
+        body = self.accept_body('login')
+        self.assertEqual((body['remember'], body['remember_for']), (True, 86400))
+
+    def test_never_remembers(self):
+        self.set_policy(consent_remember=OAuth2Client.REMEMBER_NEVER)
+        self.client.post(reverse('consent') + '?consent_challenge=consent-1',
+                         {'scopes': ['openid'], 'remember': 'on'})
+        self.assertFalse(self.accept_body('consent')['remember'])
+
+    def test_skip_rates(self):
+        self.hydra.add_consent_request('consent-2', 'alice', client_id='client-0', skip=True)
+        with mock.patch.object(metrics, '_counters', defaultdict(int)):
+            self.client.get(reverse('consent'), {'consent_challenge': 'consent-1'})
+            self.client.get(reverse('consent'), {'consent_challenge': 'consent-2'})
+            self.assertEqual(metrics.get_counter('hydra_challenges', flow='consent', client='client-0', skip='true'), 1)
+            self.assertEqual(metrics.get_counter('hydra_challenges', flow='consent', client='client-0', skip='false'), 1)
+
+        for skip in (True, True, False):
+            AuditEvent.objects.create(event_type=AuditEvent.CONSENT_ACCEPTED, subject='alice', client_id='client-0',
+                                      details={'skip': True} if skip else {})
+        self.assertEqual(skip_rates(), [{
+            'client_id': 'client-0', 'flow': 'consent', 'accepted': 3, 'skipped': 2, 'skip_rate': 2 / 3,
+        }])
+
+
+class FingerprintTests(BudgetTestCase):
+
+    def hydra_clients(self):
+        return [ory_client.OAuth2Client.from_dict(data) for data in self.hydra.clients.values()]
+
+    def test_sync_skips_unchanged_clients(self):
+        self.create_clients(2)
+        with self.assertNumQueries(2):
+            clients, skipped = OAuth2Client.sync_from_hydra_clients(self.hydra_clients(), 'default')
+        self.assertEqual((len(clients), skipped), (2, 2))
+
+        self.hydra.clients['client-1']['client_name'] = 'Renamed in Hydra'
+        clients, skipped = OAuth2Client.sync_from_hydra_clients(self.hydra_clients(), 'default')
+        self.assertEqual(skipped, 1)
+        client = OAuth2Client.objects.get(pk='client-1')
+        self.assertEqual(client.client_name, 'Renamed in Hydra')
+        self.assertTrue(client.is_synced())
+        # Hydra returns no secrets, the local one is kept
+        self.assertEqual(client.client_secret, 'secret')
+
+    def test_empty_values_do_not_change_the_fingerprint(self):
+        client = self.create_clients(1)[0]
+        client.client_uri = ''
+        self.assertTrue(client.is_synced())
+        client.client_uri = 'http://app.test'
+        self.assertFalse(client.is_synced())
+
+    def test_unchanged_update_is_not_queued(self):
+        client = self.create_clients(1)[0]
+        self.client.force_login(self.user)
+        data = {
+            'client_name': client.client_name,
+            'redirect_uris': client.redirect_uris,
+            'grant_types': client.get_grant_types_list(),
+            'response_types': client.get_response_types_list(),
+            'scope': client.scope,
+            'token_endpoint_auth_method': client.token_endpoint_auth_method,
+        }
+        response = self.client.post(reverse('client_update', args=[client.client_id]), data)
+        self.assertRedirects(response, reverse('client_list'), fetch_redirect_response=False)
+        self.assertFalse(HydraOutboxEntry.objects.exists())
+
+
+class JsonPatchTests(BudgetTestCase):
+
+    def changed_client(self):
+        client = self.create_clients(1)[0]
+        client.client_name = 'Renamed'
+        client.set_redirect_uris_list(['http://app.test/callback', 'http://app.test/other'])
+        # An empty secret keeps the one Hydra has
+        client.client_secret = None
+        return client
+
+    def test_patch_has_changed_fields_only(self):
+        self.assertEqual(self.changed_client().to_hydra_patch(), [
+            {'op': 'add', 'path': '/client_name', 'value': 'Renamed'},
+            {'op': 'add', 'path': '/redirect_uris', 'value': ['http://app.test/callback', 'http://app.test/other']},
+        ])
+
+    def test_no_patch_without_hydra_state(self):
+        self.assertIsNone(OAuth2Client(client_id='new', client_name='New').to_hydra_patch())
+
+    def test_push_sends_patch(self):
+        client = self.changed_client()
+        self.assertIsNotNone(HydraClient().push_oauth2_client(client))
+        request = self.hydra.requests[-1]
+        self.assertEqual((request.method, request.path), ('PATCH', '/admin/clients/client-0'))
+        self.assertEqual([operation['path'] for operation in request.body], ['/client_name', '/redirect_uris'])
+        self.assertEqual(self.hydra.clients['client-0']['client_name'], 'Renamed')
+
+    @override_settings(HYDRA_CLIENT_UPDATE_MODE='put')
+    def test_put_mode_replaces_client(self):
+        client = self.changed_client()
+        self.assertIsNotNone(HydraClient().push_oauth2_client(client))
+        request = self.hydra.requests[-1]
+        self.assertEqual((request.method, request.path), ('PUT', '/admin/clients/client-0'))
+        self.assertEqual(request.body['client_name'], 'Renamed')
+
+
+class OutboxTests(BudgetTestCase):
+
+    def queue_create(self, client_id='new-client'):
+        client = OAuth2Client.objects.create(
+            client_id=client_id,
+            client_name='New client',
+            client_secret='secret',
+            redirect_uris=['http://app.test/callback'],
+        )
+        return client, outbox.enqueue(client_id, HydraOutboxEntry.OPERATION_CREATE)
+
+    def make_due(self, entry):
+        HydraOutboxEntry.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now())
+
+    def test_drain_creates_client(self):
+        client, entry = self.queue_create()
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(self.hydra.clients['new-client']['metadata'], {'idempotency_key': str(entry.idempotency_key)})
+        client.refresh_from_db()
+        self.assertTrue(client.is_synced())
+        self.assertEqual(client.hydra_cluster, 'default')
+        self.assertFalse(HydraOutboxEntry.objects.exists())
+
+    def test_admin_sync_creates_unsynced_clients(self):
+        self.create_clients(1)
+        OAuth2Client.objects.update(client_name='Changed')
+        OAuth2Client.objects.create(client_id='new-client', client_name='New client', client_secret='secret')
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin-password')
+        self.client.force_login(admin_user)
+        self.client.post(reverse('admin:hydra_auth_oauth2client_changelist'), {
+            'action': 'sync_with_hydra', '_selected_action': ['client-0', 'new-client'],
+        })
+        self.assertEqual(
+            dict(HydraOutboxEntry.objects.values_list('client_id', 'operation')),
+            {'client-0': HydraOutboxEntry.OPERATION_UPDATE, 'new-client': HydraOutboxEntry.OPERATION_CREATE},
+        )
+        self.assertEqual(outbox.drain(), (2, 0))
+        self.assertIn('new-client', self.hydra.clients)
+
+    def test_failure_backs_off(self):
+        self.queue_create()
+        with mock.patch.object(HydraClient, 'create_oauth2_client', return_value=None):
+            before = timezone.now()
+            self.assertEqual(outbox.drain(), (0, 1))
+            entry = HydraOutboxEntry.objects.get()
+            self.assertEqual((entry.attempts, entry.status), (1, HydraOutboxEntry.STATUS_PENDING))
+            self.assertIn('create', entry.last_error)
+            self.assertGreaterEqual(entry.next_attempt_at, before + timedelta(seconds=5))
+            self.assertLess(entry.next_attempt_at, before + timedelta(seconds=10))
+
+            # Not claimed again before it is due
+            self.assertEqual(outbox.drain(), (0, 0))
+
+            self.make_due(entry)
+            before = timezone.now()
+            self.assertEqual(outbox.drain(), (0, 1))
+            entry.refresh_from_db()
+            self.assertEqual(entry.attempts, 2)
+            self.assertGreaterEqual(entry.next_attempt_at, before + timedelta(seconds=10))
+
+    @override_settings(HYDRA_OUTBOX_MAX_ATTEMPTS=2)
+    def test_entry_fails_after_max_attempts(self):
+        self.queue_create()
+        with mock.patch.object(HydraClient, 'create_oauth2_client', return_value=None):
+            outbox.drain()
+            self.make_due(HydraOutboxEntry.objects.get())
+            outbox.drain()
+        entry = HydraOutboxEntry.objects.get()
+        self.assertEqual((entry.attempts, entry.status), (2, HydraOutboxEntry.STATUS_FAILED))
+        # Failed entries are left for an operator to retry
+        self.make_due(entry)
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    def test_retried_create_adopts_client_with_assigned_id(self):
+        client, entry = self.queue_create()
+        # An earlier attempt reached Hydra, which assigned its own ID, but
+        # the response was lost
+        self.hydra.add_client('hydra-assigned', client_name='New client',
+                              metadata={'idempotency_key': str(entry.idempotency_key)})
+        HydraOutboxEntry.objects.filter(pk=entry.pk).update(attempts=1)
+
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertNotIn('POST', [request.method for request in self.hydra.requests])
+        self.assertEqual(list(self.hydra.clients), ['hydra-assigned'])
+        self.assertFalse(OAuth2Client.objects.filter(pk='new-client').exists())
+        client = OAuth2Client.objects.get(pk='hydra-assigned')
+        self.assertTrue(client.is_synced())
+        self.assertEqual(client.hydra_cluster, 'default')
+        self.assertFalse(HydraOutboxEntry.objects.exists())
+
+    def test_retried_create_without_match_creates_client(self):
+        client, entry = self.queue_create()
+        self.hydra.add_client('other', client_name='New client', metadata={'idempotency_key': 'another-key'})
+        HydraOutboxEntry.objects.filter(pk=entry.pk).update(attempts=1)
+
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertIn('POST', [request.method for request in self.hydra.requests])
+        self.assertEqual(sorted(self.hydra.clients), ['new-client', 'other'])
+
+
+@override_settings(HYDRA_SINGLEFLIGHT_CACHE='default')
+class SingleFlightTests(TestCase):
+    """
+    Two groups of the same name stand in for two processes sharing a cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def share(self, result):
+        """
+        Call Hydra in one group while a caller in the other waits, and
+        return what the waiting caller got and the calls that were made.
+        """
+        started, release = threading.Event(), threading.Event()
+        calls, shared = [], []
+
+        def call_hydra():
+            started.set()
+            release.wait(5)
+            calls.append(result)
+            return result
+
+        def own_call():
+            calls.append('own')
+            return 'own'
+
+        leader = threading.Thread(target=SingleFlight('read').do, args=('key', call_hydra))
+        leader.start()
+        started.wait(5)
+        waiter = threading.Thread(target=lambda: shared.append(SingleFlight('read').do('key', own_call)))
+        waiter.start()
+        time.sleep(0.2)
+        release.set()
+        leader.join(5)
+        waiter.join(5)
+        return shared[0], calls
+
+    def test_waiter_shares_leader_result(self):
+        self.assertEqual(self.share('first'), ('first', ['first']))
+
+    def test_waiter_never_gets_earlier_leader_result(self):
+        self.share('first')
+        self.assertEqual(self.share('second'), ('second', ['second']))
+
+
+class ClientMetadataCacheTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(metrics, '_counters', defaultdict(int))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.create_clients(1)
+
+    def hits(self, tier):
+        return metrics.get_counter('hydra_cache_requests', cache='client_metadata', tier=tier, result='hit')
+
+    def test_lookups_hit_the_cache(self):
+        metadata = get_client_metadata('client-0', HydraClient())
+        self.assertEqual(len(self.hydra.requests), 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_client_metadata('client-0', HydraClient()), metadata)
+        self.assertEqual(self.hits('local'), 1)
+
+        # Another process starts with only the shared tier warm
+        client_cache._cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_client_metadata('client-0', HydraClient()), metadata)
+        self.assertEqual(self.hits('shared'), 1)
+        self.assertEqual(len(self.hydra.requests), 1)
+
+    def test_saving_client_invalidates_both_tiers(self):
+        self.assertEqual(get_client_metadata('client-0', HydraClient())['client_name'], 'client-0')
+        client = OAuth2Client.objects.get(pk='client-0')
+        client.client_name = 'Renamed'
+        client.save()
+
+        self.assertEqual(get_client_metadata('client-0', HydraClient())['client_name'], 'Renamed')
+        self.assertEqual((self.hits('local'), self.hits('shared')), (0, 0))
+
+    def test_deleting_client_invalidates(self):
+        get_client_metadata('client-0', HydraClient())
+        OAuth2Client.objects.filter(pk='client-0').delete()
+        del self.hydra.clients['client-0']
+        self.assertIsNone(get_client_metadata('client-0', HydraClient()))
+
+
+class IntrospectionCacheTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.introspector = TokenIntrospector(HydraClient())
+
+    def introspections(self):
+        return len([request for request in self.hydra.requests if request.path == '/admin/oauth2/introspect'])
+
+    def test_active_token_is_cached(self):
+        self.hydra.add_token('opaque-1', exp=int(time.time()) + 600)
+        self.assertEqual(self.introspector.introspect('opaque-1')['sub'], 'alice')
+        self.assertEqual(self.introspector.introspect('opaque-1')['sub'], 'alice')
+        self.assertEqual(self.introspections(), 1)
+
+    def test_inactive_token_is_cached_briefly(self):
+        self.assertIsNone(self.introspector.introspect('revoked'))
+        self.assertIsNone(self.introspector.introspect('revoked'))
+        self.assertEqual(self.introspections(), 1)
+
+    @override_settings(HYDRA_INTROSPECTION_NEGATIVE_TTL=0)
+    def test_negative_ttl_expires(self):
+        introspector = TokenIntrospector(HydraClient())
+        introspector.introspect('revoked')
+        introspector.introspect('revoked')
+        self.assertEqual(self.introspections(), 2)
+
+    def test_expired_token_is_not_cached(self):
+        self.hydra.add_token('opaque-1', exp=int(time.time()) - 1)
+        self.introspector.introspect('opaque-1')
+        self.introspector.introspect('opaque-1')
+        self.assertEqual(self.introspections(), 2)
+
+    def test_unreachable_hydra_is_not_cached(self):
+        self.hydra.add_token('opaque-1', exp=int(time.time()) + 600)
+        with mock.patch.object(HydraClient, 'introspect_token', return_value=None):
+            self.assertIsNone(self.introspector.introspect('opaque-1'))
+        self.assertEqual(self.introspector.introspect('opaque-1')['sub'], 'alice')
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class StubJWKSSource:
+    """
+    Stands in for HydraClient.get_json_web_keys, serving the given RSA keys,
+    or failing like HydraClient does when keys is None.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.calls = 0
+
+    def get_json_web_keys(self):
+        self.calls += 1
+        if self.keys is None:
+            return None
+        return ory_client.JsonWebKeySet(keys=[
+            ory_client.JsonWebKey(
+                kty='RSA', use='sig', alg='RS256', kid=kid,
+                n=_b64(key.public_numbers().n.to_bytes(256, 'big')),
+                e=_b64(key.public_numbers().e.to_bytes(3, 'big')),
+            )
+            for kid, key in self.keys.items()
+        ])
+
+
+class JWTVerifierTests(TestCase):
+
+    ISSUER = 'http://hydra.test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def setUp(self):
+        self.source = StubJWKSSource({'key-1': self.private_key.public_key()})
+        self.jwks = JWKSCache(self.source, min_refresh_interval=0)
+        self.verifier = JWTVerifier(jwks=self.jwks, issuer=self.ISSUER, audience='api', leeway=0)
+
+    def token(self, key=None, header=None, **claims):
+        header = {'alg': 'RS256', 'kid': 'key-1', **(header or {})}
+        claims = {'iss': self.ISSUER + '/', 'sub': 'alice', 'aud': ['api'], 'scp': ['openid', 'email'],
+                  'exp': time.time() + 60, **claims}
+        signing_input = f'{_b64(json.dumps(header).encode())}.{_b64(json.dumps(claims).encode())}'
+        signature = (key or self.private_key).sign(signing_input.encode('ascii'), padding.PKCS1v15(), hashes.SHA256())
+        return f'{signing_input}.{_b64(signature)}'
+
+    def assertInvalid(self, token, message):
+        with self.assertRaisesMessage(InvalidToken, message):
+            self.verifier.verify(token)
+
+    def test_valid_token(self):
+        claims = self.verifier.verify(self.token())
+        self.assertEqual((claims['sub'], claims['scope'], claims['active']), ('alice', 'openid email', True))
+
+    def test_bad_signature(self):
+        self.assertInvalid(self.token(key=self.other_key), 'Invalid signature')
+        header, _, signature = self.token().split('.')
+        self.assertInvalid(f"{header}.{_b64(json.dumps({'sub': 'mallory'}).encode())}.{signature}",
+                           'Invalid signature')
+
+    def test_algorithm_and_key_id(self):
+        self.assertInvalid(self.token(header={'alg': 'HS256'}), 'Unsupported algorithm')
+        self.assertInvalid(self.token(header={'alg': 'none'}), 'Unsupported algorithm')
+        self.assertInvalid(self.token(header={'alg': ['RS256']}), 'Unsupported algorithm')
+        self.assertInvalid(self.token(header={'kid': ['key-1']}), 'kid must be a string')
+        self.assertInvalid(self.token(header={'kid': 'key-2'}), 'Unknown signing key')
+
+    def test_malformed_tokens(self):
+        for token in ('MQ.eA.eA', 'WzFd.e30.eA', 'e30.WzFd.eA', 'a.b', '!!.e30.eA'):
+            self.assertFalse(looks_like_jwt(token), token)
+            with self.assertRaises(InvalidToken, msg=token):
+                self.verifier.verify(token)
+        self.assertTrue(looks_like_jwt(self.token()))
+
+    def test_registered_claims(self):
+        now = time.time()
+        self.assertInvalid(self.token(exp=now - 1), 'Token expired')
+        self.assertInvalid(self.token(exp=str(now + 60)), 'malformed exp')
+        self.assertInvalid(self.token(exp=None), 'malformed exp')
+        self.assertInvalid(self.token(nbf=now + 60), 'not yet valid')
+        self.assertInvalid(self.token(nbf='later'), 'Malformed nbf')
+        self.assertInvalid(self.token(iss='http://evil.test'), 'Unexpected issuer')
+        self.assertInvalid(self.token(iss=1), 'Unexpected issuer')
+        self.assertInvalid(self.token(aud=['other']), 'Unexpected audience')
+        self.assertInvalid(self.token(aud=1), 'Unexpected audience')
+        self.assertEqual(self.verifier.verify(self.token(aud='api', nbf=now))['sub'], 'alice')
+
+    def test_unknown_key_id_refetches_keys(self):
+        self.verifier.verify(self.token())
+        self.assertEqual(self.source.calls, 1)
+
+        # Hydra rotates its signing key
+        self.source.keys = {'key-2': self.other_key.public_key()}
+        claims = self.verifier.verify(self.token(key=self.other_key, header={'kid': 'key-2'}))
+        self.assertEqual(claims['sub'], 'alice')
+        self.assertEqual(self.source.calls, 2)
+
+    def test_refetch_is_rate_limited(self):
+        self.jwks.min_refresh_interval = 60
+        self.verifier.verify(self.token())
+        for _ in range(3):
+            self.assertInvalid(self.token(header={'kid': 'key-2'}), 'Unknown signing key')
+        self.assertEqual(self.source.calls, 1)
+
+    def test_failed_fetch_backs_off(self):
+        self.jwks.min_refresh_interval = 60
+        self.source.keys = None
+        for _ in range(3):
+            self.assertInvalid(self.token(), 'Unknown signing key')
+        self.assertEqual(self.source.calls, 1)
+
+        # Hydra answers again once the backoff has passed
+        self.source.keys = {'key-1': self.private_key.public_key()}
+        self.jwks._expires_at = self.jwks._refreshed_at = 0
+        self.assertEqual(self.verifier.verify(self.token())['sub'], 'alice')
+        self.assertEqual(self.source.calls, 2)
+
+
+class BoundedExecutorTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def saturate(self, executor, count):
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self.release.wait(5)
+            return 'done'
+
+        futures = [executor.submit(block) for _ in range(count)]
+        started.wait(5)
+        return futures
+
+    def test_rejects_work_beyond_capacity(self):
+        executor = BoundedExecutor('test', max_workers=1, max_pending=1)
+        with mock.patch.object(metrics, '_counters', defaultdict(int)):
+            futures = self.saturate(executor, 2)
+            with self.assertRaises(ExecutorOverloaded):
+                executor.submit(lambda: 'rejected')
+            self.assertEqual(metrics.get_counter('hydra_executor_rejected', executor='test'), 1)
+        self.assertEqual(metrics.get_gauge('hydra_executor_depth', executor='test'), 2)
+
+        self.release.set()
+        self.assertEqual([future.result(5) for future in futures], ['done', 'done'])
+        self.assertEqual(metrics.get_gauge('hydra_executor_depth', executor='test'), 0)
+        # Capacity frees up once the tasks finish
+        self.assertEqual(executor.submit(lambda: 'accepted').result(5), 'accepted')
+
+    def test_login_is_shed_when_saturated(self):
+        executor = BoundedExecutor('password', max_workers=1, max_pending=0)
+        self.saturate(executor, 1)
+        self.hydra.add_login_request('login-1')
+        url = reverse('login') + '?login_challenge=login-1'
+        with mock.patch.object(BoundedExecutor, 'run', _run_on_worker), \
+                mock.patch('hydra_auth.views.get_password_executor', return_value=executor):
+            response = self.client.post(url, {'username': 'alice', 'password': 'secret-password'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+@override_settings(HYDRA_ADMISSION_INITIAL_LIMIT=10, HYDRA_ADMISSION_MIN_LIMIT=2, HYDRA_ADMISSION_TARGET_LATENCY=0.01)
+class AdmissionControlTests(TestCase):
+
+    def setUp(self):
+        self.latency = 0.001
+        self.status = 200
+        self.middleware = admission.AdmissionControlMiddleware(self.get_response)
+        self.limiter = self.middleware.limiters['login']
+
+    def get_response(self, request):
+        record_hydra_call('GET', 'http://hydra.test/admin/oauth2/auth/requests/login', self.latency)
+        return HttpResponse(status=self.status)
+
+    def request(self, method='get'):
+        return self.middleware(getattr(RequestFactory(), method)(reverse('login')))
+
+    def slow_requests(self, count):
+        self.latency = 0.05
+        for _ in range(count):
+            # One back-off per latency window
+            time.sleep(0.02)
+            self.request()
+
+    def test_posts_have_reserved_capacity(self):
+        limiter = admission.AIMDLimiter(initial=10, reserve=0.2)
+        self.assertEqual([limiter.try_acquire() for _ in range(9)], [True] * 8 + [False])
+        self.assertEqual([limiter.try_acquire(priority=True) for _ in range(3)], [True, True, False])
+
+    def test_slow_hydra_sheds_load(self):
+        self.slow_requests(1)
+        self.assertAlmostEqual(self.limiter.limit, 9)
+        # Requests finishing in the same window only back off once
+        self.request()
+        self.assertAlmostEqual(self.limiter.limit, 9)
+
+        self.status = 500
+        self.latency = 0.001
+        time.sleep(0.02)
+        self.request()
+        self.assertAlmostEqual(self.limiter.limit, 8.1)
+        self.status = 200
+
+        self.slow_requests(30)
+        self.assertEqual(self.limiter.limit, 2)
+
+        with mock.patch.object(metrics, '_counters', defaultdict(int)):
+            self.limiter.in_flight = 1
+            response = self.request()
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+            self.assertEqual(metrics.get_counter('hydra_admission_rejected', route='login', method='GET'), 1)
+            # The last slot is held for flows in progress
+            self.assertEqual(self.request('post').status_code, 200)
+
+    def test_recovers_when_hydra_is_healthy(self):
+        self.slow_requests(30)
+        self.assertEqual(self.limiter.limit, 2)
+
+        self.latency = 0.001
+        limits = []
+        for _ in range(20):
+            self.request()
+            limits.append(self.limiter.limit)
+        self.assertEqual(limits, sorted(limits))
+        # About one more request per window of healthy requests
+        self.assertGreater(self.limiter.limit, 6)
+        self.assertLess(self.limiter.limit, 7)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+
+class ConsentClaimsTests(BudgetTestCase):
+
+    def test_claims_follow_granted_scopes(self):
+        self.assertIsNone(claims.get_consent_session('alice', ['openid']))
+        session = claims.get_consent_session('alice', ['openid', 'email'])
+        self.assertEqual(session['id_token'], {'email': 'alice@example.com'})
+        self.assertEqual(session['access_token'], session['id_token'])
+        self.assertEqual(claims.get_consent_session('alice', ['profile'])['id_token'],
+                         {'preferred_username': 'alice'})
+
+    def test_claims_are_cached(self):
+        claims.get_consent_session('alice', ['email'])
+        with self.assertNumQueries(0):
+            claims.get_consent_session('alice', ['profile', 'email'])
+
+    def test_saving_user_invalidates_claims(self):
+        claims.get_consent_session('alice', ['profile'])
+        self.user.first_name = 'Alice'
+        self.user.save()
+        self.assertEqual(claims.get_consent_session('alice', ['profile'])['id_token']['given_name'], 'Alice')
+
+        self.user.delete()
+        self.assertIsNone(claims.get_consent_session('alice', ['profile']))
+
+    def test_login_keeps_claims_cached(self):
+        claims.get_consent_session('alice', ['profile'])
+        self.client.force_login(self.user)
+        with self.assertNumQueries(0):
+            claims.get_consent_session('alice', ['profile'])
+
+
+class RevocationTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin-password')
+        self.create_clients(2)
+
+    def hydra_calls(self, path):
+        return sorted(
+            tuple(sorted(request.query.items())) for request in self.hydra.requests if request.path == path
+        )
+
+    def revoke_action(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:hydra_auth_oauth2client_changelist'), {
+            'action': 'revoke_client_sessions', '_selected_action': ['client-0', 'client-1'],
+        })
+        self.assertEqual(response.status_code, 302)
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_action_deletes_tokens_and_queues_consent_revocation(self):
+        with mock.patch.object(BoundedExecutor, 'submit') as submit:
+            self.revoke_action()
+        self.assertEqual(self.hydra_calls('/admin/oauth2/tokens'),
+                         [(('client_id', 'client-0'),), (('client_id', 'client-1'),)])
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/consent'), [])
+
+        # The queued jobs revoke the consent of every local user
+        for call in submit.call_args_list:
+            self.assertEqual(call.args[0](*call.args[1:]), (2, 0))
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/consent'), [
+            (('client', client_id), ('subject', subject))
+            for client_id in ('client-0', 'client-1') for subject in ('admin', 'alice')
+        ])
+
+    def test_action_points_to_command_when_queue_is_full(self):
+        with mock.patch.object(BoundedExecutor, 'submit', side_effect=ExecutorOverloaded):
+            messages = self.revoke_action()
+        self.assertEqual(len(self.hydra_calls('/admin/oauth2/tokens')), 2)
+        for client_id in ('client-0', 'client-1'):
+            self.assertTrue(any(f'revoke_hydra_sessions --client {client_id}' in message for message in messages))
+
+    def revoke_users_action(self):
+        self.client.force_login(self.admin)
+        user_ids = get_user_model().objects.values_list('pk', flat=True)
+        response = self.client.post(reverse('admin:auth_user_changelist'), {
+            'action': 'revoke_hydra_sessions', '_selected_action': [str(pk) for pk in user_ids],
+        })
+        self.assertEqual(response.status_code, 302)
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_user_action_queues_session_revocation(self):
+        with mock.patch.object(BoundedExecutor, 'submit') as submit:
+            self.revoke_users_action()
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/login'), [])
+
+        (call,) = submit.call_args_list
+        self.assertEqual(call.args[0](*call.args[1:]), (2, 0))
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/login'),
+                         [(('subject', 'admin'),), (('subject', 'alice'),)])
+
+    def test_user_action_points_to_command_when_queue_is_full(self):
+        with mock.patch.object(BoundedExecutor, 'submit', side_effect=ExecutorOverloaded):
+            messages = self.revoke_users_action()
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/login'), [])
+        self.assertTrue(any('revoke_hydra_sessions --login' in message for message in messages))
+
+    def test_command_revokes_client(self):
+        out = io.StringIO()
+        call_command('revoke_hydra_sessions', client='client-0', stdout=out)
+        self.assertEqual(self.hydra_calls('/admin/oauth2/tokens'), [(('client_id', 'client-0'),)])
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/consent'), [
+            (('client', 'client-0'), ('subject', 'admin')), (('client', 'client-0'), ('subject', 'alice')),
+        ])
+        self.assertIn('Done: 2 subjects processed, 0 failed', out.getvalue())
+
+    def test_command_revokes_subjects(self):
+        report = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'report.jsonl')
+        call_command('revoke_hydra_sessions', subject=['alice'], login=True, report=report, stdout=io.StringIO())
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/consent'),
+                         [(('all', 'true'), ('subject', 'alice'))])
+        self.assertEqual(self.hydra_calls('/admin/oauth2/auth/sessions/login'), [(('subject', 'alice'),)])
+        with open(report) as lines:
+            self.assertEqual([json.loads(line) for line in lines], [{'subject': 'alice', 'ok': True, 'error': ''}])
+
+    def test_command_rejects_login_for_client(self):
+        with self.assertRaisesMessage(CommandError, '--login cannot be combined with --client'):
+            call_command('revoke_hydra_sessions', client='client-0', login=True)
+
+    def test_command_rejects_nothing_to_revoke(self):
+        with self.assertRaisesMessage(CommandError, '--no-consent needs --login'):
+            call_command('revoke_hydra_sessions', subject=['alice'], no_consent=True)
+
+
+class AuditLogTests(TestCase):
+
+    def setUp(self):
+        self.fallback_path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'audit.jsonl')
+
+    def audit_log(self, worker=False, **kwargs):
+        kwargs.setdefault('fallback_path', self.fallback_path)
+        log = audit.AuditLog(**kwargs)
+        if not worker:
+            # Flushed by the test instead of the background thread
+            log._worker_pid = os.getpid()
+        return log
+
+    def watch_flushes(self, log, fail_first=False):
+        """
+        Replace log.flush with a stand-in and return an event set on each call.
+        """
+        flushed = threading.Event()
+        calls = []
+
+        def flush():
+            calls.append(len(log._events))
+            if fail_first and len(calls) == 1:
+                raise DatabaseError('connection lost')
+            flushed.set()
+
+        log.flush = flush
+        return flushed, calls
+
+    def test_flush_when_buffer_is_full(self):
+        log = self.audit_log(worker=True, buffer_size=2, flush_interval=60)
+        flushed, calls = self.watch_flushes(log)
+        log.record(AuditEvent.LOGIN_ACCEPTED, 'alice')
+        self.assertFalse(flushed.wait(0.1))
+        log.record(AuditEvent.LOGIN_ACCEPTED, 'alice')
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(calls, [2])
+
+    def test_flush_on_interval(self):
+        log = self.audit_log(worker=True, buffer_size=100, flush_interval=0.05)
+        flushed, calls = self.watch_flushes(log)
+        log.record(AuditEvent.LOGIN_ACCEPTED, 'alice')
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(calls[0], 1)
+
+    def test_worker_survives_failed_flush(self):
+        log = self.audit_log(worker=True, buffer_size=100, flush_interval=0.05)
+        flushed, calls = self.watch_flushes(log, fail_first=True)
+        log.record(AuditEvent.LOGIN_ACCEPTED, 'alice')
+        self.assertTrue(flushed.wait(5))
+        self.assertGreaterEqual(len(calls), 2)
+
+    def test_flush_writes_events(self):
+        log = self.audit_log()
+        log.record(AuditEvent.CONSENT_ACCEPTED, 'alice', 'client-0', scopes=['openid'])
+        self.assertEqual(log.flush(), 1)
+        event = AuditEvent.objects.get()
+        self.assertEqual((event.subject, event.client_id, event.details), ('alice', 'client-0', {'scopes': ['openid']}))
+
+    def test_fallback_round_trip(self):
+        log = self.audit_log()
+        log.record(AuditEvent.LOGIN_ACCEPTED, 'alice', 'client-0', remember=True)
+        log.record(AuditEvent.LOGOUT_ACCEPTED, 'alice')
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', side_effect=DatabaseError('database is down')):
+            self.assertEqual(log.flush(), 2)
+        self.assertFalse(AuditEvent.objects.exists())
+        self.assertTrue(os.path.exists(self.fallback_path))
+
+        self.assertEqual(log.load_fallback(), 2)
+        self.assertFalse(os.path.exists(self.fallback_path))
+        self.assertEqual(
+            list(AuditEvent.objects.order_by('id').values_list('event_type', 'subject', 'client_id', 'details')),
+            [(AuditEvent.LOGIN_ACCEPTED, 'alice', 'client-0', {'remember': True}),
+             (AuditEvent.LOGOUT_ACCEPTED, 'alice', '', {})],
+        )
+        self.assertEqual(log.load_fallback(), 0)
+
+    def test_full_buffer_spills_oldest_events(self):
+        log = self.audit_log(buffer_size=2, max_buffered=4)
+        for i in range(5):
+            log.record(AuditEvent.LOGIN_ACCEPTED, f'user-{i}')
+        self.assertEqual([event['subject'] for event in log._events], ['user-2', 'user-3', 'user-4'])
+        with open(self.fallback_path) as f:
+            self.assertEqual([json.loads(line)['subject'] for line in f], ['user-0', 'user-1'])
+
+    def test_unwritable_fallback_keeps_events(self):
+        log = self.audit_log(fallback_path=os.path.join(self.fallback_path, 'missing', 'audit.jsonl'))
+        log.record(AuditEvent.LOGIN_ACCEPTED, 'alice')
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', side_effect=DatabaseError('database is down')), \
+                self.assertRaises(OSError):
+            log.flush()
+        self.assertEqual(len(log._events), 1)
+
+
+class SecretRotationTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.export_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.key = Fernet.generate_key()
+        self.enterContext(self.settings(HYDRA_SECRET_EXPORT_KEY=self.key, HYDRA_SECRET_EXPORT_DIR=self.export_dir))
+        self.create_clients(2)
+        self.output = os.path.join(self.export_dir, 'secrets.enc')
+
+    def rotate(self, **options):
+        out = io.StringIO()
+        call_command('rotate_client_secrets', stdout=out, **options)
+        return out.getvalue()
+
+    def test_stage_then_activate(self):
+        self.assertIn('Staged new secrets for 1 clients', self.rotate(client=['client-0'], output=self.output))
+        client = OAuth2Client.objects.get(pk='client-0')
+        new_secret = client.next_client_secret
+        self.assertEqual(client.client_secret, 'secret')
+        self.assertIsNone(OAuth2Client.objects.get(pk='client-1').next_client_secret)
+        self.assertEqual(self.hydra.requests, [])
+
+        # Not due before the grace period is over
+        self.assertIn('Activated 0 secrets', self.rotate(activate=True))
+        OAuth2Client.objects.filter(pk='client-0').update(
+            next_secret_activates_at=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertIn('Activated 1 secrets in Hydra (0 failed)', self.rotate(activate=True))
+
+        client.refresh_from_db()
+        self.assertEqual((client.client_secret, client.next_client_secret, client.next_secret_activates_at),
+                         (new_secret, None, None))
+        self.assertEqual(self.hydra.clients['client-0']['client_secret'], new_secret)
+        self.assertTrue(client.is_synced())
+
+    def test_export_round_trip(self):
+        self.rotate(all=True, output=self.output, grace=60)
+        self.assertEqual(os.stat(self.output).st_mode & 0o777, 0o600)
+        secrets = dict(OAuth2Client.objects.values_list('client_id', 'next_client_secret'))
+        records = list(read_secret_export(self.output))
+        self.assertEqual({record['client_id']: record['client_secret'] for record in records}, secrets)
+
+        out = io.StringIO()
+        call_command('read_secret_export', self.output, stdout=out)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], records)
+
+        with self.assertRaises(InvalidFernetToken):
+            list(read_secret_export(self.output, key=Fernet.generate_key()))
+
+    def test_export_tightens_existing_file(self):
+        with open(self.output, 'w'):
+            pass
+        os.chmod(self.output, 0o644)
+        self.rotate(all=True, output=self.output)
+        self.assertEqual(os.stat(self.output).st_mode & 0o777, 0o600)
+
+    def rotate_action(self, export_dir):
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin-password')
+        self.client.force_login(admin_user)
+        with self.settings(HYDRA_SECRET_EXPORT_DIR=export_dir):
+            response = self.client.post(reverse('admin:hydra_auth_oauth2client_changelist'), {
+                'action': 'rotate_client_secrets', '_selected_action': ['client-0'],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(OAuth2Client.objects.filter(next_client_secret__isnull=False).exists())
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_admin_action_requires_export_dir(self):
+        messages = self.rotate_action(None)
+        self.assertIn('HYDRA_SECRET_EXPORT_DIR must be set', messages[0])
+
+    def test_admin_action_reports_missing_export_dir(self):
+        messages = self.rotate_action(os.path.join(self.export_dir, 'missing'))
+        self.assertIn('Cannot write the secret export', messages[0])
+
+
+class RoutingTests(TestCase):
+
+    CLUSTERS = {
+        name: {'admin_url': f'http://{name}.test:4445', 'public_url': f'http://{name}.test:4444'}
+        for name in ('eu', 'us', 'ap')
+    }
+    KEYS = [f'client-{i}' for i in range(2000)]
+
+    def placement(self, nodes):
+        ring = HashRing(nodes)
+        return {key: ring.get_node(key) for key in self.KEYS}
+
+    def test_placement_is_stable_and_balanced(self):
+        placement = self.placement(['eu', 'us', 'ap'])
+        self.assertEqual(placement, self.placement(['ap', 'eu', 'us']))
+        for node in ('eu', 'us', 'ap'):
+            self.assertGreater(list(placement.values()).count(node), len(self.KEYS) * 0.2)
+
+    def test_adding_cluster_only_moves_keys_to_it(self):
+        before = self.placement(['eu', 'us', 'ap'])
+        after = self.placement(['eu', 'us', 'ap', 'sa'])
+        moved = [key for key in self.KEYS if before[key] != after[key]]
+        self.assertEqual({after[key] for key in moved}, {'sa'})
+        self.assertLess(len(moved), len(self.KEYS) * 0.35)
+
+    def test_removing_cluster_only_moves_its_keys(self):
+        before = self.placement(['eu', 'us', 'ap'])
+        after = self.placement(['eu', 'us'])
+        self.assertEqual([key for key in self.KEYS if before[key] != after[key]],
+                         [key for key in self.KEYS if before[key] == 'ap'])
+
+    def test_stored_and_pinned_clusters_win(self):
+        router = HydraRouter(self.CLUSTERS, pins={'pinned': 'ap'})
+        self.assertEqual(router.cluster_for_key('pinned'), 'ap')
+        hashed = router.cluster_for_key('client-1')
+        stored = next(name for name in self.CLUSTERS if name != hashed)
+
+        client = OAuth2Client.objects.create(client_id='client-1', client_name='Client', hydra_cluster=stored)
+        self.assertEqual(router.for_client(client).cluster, stored)
+        self.assertEqual(router.for_client_id('client-1').cluster, stored)
+        # A cluster added later does not move a placed client
+        router = HydraRouter({**self.CLUSTERS, 'sa': {'admin_url': 'http://sa.test:4445'}})
+        self.assertEqual(router.for_client_id('client-1').cluster, stored)
+
+    def test_one_client_per_cluster(self):
+        router = HydraRouter(self.CLUSTERS)
+        key = next(key for key in self.KEYS if router.cluster_for_key(key) == 'us')
+        self.assertIs(router.for_key(key), router.for_cluster('us'))
+        self.assertEqual(router.for_cluster().cluster, 'eu')
+        self.assertEqual(set(router.all()), {'eu', 'us', 'ap'})
+        with self.assertRaises(KeyError):
+            router.for_cluster('mars')
+
+
+class ReadinessTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.probe = health.HealthProbe(interval=60, max_age=60)
+        # Checked by the test instead of the probe thread
+        self.probe._worker_pid = os.getpid()
+        self.enterContext(mock.patch.object(health, '_probe', self.probe))
+        self.enterContext(mock.patch.object(health.HealthProbe, '_check_database', return_value=True))
+
+    def readyz(self):
+        response = self.client.get('/readyz')
+        return response.status_code, json.loads(response.content)
+
+    def test_starting_until_first_check(self):
+        self.assertEqual(self.readyz(), (503, {'status': 'starting'}))
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+
+    def test_ready(self):
+        self.probe.check()
+        status, report = self.readyz()
+        self.assertEqual((status, report['status']), (200, 'ready'))
+        self.assertEqual(report['checks'], {'database': True, 'hydra:default': True})
+        self.assertEqual(report['clusters']['default']['admin_circuit'], 'closed')
+        # Probes are answered from memory
+        requests = len(self.hydra.requests)
+        with self.assertNumQueries(0):
+            self.readyz()
+        self.assertEqual(len(self.hydra.requests), requests)
+
+    def test_degraded_when_hydra_is_not_ready(self):
+        with mock.patch.object(HydraClient, 'is_ready', return_value=False):
+            self.probe.check()
+        status, report = self.readyz()
+        self.assertEqual((status, report['status']), (503, 'unavailable'))
+        self.assertEqual(report['checks'], {'database': True, 'hydra:default': False})
+
+    def test_stale_report_is_not_ready(self):
+        self.probe.check()
+        self.probe.max_age = 0.01
+        time.sleep(0.02)
+        status, report = self.readyz()
+        self.assertEqual((status, report['status']), (503, 'stale'))
+        self.assertTrue(report['checks']['hydra:default'])
+
+
+class ProfilingTests(BudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(HYDRA_PROFILE_DIR=self.profile_dir, HYDRA_PROFILE_INTERVAL=0.001,
+                                        HYDRA_PROFILE_KEEP=2))
+        self.hydra.add_login_request('login-1')
+
+    def login(self, token=None):
+        headers = {'X-Hydra-Profile': token} if token is not None else {}
+        response = self.client.get(reverse('login'), {'login_challenge': 'login-1'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_signed_requests_are_profiled(self):
+        self.login()
+        self.login('profile')
+        self.login(make_profile_token() + 'x')
+        self.assertFalse(RequestProfile.objects.exists())
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_signed_request_is_profiled(self):
+        self.login(make_profile_token())
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.method, profile.view_name, profile.status_code, profile.hydra_calls),
+                         ('GET', 'login', 200, 1))
+        self.assertEqual(os.listdir(self.profile_dir), [profile.file_name])
+
+    def test_failing_save_does_not_fail_request(self):
+        with mock.patch.object(RequestProfile.objects, 'create', side_effect=DatabaseError('database is down')):
+            self.login(make_profile_token())
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_old_profiles_are_pruned(self):
+        for _ in range(3):
+            self.login(make_profile_token())
+        kept = set(RequestProfile.objects.values_list('file_name', flat=True))
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(set(os.listdir(self.profile_dir)), kept)
+
+
+class CommitInvalidationTests(BudgetTestCase):
+
+    def test_shared_tier_is_dropped_after_commit(self):
+        self.create_clients(1)
+        stale = get_client_metadata('client-0', HydraClient())
+        shared_key = client_cache._cache._shared_key('client-0')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client = OAuth2Client.objects.get(pk='client-0')
+            client.client_name = 'Renamed'
+            client.save()
+            self.assertIs(cache.get(shared_key, MISSING), MISSING)
+            # Another process reads the row before the commit and caches it again
+            client_cache._cache.set('client-0', stale)
+
+        self.assertIs(cache.get(shared_key, MISSING), MISSING)
+        self.assertEqual(get_client_metadata('client-0', HydraClient())['client_name'], 'Renamed')
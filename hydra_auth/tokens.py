@@ -0,0 +1,163 @@
+"""
+Cached client_credentials tokens for service-to-service calls.
+
+ClientCredentialsTokenProvider hands out access tokens per client, scope and
+audience, and only asks Hydra's token endpoint when no usable token is
+cached. Tokens live in a per-process LRU and in the HYDRA_TOKEN_CACHE alias,
+so every worker shares them. They are refreshed HYDRA_TOKEN_REFRESH_MARGIN
+seconds before they expire: the first caller inside that window fetches a
+new token, in this process and across workers, while the others keep using
+the current one. Callers without a usable token wait for a single fetch per
+key. Lookups are counted in hydra_token_requests by result: hit, shared_hit,
+stale, refresh and miss.
+
+The shared cache holds bearer tokens, so it must be no more widely readable
+than this app's own secrets.
+"""
+
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .caching import MISSING, LRUCache
+from .routing import get_router
+from .singleflight import SingleFlight
+
+
+class ClientCredentialsTokenProvider:
+    """
+    Cached, proactively refreshed client_credentials tokens from one Hydra cluster.
+    """
+
+    def __init__(self, hydra_client=None):
+        self.hydra_client = hydra_client or get_router().for_cluster()
+        self.alias = getattr(settings, 'HYDRA_TOKEN_CACHE', 'default')
+        self.refresh_margin = getattr(settings, 'HYDRA_TOKEN_REFRESH_MARGIN', 60)
+        self._local = LRUCache(maxsize=getattr(settings, 'HYDRA_TOKEN_CACHE_LOCAL_SIZE', 1024))
+        self._fetches = SingleFlight('client_credentials')
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _key(self, client_id, scope, audience):
+        raw = '\n'.join([
+            self.hydra_client.public_configuration.host, client_id, ' '.join(sorted(scope)), ' '.join(sorted(audience)),
+        ])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _shared_key(self, key):
+        return f'hydra:client_credentials:{key}'
+
+    def get_token(self, client_id, client_secret, scope=(), audience=()):
+        """
+        Get an access token for a client.
+
+        Args:
+            client_id (str): ID of the client
+            client_secret (str): Secret of the client
+            scope (list, optional): Scopes the token must carry
+            audience (list, optional): Audiences the token must carry
+
+        Returns:
+            str: An unexpired access token, or None if Hydra could not issue one
+        """
+        key = self._key(client_id, scope, audience)
+        now = time.time()
+        token = self._local.get(key)
+        result = 'hit'
+        if token is MISSING or token['refresh_at'] <= now:
+            # Another worker may have fetched or refreshed it already
+            shared = caches[self.alias].get(self._shared_key(key))
+            if shared is not None and (token is MISSING or shared['expires_at'] > token['expires_at']):
+                token = shared
+                result = 'shared_hit'
+                self._store_local(key, token)
+
+        if token is not MISSING and now < token['refresh_at']:
+            metrics.increment('hydra_token_requests', result=result)
+            return token['access_token']
+
+        if token is not MISSING and now < token['expires_at']:
+            if not self._claim_refresh(key):
+                metrics.increment('hydra_token_requests', result='stale')
+                return token['access_token']
+            metrics.increment('hydra_token_requests', result='refresh')
+            try:
+                fresh = self._fetch(key, client_id, client_secret, scope, audience)
+            finally:
+                self._release_refresh(key)
+            # While Hydra is unreachable the current token is served until it expires
+            return (fresh or token)['access_token']
+
+        metrics.increment('hydra_token_requests', result='miss')
+        fresh = self._fetches.do(key, self._fetch, key, client_id, client_secret, scope, audience)
+        return fresh['access_token'] if fresh else None
+
+    def invalidate(self, client_id, scope=(), audience=()):
+        """
+        Drop a cached token, e.g. after a downstream service rejected it.
+        """
+        key = self._key(client_id, scope, audience)
+        self._local.delete(key)
+        caches[self.alias].delete(self._shared_key(key))
+
+    def _store_local(self, key, token):
+        self._local.set(key, token, token['expires_at'] - time.time())
+
+    def _claim_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+        if caches[self.alias].add(f'{self._shared_key(key)}:refresh', 1, 10):
+            return True
+        with self._lock:
+            self._refreshing.discard(key)
+        return False
+
+    def _release_refresh(self, key):
+        caches[self.alias].delete(f'{self._shared_key(key)}:refresh')
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def _fetch(self, key, client_id, client_secret, scope, audience):
+        response = self.hydra_client.request_client_credentials_token(client_id, client_secret, scope, audience)
+        if not response or not response.get('access_token'):
+            metrics.increment('hydra_token_fetches', result='error')
+            return None
+        metrics.increment('hydra_token_fetches', result='ok')
+
+        now = time.time()
+        lifetime = response.get('expires_in') or 0
+        # Short-lived tokens are refreshed halfway through their lifetime
+        margin = min(self.refresh_margin, lifetime / 2)
+        token = {
+            'access_token': response['access_token'],
+            'expires_at': now + lifetime,
+            'refresh_at': now + lifetime - margin,
+        }
+        if lifetime > 0:
+            caches[self.alias].set(self._shared_key(key), token, lifetime)
+            self._store_local(key, token)
+        return token
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(cluster=None):
+    """
+    Get the shared token provider of a Hydra cluster, the default one if
+    cluster is empty.
+    """
+    hydra_client = get_router().for_cluster(cluster)
+    with _providers_lock:
+        provider = _providers.get(hydra_client.cluster)
+        if provider is None:
+            provider = _providers[hydra_client.cluster] = ClientCredentialsTokenProvider(hydra_client)
+        return provider
@@ -0,0 +1,152 @@
+"""
+Transports for the Hydra API clients, selected by the scheme of the URL.
+
+- http:// and https:// use the Ory client's own urllib3 pool manager.
+- http+unix://<percent-encoded socket path> speaks HTTP/1.1 with keep-alive
+  over a Unix domain socket, for a Hydra running next to the app, e.g.
+  http+unix://%2Frun%2Fhydra%2Fadmin.sock with Hydra's serve.admin.host set
+  to unix:/run/hydra/admin.sock. No TCP handshake, no loopback stack.
+- h2:// (TLS, negotiated by ALPN) and h2c:// (cleartext, prior knowledge)
+  multiplex all requests of a process over one HTTP/2 connection per host,
+  for a remote Hydra. They need httpx with HTTP/2 support, installed by
+  the http2 extra: pip install '.[http2]'.
+
+Each transport stands in for the urllib3 PoolManager the Ory client calls,
+so HydraClient, its instrumentation and circuit breakers work unchanged.
+"""
+
+
+import socket
+from urllib.parse import unquote, urlencode, urlsplit
+
+import urllib3
+from django.core.exceptions import ImproperlyConfigured
+from urllib3.connection import HTTPConnection
+
+UNIX_SCHEME = 'http+unix'
+HTTP2_SCHEMES = {'h2': 'https', 'h2c': 'http'}
+
+
+def _path_and_query(url):
+    parts = urlsplit(url)
+    return parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+class UnixSocketConnection(HTTPConnection):
+    """
+    HTTP connection over a Unix domain socket.
+    """
+
+    def __init__(self, *args, socket_path, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixSocketConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = UnixSocketConnection
+
+
+class UnixSocketPoolManager:
+    """
+    Send every request to one Unix domain socket, keeping up to maxsize
+    connections alive.
+    """
+
+    def __init__(self, socket_path, maxsize=None):
+        self.socket_path = socket_path
+        # Host only fills the Host header, the socket decides where requests go
+        self.pool = UnixSocketConnectionPool('localhost', maxsize=maxsize or 1, socket_path=socket_path)
+        self.pools = {socket_path: self.pool}
+
+    def request(self, method, url, **kwargs):
+        return self.pool.request(method, _path_and_query(url), **kwargs)
+
+
+class Http2Response:
+    """
+    The parts of urllib3's HTTPResponse the Ory client reads, over an httpx response.
+    """
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self.reason = response.reason_phrase
+        self.data = response.content
+        self.headers = response.headers
+
+    def release_conn(self):
+        # The body is already read and the stream is back in the connection
+        pass
+
+
+class Http2PoolManager:
+    """
+    Send requests over multiplexed HTTP/2 connections with httpx.
+    """
+
+    def __init__(self, scheme, configuration):
+        try:
+            import httpx
+        except ImportError:
+            raise ImproperlyConfigured(
+                f"{scheme}:// Hydra URLs need httpx with HTTP/2 support: install the http2 extra"
+            )
+
+        self._httpx = httpx
+        self.scheme = HTTP2_SCHEMES[scheme]
+        verify = configuration.verify_ssl
+        if verify and configuration.ssl_ca_cert:
+            verify = configuration.ssl_ca_cert
+        self.client = httpx.Client(
+            # Cleartext HTTP/2 needs prior knowledge, TLS falls back to HTTP/1.1 via ALPN
+            http1=scheme == 'h2',
+            http2=True,
+            verify=verify,
+            timeout=None,
+            limits=httpx.Limits(max_connections=configuration.connection_pool_maxsize),
+        )
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return None
+        connect = timeout.connect_timeout
+        read = timeout.read_timeout
+        return self._httpx.Timeout(
+            None,
+            connect=connect if isinstance(connect, (int, float)) else None,
+            read=read if isinstance(read, (int, float)) else None,
+        )
+
+    def request(self, method, url, body=None, fields=None, headers=None, timeout=None, encode_multipart=False,
+                preload_content=True):
+        if fields:
+            if encode_multipart:
+                raise ValueError("Multipart bodies are not supported over HTTP/2")
+            body = urlencode(fields)
+        url = f'{self.scheme}:{url.split(":", 1)[1]}'
+        response = self.client.request(method, url, content=body, headers=headers,
+                                       timeout=self._timeout(timeout))
+        return Http2Response(response)
+
+
+def make_pool_manager(configuration):
+    """
+    Get the transport for a Configuration's host, or None for the default
+    urllib3 pool manager.
+    """
+    parts = urlsplit(configuration.host)
+    if parts.scheme == UNIX_SCHEME:
+        return UnixSocketPoolManager(unquote(parts.netloc), configuration.connection_pool_maxsize)
+    if parts.scheme in HTTP2_SCHEMES:
+        return Http2PoolManager(parts.scheme, configuration)
+    return None
@@ -1,15 +1,37 @@
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
+from django.db import transaction
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from . import audit, metrics, outbox
+from .claims import get_consent_session
+from .client_cache import get_client_metadata
+from .executors import ExecutorOverloaded, get_password_executor
 from .forms import OAuth2ClientForm
-from .hydra_client import HydraClient
-from .models import OAuth2Client
+from .models import AuditEvent, HydraOutboxEntry, OAuth2Client
+from .policies import get_remember_policy, record_challenge, remember_decision
+from .routing import cluster_from_request, get_router
 
-hydra_client = HydraClient()
+
+def _client_id(hydra_request):
+    return hydra_request.client.client_id if hydra_request.client else ''
+
+def _challenge_hydra_client(request):
+    """
+    Get the HydraClient of the cluster that issued the request's challenge.
+    """
+    try:
+        return get_router().for_cluster(cluster_from_request(request))
+    except KeyError:
+        return None
+
+def _logout_rejected_url():
+    # Hydra has no redirect for a rejected logout
+    return getattr(settings, 'HYDRA_LOGOUT_REJECTED_URL', '/')
 
 # Login, Consent, and Logout views (existing code)
 
@@ -21,48 +43,72 @@ def login_view(request):
     login_challenge = request.GET.get('login_challenge')
     if not login_challenge:
         return HttpResponse('Login challenge is missing', status=400)
+    hydra_client = _challenge_hydra_client(request)
+    if hydra_client is None:
+        return HttpResponse('Unknown Hydra cluster', status=400)
     
     # Fetch the login request from Hydra
     login_request = hydra_client.get_login_request(login_challenge)
     if not login_request:
         return HttpResponse('Invalid login challenge', status=400)
     
+    client_id = _client_id(login_request)
+    policy = get_remember_policy(client_id, hydra_client, login_request.client)
+    if login_request.skip or request.method == 'GET':
+        record_challenge('login', client_id, login_request.skip)
+    
     # If user is already authenticated, accept the login request
     if login_request.skip:
+        remember, remember_for = remember_decision(policy, 'login', True)
         accept_response = hydra_client.accept_login_request(
             login_challenge=login_challenge,
             subject=login_request.subject,
-            remember=True
+            remember=remember,
+            remember_for=remember_for
         )
+        audit.record(AuditEvent.LOGIN_ACCEPTED, login_request.subject, client_id, request, skip=True)
         return redirect(accept_response.redirect_to)
     
     # Handle form submission
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
-        if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                remember = request.POST.get('remember', False) == 'on'
-                
-                # Accept the login request
-                accept_response = hydra_client.accept_login_request(
-                    login_challenge=login_challenge,
-                    subject=username,
-                    remember=remember
-                )
-                return redirect(accept_response.redirect_to)
-            else:
-                form.add_error(None, "Invalid username or password")
+        
+        # Validation authenticates the user, so the password hash check runs
+        # exactly once, on the size-capped password executor
+        try:
+            is_valid = get_password_executor().run(form.is_valid)
+        except ExecutorOverloaded:
+            response = HttpResponse('Too many sign-in attempts in progress, please retry shortly', status=503)
+            response['Retry-After'] = '1'
+            return response
+        
+        if is_valid:
+            user = form.get_user()
+            login(request, user)
+            remember, remember_for = remember_decision(
+                policy, 'login', request.POST.get('remember', False) == 'on'
+            )
+            
+            # Accept the login request
+            accept_response = hydra_client.accept_login_request(
+                login_challenge=login_challenge,
+                subject=user.get_username(),
+                remember=remember,
+                remember_for=remember_for
+            )
+            audit.record(AuditEvent.LOGIN_ACCEPTED, user.get_username(), client_id, request,
+                         remember=remember)
+            return redirect(accept_response.redirect_to)
         # If form is invalid, it will be rendered with errors
+        audit.record(AuditEvent.LOGIN_FAILED, request.POST.get('username', ''), client_id, request)
     else:
         form = AuthenticationForm()
     
     return render(request, 'hydra_auth/login.html', {
         'form': form,
-        'login_challenge': login_challenge
+        'login_challenge': login_challenge,
+        'hydra_cluster': cluster_from_request(request),
+        'ask_remember': policy['login_remember'] == OAuth2Client.REMEMBER_ASK,
     })
 
 def login_reject(request):
@@ -72,12 +118,16 @@ def login_reject(request):
     login_challenge = request.GET.get('login_challenge')
     if not login_challenge:
         return HttpResponse('Login challenge is missing', status=400)
+    hydra_client = _challenge_hydra_client(request)
+    if hydra_client is None:
+        return HttpResponse('Unknown Hydra cluster', status=400)
     
     reject_response = hydra_client.reject_login_request(
         login_challenge=login_challenge,
         error="access_denied",
         error_description="The user rejected the authentication request"
     )
+    audit.record(AuditEvent.LOGIN_REJECTED, request=request)
     
     return redirect(reject_response.redirect_to)
 
@@ -89,43 +139,73 @@ def consent_view(request):
     consent_challenge = request.GET.get('consent_challenge')
     if not consent_challenge:
         return HttpResponse('Consent challenge is missing', status=400)
+    hydra_client = _challenge_hydra_client(request)
+    if hydra_client is None:
+        return HttpResponse('Unknown Hydra cluster', status=400)
     
     # Fetch the consent request from Hydra
     consent_request = hydra_client.get_consent_request(consent_challenge)
     if not consent_request:
         return HttpResponse('Invalid consent challenge', status=400)
     
+    client_id = _client_id(consent_request)
+    policy = get_remember_policy(client_id, hydra_client, consent_request.client)
+    if consent_request.skip or request.method == 'GET':
+        record_challenge('consent', client_id, consent_request.skip)
+    
     # If the user has previously given consent and no new scopes are requested, 
     # we can skip showing the consent screen
     if consent_request.skip:
+        remember, remember_for = remember_decision(policy, 'consent', True)
         accept_response = hydra_client.accept_consent_request(
             consent_challenge=consent_challenge,
             grant_scope=consent_request.requested_scope,
             grant_access_token_audience=consent_request.requested_access_token_audience,
-            remember=True
+            remember=remember,
+            remember_for=remember_for,
+            session=get_consent_session(consent_request.subject, consent_request.requested_scope)
         )
+        audit.record(AuditEvent.CONSENT_ACCEPTED, consent_request.subject, client_id, request,
+                     scopes=consent_request.requested_scope, skip=True)
         return redirect(accept_response.redirect_to)
     
     # Handle form submission
     if request.method == 'POST':
         # Get the selected scopes from the form
         granted_scopes = request.POST.getlist('scopes')
-        remember = request.POST.get('remember', False) == 'on'
+        remember, remember_for = remember_decision(
+            policy, 'consent', request.POST.get('remember', False) == 'on'
+        )
         
         # Accept the consent request
         accept_response = hydra_client.accept_consent_request(
             consent_challenge=consent_challenge,
             grant_scope=granted_scopes,
             grant_access_token_audience=consent_request.requested_access_token_audience,
-            remember=remember
+            remember=remember,
+            remember_for=remember_for,
+            session=get_consent_session(consent_request.subject, granted_scopes)
         )
+        audit.record(AuditEvent.CONSENT_ACCEPTED, consent_request.subject, client_id, request,
+                     scopes=granted_scopes, remember=remember)
         return redirect(accept_response.redirect_to)
     
+    # Merged Hydra and local client metadata, cached per client_id
+    client = None
+    if consent_request.client:
+        client = get_client_metadata(
+            consent_request.client.client_id,
+            hydra_client=hydra_client,
+            hydra_data=consent_request.client
+        )
+    
     return render(request, 'hydra_auth/consent.html', {
         'consent_challenge': consent_challenge,
-        'client': consent_request.client,
+        'hydra_cluster': cluster_from_request(request),
+        'client': client,
         'requested_scope': consent_request.requested_scope,
         'user': consent_request.subject,
+        'ask_remember': policy['consent_remember'] == OAuth2Client.REMEMBER_ASK,
     })
 
 def consent_reject(request):
@@ -135,12 +215,16 @@ def consent_reject(request):
     consent_challenge = request.GET.get('consent_challenge')
     if not consent_challenge:
         return HttpResponse('Consent challenge is missing', status=400)
+    hydra_client = _challenge_hydra_client(request)
+    if hydra_client is None:
+        return HttpResponse('Unknown Hydra cluster', status=400)
     
     reject_response = hydra_client.reject_consent_request(
         consent_challenge=consent_challenge,
         error="access_denied",
         error_description="The user rejected the consent request"
     )
+    audit.record(AuditEvent.CONSENT_REJECTED, request=request)
     
     return redirect(reject_response.redirect_to)
 
@@ -152,6 +236,9 @@ def logout_view(request):
     logout_challenge = request.GET.get('logout_challenge')
     if not logout_challenge:
         return HttpResponse('Logout challenge is missing', status=400)
+    hydra_client = _challenge_hydra_client(request)
+    if hydra_client is None:
+        return HttpResponse('Unknown Hydra cluster', status=400)
     
     # Fetch the logout request from Hydra
     logout_request = hydra_client.get_logout_request(logout_challenge)
@@ -167,15 +254,18 @@ def logout_view(request):
             
             # Accept the logout request
             accept_response = hydra_client.accept_logout_request(logout_challenge)
+            audit.record(AuditEvent.LOGOUT_ACCEPTED, logout_request.subject, request=request)
             return redirect(accept_response.redirect_to)
         else:
             # Reject the logout request
-            reject_response = hydra_client.reject_logout_request(
+            if not hydra_client.reject_logout_request(
                 logout_challenge=logout_challenge,
                 error="access_denied",
                 error_description="The user rejected the logout request"
-            )
-            return redirect(reject_response.redirect_to)
+            ):
+                return HttpResponse('Invalid logout challenge', status=400)
+            audit.record(AuditEvent.LOGOUT_REJECTED, logout_request.subject, request=request)
+            return redirect(_logout_rejected_url())
     
     return render(request, 'hydra_auth/logout.html', {
         'logout_challenge': logout_challenge,
@@ -190,14 +280,19 @@ def logout_reject(request):
     logout_challenge = request.GET.get('logout_challenge')
     if not logout_challenge:
         return HttpResponse('Logout challenge is missing', status=400)
+    hydra_client = _challenge_hydra_client(request)
+    if hydra_client is None:
+        return HttpResponse('Unknown Hydra cluster', status=400)
     
-    reject_response = hydra_client.reject_logout_request(
+    if not hydra_client.reject_logout_request(
         logout_challenge=logout_challenge,
         error="access_denied",
         error_description="The user rejected the logout request"
-    )
+    ):
+        return HttpResponse('Invalid logout challenge', status=400)
+    audit.record(AuditEvent.LOGOUT_REJECTED, request=request)
     
-    return redirect(reject_response.redirect_to)
+    return redirect(_logout_rejected_url())
 
 # OAuth2 Client Management views
 
@@ -206,44 +301,16 @@ def client_list(request):
     """
     List all OAuth2 clients.
     """
-    # Fetch clients from Hydra
-    hydra_clients = hydra_client.list_oauth2_clients()
-    
-    # Convert Hydra clients to Django model instances
     clients = []
-    for hc in hydra_clients:
-        # Create or update local model
-        client_model, created = OAuth2Client.objects.update_or_create(
-            client_id=hc.client_id,
-            defaults={
-                'client_name': hc.client_name or '',
-                'client_secret': hc.client_secret,
-            }
-        )
+    for cluster, hydra_client in get_router().all().items():
+        # Fetch clients from each Hydra cluster
+        hydra_clients = hydra_client.list_oauth2_clients()
         
-        # Update other fields
-        if hc.redirect_uris:
-            client_model.set_redirect_uris_list(hc.redirect_uris)
-        if hc.grant_types:
-            client_model.set_grant_types_list(hc.grant_types)
-        if hc.response_types:
-            client_model.set_response_types_list(hc.response_types)
-        client_model.scope = hc.scope or ''
-        client_model.token_endpoint_auth_method = hc.token_endpoint_auth_method or 'client_secret_basic'
-        if hc.audience:
-            client_model.set_audience_list(hc.audience)
-        client_model.client_uri = hc.client_uri
-        client_model.logo_uri = hc.logo_uri
-        if hc.contacts:
-            client_model.set_contacts_list(hc.contacts)
-        client_model.tos_uri = hc.tos_uri
-        client_model.policy_uri = hc.policy_uri
-        client_model.jwks_uri = hc.jwks_uri
-        client_model.allow_cors_requests = hc.allow_cors_requests or False
-        
-        # Save the updated model
-        client_model.save()
-        clients.append(client_model)
+        # Mirror them into the local database, skipping unchanged rows
+        cluster_clients, skipped = OAuth2Client.sync_from_hydra_clients(hydra_clients, cluster)
+        if skipped:
+            metrics.increment('hydra_client_writes_skipped', skipped, source='client_list')
+        clients.extend(cluster_clients)
     
     return render(request, 'hydra_auth/client_list.html', {
         'clients': clients
@@ -260,22 +327,14 @@ def client_create(request):
             # Create a new client model instance but don't save it yet
             client = form.save(commit=False)
             
-            # Convert form data to Hydra client format
-            client_data = client.to_hydra_dict()
-            
-            # Create client in Hydra
-            hydra_response = hydra_client.create_oauth2_client(client_data)
+            # Save locally and queue the Hydra creation in one transaction
+            with transaction.atomic():
+                # The primary key is set, so skip the UPDATE Django would try first
+                client.save(force_insert=True)
+                outbox.enqueue(client.client_id, HydraOutboxEntry.OPERATION_CREATE)
             
-            if hydra_response:
-                # Update the model with data from Hydra response
-                client.client_id = hydra_response.client_id
-                client.client_secret = hydra_response.client_secret
-                client.save()
-                
-                messages.success(request, f"Client '{client.client_name}' created successfully.")
-                return redirect('client_list')
-            else:
-                messages.error(request, "Failed to create client in Hydra.")
+            messages.success(request, f"Client '{client.client_name}' created and queued for synchronization with Hydra.")
+            return redirect('client_list')
     else:
         form = OAuth2ClientForm()
     
@@ -290,22 +349,22 @@ def client_update(request, client_id):
     """
     Update an existing OAuth2 client.
     """
-    # Get the client from Hydra
+    # Get the client from the Hydra cluster it lives on
+    hydra_client = get_router().for_client_id(client_id)
     hydra_client_obj = hydra_client.get_oauth2_client(client_id)
-    if not hydra_client_obj:
+    if hydra_client_obj:
+        # Refresh the local model from Hydra, writing only if it changed
+        clients, skipped = OAuth2Client.sync_from_hydra_clients([hydra_client_obj], hydra_client.cluster)
+        if skipped:
+            metrics.increment('hydra_client_writes_skipped', skipped, source='client_update')
+    else:
+        # The creation may still be waiting in the outbox
+        clients = list(OAuth2Client.objects.filter(client_id=client_id))
+    
+    if not clients:
         messages.error(request, f"Client with ID '{client_id}' not found.")
         return redirect('client_list')
-    
-    # Get or create the local model instance
-    client, created = OAuth2Client.objects.get_or_create(
-        client_id=client_id,
-        defaults={'client_name': hydra_client_obj.client_name or ''}
-    )
-    
-    # Update the local model with data from Hydra
-    if created or request.method != 'POST':
-        client = OAuth2Client.from_hydra_client(hydra_client_obj)
-        client.save()
+    client = clients[0]
     
     if request.method == 'POST':
         form = OAuth2ClientForm(request.POST, instance=client)
@@ -313,20 +372,18 @@ def client_update(request, client_id):
             # Update the model but don't save it yet
             updated_client = form.save(commit=False)
             
-            # Convert form data to Hydra client format
-            client_data = updated_client.to_hydra_dict()
-            
-            # Update client in Hydra
-            hydra_response = hydra_client.update_oauth2_client(client_id, client_data)
+            if updated_client.is_synced():
+                metrics.increment('hydra_client_writes_skipped', source='client_update')
+                messages.info(request, f"No changes detected for client '{updated_client.client_name}'.")
+                return redirect('client_list')
             
-            if hydra_response:
-                # Save the updated model
+            # Save locally and queue the Hydra update in one transaction
+            with transaction.atomic():
                 updated_client.save()
-                
-                messages.success(request, f"Client '{updated_client.client_name}' updated successfully.")
-                return redirect('client_list')
-            else:
-                messages.error(request, "Failed to update client in Hydra.")
+                outbox.enqueue(client_id, HydraOutboxEntry.OPERATION_UPDATE)
+            
+            messages.success(request, f"Client '{updated_client.client_name}' updated and queued for synchronization with Hydra.")
+            return redirect('client_list')
     else:
         form = OAuth2ClientForm(instance=client)
     
@@ -346,13 +403,11 @@ def client_delete(request, client_id):
     client = get_object_or_404(OAuth2Client, client_id=client_id)
     
     if request.method == 'POST':
-        # Delete the client from Hydra
-        if hydra_client.delete_oauth2_client(client_id):
-            # Delete the client from the database
+        # Delete locally and queue the Hydra deletion in one transaction
+        with transaction.atomic():
             client.delete()
-            messages.success(request, f"Client '{client.client_name}' deleted successfully.")
-        else:
-            messages.error(request, f"Failed to delete client '{client.client_name}' from Hydra.")
+            outbox.enqueue(client_id, HydraOutboxEntry.OPERATION_DELETE, client.hydra_cluster)
+        messages.success(request, f"Client '{client.client_name}' deleted and queued for removal from Hydra.")
         
         return redirect('client_list')
     
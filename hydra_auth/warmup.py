@@ -0,0 +1,152 @@
+"""
+Warm-up of a freshly started process before it reports ready.
+
+A new worker would otherwise take its first logins with cold connection
+pools, an unloaded URLconf (and so unimported views and ory_client models),
+uncompiled templates and empty client caches. warm_up() does all of that up
+front. The health probe runs it before its first check, so /readyz keeps
+answering "starting" until it is done; set HYDRA_WARMUP_ON_STARTUP to start
+the probe, and so the warm-up, from AppConfig.ready() instead of the first
+probe. `manage.py hydra_warmup` runs it on demand, which also fills the
+shared tier of the client metadata cache for other processes.
+
+Every step is best effort: a failure is logged and the next step runs.
+"""
+
+
+import time
+from datetime import timedelta
+
+import ory_client
+from django.conf import settings
+from django.contrib.auth.forms import AuthenticationForm
+from django.db.models import Count
+from django.template.loader import render_to_string
+from django.urls import get_resolver
+from django.utils import timezone
+
+from . import metrics
+from .client_cache import get_client_metadata
+from .executors import map_bounded
+from .models import AuditEvent, OAuth2Client
+from .routing import get_router
+
+_SAMPLE_CLIENT = {'client_id': 'warmup', 'client_name': 'Warm-up', 'scope': 'openid profile email'}
+
+
+def load_urls():
+    """
+    Import the URLconf, and with it the views and the Ory client.
+    """
+    get_resolver().url_patterns
+
+
+def load_models():
+    """
+    Decode a sample of each Hydra response read during a login.
+    """
+    ory_client.OAuth2LoginRequest.from_dict({
+        'challenge': 'warmup', 'client': _SAMPLE_CLIENT, 'request_url': 'http://hydra/oauth2/auth',
+        'requested_scope': ['openid'], 'requested_access_token_audience': [], 'skip': False, 'subject': '',
+    })
+    ory_client.OAuth2ConsentRequest.from_dict({
+        'challenge': 'warmup', 'client': _SAMPLE_CLIENT, 'requested_scope': ['openid'],
+        'requested_access_token_audience': [], 'skip': False, 'subject': 'warmup',
+    })
+    ory_client.OAuth2RedirectTo.from_dict({'redirect_to': 'http://hydra/oauth2/auth'})
+
+
+def render_templates():
+    """
+    Load and render the login, consent and logout pages once.
+    """
+    context = {'csrf_token': 'warmup', 'ask_remember': True}
+    render_to_string('hydra_auth/login.html', {**context, 'form': AuthenticationForm(), 'login_challenge': 'warmup'})
+    render_to_string('hydra_auth/consent.html', {
+        **context, 'consent_challenge': 'warmup', 'client': _SAMPLE_CLIENT,
+        'requested_scope': ['openid', 'profile'], 'user': 'warmup',
+    })
+    render_to_string('hydra_auth/logout.html', {**context, 'logout_challenge': 'warmup'})
+
+
+def open_connections(hydra_client, count, timeout=2):
+    """
+    Open up to count keep-alive connections to a cluster's admin API by
+    sending that many concurrent readiness checks.
+
+    Returns:
+        int: The number of checks that succeeded
+    """
+    count = min(count, hydra_client.admin_configuration.connection_pool_maxsize)
+    # One check first, so an unreachable cluster costs one failure, not
+    # enough to open its circuit breaker
+    if count < 1 or not hydra_client.is_ready(timeout):
+        return 0
+    checks = map_bounded(lambda _: hydra_client.is_ready(timeout), range(count - 1), count, name='warmup')
+    return 1 + sum(checks)
+
+
+def hot_client_ids(limit):
+    """
+    Get the clients with the most consents over the last day, topped up
+    with the most recently updated clients.
+    """
+    since = timezone.localdate() - timedelta(days=1)
+    client_ids = list(
+        AuditEvent.objects.filter(created_date__gte=since, event_type=AuditEvent.CONSENT_ACCEPTED)
+        .exclude(client_id='')
+        .values('client_id')
+        .annotate(events=Count('id'))
+        .order_by('-events')
+        .values_list('client_id', flat=True)[:limit]
+    )
+    if len(client_ids) < limit:
+        client_ids += OAuth2Client.objects.exclude(client_id__in=client_ids).order_by('-updated_at').values_list(
+            'client_id', flat=True
+        )[:limit - len(client_ids)]
+    return client_ids
+
+
+def preload_clients(limit):
+    """
+    Load the metadata of the hottest clients into both cache tiers.
+
+    Returns:
+        int: The number of clients loaded
+    """
+    router = get_router()
+    clients = OAuth2Client.objects.filter(client_id__in=hot_client_ids(limit)).only('client_id', 'hydra_cluster')
+    loaded = 0
+    for client in clients:
+        if get_client_metadata(client.client_id, hydra_client=router.for_client(client)) is not None:
+            loaded += 1
+    return loaded
+
+
+def warm_up():
+    """
+    Run every warm-up step.
+
+    Returns:
+        dict: Seconds taken by each step
+    """
+    connections = getattr(settings, 'HYDRA_WARMUP_CONNECTIONS', 8)
+    steps = [
+        ('urls', load_urls),
+        ('models', load_models),
+        ('templates', render_templates),
+    ]
+    for name, hydra_client in get_router().all().items():
+        steps.append((f'hydra:{name}', lambda hydra_client=hydra_client: open_connections(hydra_client, connections)))
+    steps.append(('clients', lambda: preload_clients(getattr(settings, 'HYDRA_WARMUP_CLIENTS', 100))))
+
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Exception when warming up {name}: {e}")
+        timings[name] = time.perf_counter() - start
+    metrics.set_gauge('hydra_warmup_seconds', sum(timings.values()))
+    return timings
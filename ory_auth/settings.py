@@ -3,6 +3,7 @@ Django settings for ory_auth project.
 """
 
 from pathlib import Path
+import json
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,13 +29,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'hydra_auth.health.HealthCheckMiddleware',
+    'hydra_auth.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'hydra_auth.admission.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'hydra_auth.protection.HydraTokenMiddleware',
 ]
 
 ROOT_URLCONF = 'ory_auth.urls'
@@ -61,7 +66,7 @@ WSGI_APPLICATION = 'ory_auth.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -94,5 +99,124 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Ory Hydra Configuration
+# http+unix://%2Fpath%2Fto.sock, h2:// and h2c:// URLs select other transports, see hydra_auth.transports
 HYDRA_ADMIN_URL = os.environ.get('HYDRA_ADMIN_URL', 'http://localhost:4445')
 HYDRA_PUBLIC_URL = os.environ.get('HYDRA_PUBLIC_URL', 'http://localhost:4444')
+HYDRA_CONNECTION_POOL_SIZE = int(os.environ.get('HYDRA_CONNECTION_POOL_SIZE', 32))
+
+# Seconds Hydra remembers logins and consents when a client's remember policy sets no duration
+HYDRA_LOGIN_REMEMBER_FOR = int(os.environ.get('HYDRA_LOGIN_REMEMBER_FOR', 3600))
+HYDRA_CONSENT_REMEMBER_FOR = int(os.environ.get('HYDRA_CONSENT_REMEMBER_FOR', 3600))
+
+# Where users go after declining to log out, Hydra gives no redirect for it
+HYDRA_LOGOUT_REJECTED_URL = os.environ.get('HYDRA_LOGOUT_REJECTED_URL', '/')
+
+# Hydra clusters as JSON: {"name": {"admin_url": ..., "public_url": ...}}, the first is the default.
+# New clients are placed by consistent hashing of their client_id unless pinned in HYDRA_CLUSTER_PINS.
+HYDRA_CLUSTERS = json.loads(os.environ.get('HYDRA_CLUSTERS', '{}')) or {
+    'default': {'admin_url': HYDRA_ADMIN_URL, 'public_url': HYDRA_PUBLIC_URL},
+}
+HYDRA_CLUSTER_PINS = json.loads(os.environ.get('HYDRA_CLUSTER_PINS', '{}'))
+
+# Calls to a Hydra endpoint fail fast after this many consecutive failures, for the reset timeout
+HYDRA_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('HYDRA_CIRCUIT_FAILURE_THRESHOLD', 5))
+HYDRA_CIRCUIT_RESET_TIMEOUT = int(os.environ.get('HYDRA_CIRCUIT_RESET_TIMEOUT', 30))
+
+# How client edits are sent to Hydra: 'patch' (changed fields only) or 'put'
+HYDRA_CLIENT_UPDATE_MODE = os.environ.get('HYDRA_CLIENT_UPDATE_MODE', 'patch')
+
+# Decode client listings into lightweight records instead of ory_client models
+HYDRA_RAW_RESPONSES = os.environ.get('HYDRA_RAW_RESPONSES', 'False') == 'True'
+
+# Outbox worker (python manage.py process_hydra_outbox --loop)
+HYDRA_OUTBOX_BATCH_SIZE = int(os.environ.get('HYDRA_OUTBOX_BATCH_SIZE', 100))
+HYDRA_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('HYDRA_OUTBOX_MAX_ATTEMPTS', 10))
+HYDRA_OUTBOX_RETRY_DELAY = int(os.environ.get('HYDRA_OUTBOX_RETRY_DELAY', 5))
+HYDRA_OUTBOX_LEASE_SECONDS = int(os.environ.get('HYDRA_OUTBOX_LEASE_SECONDS', 60))
+
+# Share in-flight Hydra reads across processes through this cache alias (optional)
+HYDRA_SINGLEFLIGHT_CACHE = os.environ.get('HYDRA_SINGLEFLIGHT_CACHE') or None
+
+# Cached client metadata for consent rendering (per-process LRU over this cache alias)
+HYDRA_CLIENT_CACHE = os.environ.get('HYDRA_CLIENT_CACHE', 'default')
+HYDRA_CLIENT_CACHE_TIMEOUT = int(os.environ.get('HYDRA_CLIENT_CACHE_TIMEOUT', 300))
+HYDRA_CLIENT_CACHE_LOCAL_SIZE = int(os.environ.get('HYDRA_CLIENT_CACHE_LOCAL_SIZE', 1024))
+HYDRA_CLIENT_CACHE_LOCAL_TTL = int(os.environ.get('HYDRA_CLIENT_CACHE_LOCAL_TTL', 30))
+
+# Deliver cache invalidations to every process (hydra_auth.invalidation), e.g.
+# hydra_auth.invalidation.PostgresNotifyBackend or hydra_auth.invalidation.CacheBackend
+HYDRA_INVALIDATION_BACKEND = os.environ.get('HYDRA_INVALIDATION_BACKEND') or None
+HYDRA_INVALIDATION_CACHE = os.environ.get('HYDRA_INVALIDATION_CACHE', 'default')
+HYDRA_INVALIDATION_INTERVAL = float(os.environ.get('HYDRA_INVALIDATION_INTERVAL', 0.5))
+
+# Bearer-token protection (hydra_auth.protection.HydraTokenMiddleware / token_required)
+HYDRA_TOKEN_PROTECTED_PATHS = [p for p in os.environ.get('HYDRA_TOKEN_PROTECTED_PATHS', '').split(',') if p]
+HYDRA_INTROSPECTION_CACHE_SIZE = int(os.environ.get('HYDRA_INTROSPECTION_CACHE_SIZE', 10000))
+HYDRA_INTROSPECTION_NEGATIVE_TTL = int(os.environ.get('HYDRA_INTROSPECTION_NEGATIVE_TTL', 60))
+
+# 'auto' verifies JWT access tokens locally against Hydra's JWKS and introspects opaque ones
+HYDRA_TOKEN_VERIFICATION = os.environ.get('HYDRA_TOKEN_VERIFICATION', 'auto')
+HYDRA_JWT_AUDIENCE = os.environ.get('HYDRA_JWT_AUDIENCE') or None
+HYDRA_JWKS_CACHE_TTL = int(os.environ.get('HYDRA_JWKS_CACHE_TTL', 300))
+
+# client_credentials tokens for outgoing calls (hydra_auth.tokens), shared through this cache alias
+HYDRA_TOKEN_CACHE = os.environ.get('HYDRA_TOKEN_CACHE', 'default')
+HYDRA_TOKEN_REFRESH_MARGIN = int(os.environ.get('HYDRA_TOKEN_REFRESH_MARGIN', 60))
+HYDRA_TOKEN_CACHE_LOCAL_SIZE = int(os.environ.get('HYDRA_TOKEN_CACHE_LOCAL_SIZE', 1024))
+
+# Password verification executor used by the login view (workers default to the CPU count)
+HYDRA_PASSWORD_WORKERS = int(os.environ.get('HYDRA_PASSWORD_WORKERS', 0)) or None
+HYDRA_PASSWORD_QUEUE_SIZE = int(os.environ.get('HYDRA_PASSWORD_QUEUE_SIZE', 32))
+
+# Adaptive admission control for the challenge endpoints (URL names from hydra_auth/urls.py)
+HYDRA_ADMISSION_ROUTES = ['login', 'consent']
+HYDRA_ADMISSION_INITIAL_LIMIT = int(os.environ.get('HYDRA_ADMISSION_INITIAL_LIMIT', 20))
+HYDRA_ADMISSION_MAX_LIMIT = int(os.environ.get('HYDRA_ADMISSION_MAX_LIMIT', 200))
+HYDRA_ADMISSION_TARGET_LATENCY = float(os.environ.get('HYDRA_ADMISSION_TARGET_LATENCY', 0.25))
+
+# Parallel Hydra calls for bulk session revocation (python manage.py revoke_hydra_sessions)
+HYDRA_REVOCATION_CONCURRENCY = int(os.environ.get('HYDRA_REVOCATION_CONCURRENCY', 16))
+
+# Client revocations the admin action may queue for the background worker
+HYDRA_REVOCATION_QUEUE_SIZE = int(os.environ.get('HYDRA_REVOCATION_QUEUE_SIZE', 16))
+
+# /healthz and /readyz (readiness is probed in the background, never per request)
+HYDRA_HEALTH_PROBE_INTERVAL = float(os.environ.get('HYDRA_HEALTH_PROBE_INTERVAL', 5))
+HYDRA_HEALTH_MAX_AGE = float(os.environ.get('HYDRA_HEALTH_MAX_AGE', 15))
+
+# Warm-up before the first readiness report (hydra_auth.warmup). Enable HYDRA_WARMUP_ON_STARTUP
+# only in the environment of the app server, management commands would start it too.
+HYDRA_WARMUP_ENABLED = os.environ.get('HYDRA_WARMUP_ENABLED', 'True') == 'True'
+HYDRA_WARMUP_ON_STARTUP = os.environ.get('HYDRA_WARMUP_ON_STARTUP', 'False') == 'True'
+HYDRA_WARMUP_CONNECTIONS = int(os.environ.get('HYDRA_WARMUP_CONNECTIONS', 8))
+HYDRA_WARMUP_CLIENTS = int(os.environ.get('HYDRA_WARMUP_CLIENTS', 100))
+
+# Sampling profiler: send the header printed by `python manage.py hydra_profile_token`,
+# or profile a random share of requests under HYDRA_PROFILE_PATHS
+HYDRA_PROFILE_SAMPLE_RATE = float(os.environ.get('HYDRA_PROFILE_SAMPLE_RATE', 0.0))
+HYDRA_PROFILE_DIR = os.environ.get('HYDRA_PROFILE_DIR', BASE_DIR / 'profiles')
+HYDRA_PROFILE_INTERVAL = float(os.environ.get('HYDRA_PROFILE_INTERVAL', 0.005))
+
+# Client secret rotation (python manage.py rotate_client_secrets)
+HYDRA_SECRET_EXPORT_KEY = os.environ.get('HYDRA_SECRET_EXPORT_KEY')
+# Where the admin action writes exports, required for it and best kept outside the project tree
+HYDRA_SECRET_EXPORT_DIR = os.environ.get('HYDRA_SECRET_EXPORT_DIR') or None
+HYDRA_SECRET_ROTATION_GRACE = int(os.environ.get('HYDRA_SECRET_ROTATION_GRACE', 86400))
+HYDRA_ROTATION_CONCURRENCY = int(os.environ.get('HYDRA_ROTATION_CONCURRENCY', 8))
+
+# Admin lists above this many rows are paginated on the database's row estimate
+HYDRA_ADMIN_COUNT_ESTIMATE_THRESHOLD = int(os.environ.get('HYDRA_ADMIN_COUNT_ESTIMATE_THRESHOLD', 10000))
+
+# Buffered audit log of login, consent and logout decisions
+HYDRA_AUDIT_ENABLED = os.environ.get('HYDRA_AUDIT_ENABLED', 'True') == 'True'
+HYDRA_AUDIT_BUFFER_SIZE = int(os.environ.get('HYDRA_AUDIT_BUFFER_SIZE', 500))
+HYDRA_AUDIT_FLUSH_INTERVAL = float(os.environ.get('HYDRA_AUDIT_FLUSH_INTERVAL', 2.0))
+# Events held in memory before the oldest are spilled to the fallback file (default 10 buffers)
+HYDRA_AUDIT_MAX_BUFFERED = int(os.environ.get('HYDRA_AUDIT_MAX_BUFFERED', 0)) or None
+HYDRA_AUDIT_FALLBACK_PATH = os.environ.get('HYDRA_AUDIT_FALLBACK_PATH', BASE_DIR / 'audit-fallback.jsonl')
+
+# Claims added to ID and access tokens on consent, per granted scope
+HYDRA_CLAIMS_PROVIDERS = {
+    'profile': ['hydra_auth.claims.profile_claims'],
+    'email': ['hydra_auth.claims.email_claims'],
+}